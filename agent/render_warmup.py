@@ -0,0 +1,19 @@
+"""
+Imported by the consumer's fork server (helper/worker_pool.py) before it forks render workers:
+loads the render stack, compiles the graph and warms WeasyPrint/fonts/templates once, so every
+worker starts warm and shares these pages copy-on-write.
+"""
+import gc
+
+from agent.report_generator_agent import AgentReportGenerator
+from config.logging import logger
+
+try:
+    AgentReportGenerator().warm_up()
+except Exception as e:
+    # Workers still render, they just pay the warm-up on their first report
+    logger.warning(f"Render warm-up failed: {str(e)}")
+
+# Move everything allocated so far out of the GC's reach, so collections in the
+# workers don't write to (and un-share) the inherited pages
+gc.freeze()
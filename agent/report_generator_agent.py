@@ -8,7 +8,6 @@ import os
 import uuid
 import subprocess
 import platform
-import requests
 import io
 import fitz  # PyMuPDF
 from typing import Tuple
@@ -26,8 +25,63 @@ from service.translate_service import TranslateService
 import string
 from service.misc_service import MiscService
 from helper.common import download_from_gcs
+from helper.attachment_fetcher import AttachmentFetcher
+from helper.asset_bundle import AssetBundle
+from helper.metrics import metrics
+from helper.section_cache import SectionCache, section_key, template_fingerprint
+from service.customize_variable_service import build_report_branding
+from service.report_status_writer import ReportStatusWriter
 
 LOG_SIZE = 100
+# Page-broken sections of reports.html, in document order, with the template variables each
+# one renders from (besides the shared identity/header/footer/placeholder inputs)
+REPORT_SECTIONS = [
+    ("prescreening", ["prescreening_test_data"]),
+    ("physical_examination", ["physical_examination_data"]),
+    ("vital_signs", ["vital_signs_data"]),
+    ("conclusions", ["conclusions_data", "advice_data", "analysis_data", "dokter_pemeriksa_data"]),
+    ("laboratory", ["lab_header_data", "lab_section_data", "penanggung_jawab_lab_data", "diperiksa_oleh_data"]),
+    ("electromedical", ["electromedical_data"]),
+    ("attachments", ["electromedical_data", "vector_attachment_box"]),
+]
+REPORT_SHARED_INPUTS = ["patient_data", "placeholder", "header_image_url", "footer_image_url"]
+# Output options, overridable per report with patient_data["render_options"]. WeasyPrint already
+# subsets fonts unless full_fonts is set; dpi caps embedded images (header, footer, attachments)
+# and 0 keeps them at source resolution
+REPORT_RENDER_OPTIONS = {
+    "optimize_images": os.getenv('REPORT_PDF_OPTIMIZE_IMAGES', 'true').lower() == 'true',
+    "jpeg_quality": int(os.getenv('REPORT_PDF_JPEG_QUALITY', 85)),
+    "dpi": int(os.getenv('REPORT_PDF_DPI', 150)),
+    "full_fonts": os.getenv('REPORT_PDF_FULL_FONTS', 'false').lower() == 'true',
+    "uncompressed_pdf": os.getenv('REPORT_PDF_UNCOMPRESSED', 'false').lower() == 'true',
+    # PDF attachments: image (rasterised, embedded with <img>) or vector (source page placed into
+    # the rendered report with PyMuPDF, no rasterisation)
+    "attachment_mode": os.getenv('REPORT_ATTACHMENT_MODE', 'image').lower(),
+    # Encoding of rasterised attachment pages: jpeg or png
+    "attachment_image_format": os.getenv('REPORT_ATTACHMENT_IMAGE_FORMAT', 'jpeg').lower(),
+    "attachment_jpeg_quality": int(os.getenv('REPORT_ATTACHMENT_JPEG_QUALITY', 85)),
+}
+# Box (CSS px) reserved on the attachment page for a vector attachment: the content width
+# (A4 minus the 80px side padding of print.css) by the height the <img> was capped at
+VECTOR_ATTACHMENT_BOX_PX = (634, 720)
+CSS_PX_TO_PT = 0.75
+# Graph nodes grouped by the pipeline stage of report_consumer that runs them: prepare is I/O
+# (database, attachment downloads) plus formatting, render is the CPU-bound WeasyPrint layout,
+# upload is I/O (GCS, status update)
+REPORT_STAGES = {
+    "prepare": [
+        "setup_customize_variable",
+        "formatting_patient_data",
+        "formatting_prescreening_test_data",
+        "formatting_physical_examination_data",
+        "formatting_vital_signs_data",
+        "formatting_conclusions_advice_data",
+        "formatting_lab_section_data",
+        "formatting_electromedical_data",
+    ],
+    "render": ["generate_report"],
+    "upload": ["uploadcleanup"],
+}
 class CustomizeVariableReport(TypedDict):
     """Customize variable report"""
     header_image_url: Optional[str]
@@ -71,38 +125,138 @@ class _ReportGeneratorState(TypedDict):
 @singleton
 class AgentReportGenerator:
     def __init__(self):
-        # Define state schema
-        self.state_graph = StateGraph(_ReportGeneratorState)
-        
         # Add nodes - removing the reference to _load_patient_data
-        self.state_graph.add_node("setup_customize_variable", self._setup_customize_variable)
-        self.state_graph.add_node("formatting_patient_data", self._formatting_patient_data)
-        self.state_graph.add_node("formatting_prescreening_test_data", self._formatting_prescreening_test_data)
-        self.state_graph.add_node("formatting_physical_examination_data", self._formatting_physical_examination_data)
-        self.state_graph.add_node("formatting_vital_signs_data", self._formatting_vital_signs_data)
-        self.state_graph.add_node("formatting_conclusions_advice_data", self._formatting_conclusions_advice_data)
-        self.state_graph.add_node("formatting_lab_section_data", self._formatting_lab_section_data)
-        self.state_graph.add_node("formatting_electromedical_data", self._formatting_electromedical_data)
-        self.state_graph.add_node("generate_report", self._generate_report)
-        self.state_graph.add_node("uploadcleanup", self._upload_cleanup_files)
-        
-        # Define edges - starting directly from generate_report
-        self.state_graph.add_edge(START, "setup_customize_variable")
-        self.state_graph.add_edge("setup_customize_variable", "formatting_patient_data")
-        self.state_graph.add_edge("formatting_patient_data", "formatting_prescreening_test_data")
-        self.state_graph.add_edge("formatting_prescreening_test_data", "formatting_physical_examination_data")
-        self.state_graph.add_edge("formatting_physical_examination_data", "formatting_vital_signs_data")
-        self.state_graph.add_edge("formatting_vital_signs_data", "formatting_conclusions_advice_data")
-        self.state_graph.add_edge("formatting_conclusions_advice_data", "formatting_lab_section_data")
-        self.state_graph.add_edge("formatting_lab_section_data", "formatting_electromedical_data")
-        self.state_graph.add_edge("formatting_electromedical_data", "generate_report")
-        # self.state_graph.add_edge("generate_report", END)
-
-        self.state_graph.add_edge("generate_report", "uploadcleanup")
-        self.state_graph.add_edge("uploadcleanup", END)
-                
-        # Compile the graph
-        self.chain = self.state_graph.compile()
+        self.nodes = {
+            "setup_customize_variable": self._setup_customize_variable,
+            "formatting_patient_data": self._formatting_patient_data,
+            "formatting_prescreening_test_data": self._formatting_prescreening_test_data,
+            "formatting_physical_examination_data": self._formatting_physical_examination_data,
+            "formatting_vital_signs_data": self._formatting_vital_signs_data,
+            "formatting_conclusions_advice_data": self._formatting_conclusions_advice_data,
+            "formatting_lab_section_data": self._formatting_lab_section_data,
+            "formatting_electromedical_data": self._formatting_electromedical_data,
+            "generate_report": self._generate_report,
+            "uploadcleanup": self._upload_cleanup_files,
+        }
+
+        # The whole report in one graph (run_with_data), and one graph per stage for the
+        # consumer's pipeline (prepare_report, render_prepared, upload_report)
+        self.chain = self._compile_chain([node for stage in REPORT_STAGES.values() for node in stage])
+        self.stage_chains = {stage: self._compile_chain(node_names) for stage, node_names in REPORT_STAGES.items()}
+
+        # Templates and the print stylesheet are parsed once per process, not once per report
+        self.template_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+        self.jinja_env = Environment(loader=FileSystemLoader(self.template_dir), auto_reload=False)
+        self.print_css = CSS(os.path.join(self.template_dir, "print.css"))
+        self.section_cache = SectionCache()
+        self.template_fingerprint = template_fingerprint(self.template_dir) if self.section_cache.enabled else None
+
+    def warm_up(self) -> None:
+        """Load the report template and lay out a tiny document so fonts and Pango are initialised"""
+        started_at = time.time()
+        self.jinja_env.get_template('reports.html')
+        HTML(string="<p>warm-up</p>", base_url=self.template_dir).render(stylesheets=[self.print_css])
+        # Decodes the bundled header/footer/signature images for the default options
+        self._render_image_options(self._pdf_write_options(REPORT_RENDER_OPTIONS))
+        logger.info(f"Render stack warmed up in {time.time() - started_at:.2f} seconds")
+
+    @staticmethod
+    def _render_options(state: _ReportGeneratorState) -> Dict:
+        """REPORT_RENDER_OPTIONS with the report's own overrides (unknown keys are ignored)"""
+        overrides = state["patient_data"].get("render_options") or {}
+        return {key: overrides.get(key, default) for key, default in REPORT_RENDER_OPTIONS.items()}
+
+    @staticmethod
+    def _render_image_options(pdf_write_options: Dict) -> Dict:
+        """
+        Image options for WeasyPrint's render: images are decoded (and downsampled/recompressed)
+        at layout time, so write_pdf alone does not apply them. Includes the shared image cache.
+        """
+        image_options = {key: pdf_write_options[key] for key in ("optimize_images", "jpeg_quality", "dpi")}
+        return {**image_options, "cache": AssetBundle().image_cache(image_options)}
+
+    @staticmethod
+    def _pdf_write_options(render_options: Dict) -> Dict:
+        """Keyword arguments for WeasyPrint's write_pdf"""
+        return {
+            "optimize_images": render_options["optimize_images"],
+            "jpeg_quality": render_options["jpeg_quality"],
+            "dpi": render_options["dpi"] or None,
+            "full_fonts": render_options["full_fonts"],
+            "uncompressed_pdf": render_options["uncompressed_pdf"],
+        }
+
+    def _compile_chain(self, node_names: List[str]):
+        """Compile a graph running `node_names` one after the other"""
+        state_graph = StateGraph(_ReportGeneratorState)
+        previous = START
+        for node_name in node_names:
+            # Every node is wrapped so its duration is recorded in the metrics registry
+            state_graph.add_node(node_name, self._instrumented_node(node_name, self.nodes[node_name]))
+            state_graph.add_edge(previous, node_name)
+            previous = node_name
+        state_graph.add_edge(previous, END)
+        return state_graph.compile()
+
+    def _instrumented_node(self, node_name: str, node):
+        """Wrap a graph node so its duration is recorded per node"""
+        def instrumented(state: _ReportGeneratorState) -> _ReportGeneratorState:
+            with metrics.timer("report_node_duration_seconds", node=node_name):
+                return node(state)
+        return instrumented
+
+    @staticmethod
+    def _initial_state(patient_data: Dict) -> _ReportGeneratorState:
+        # Initialize state with provided data
+        customize_variable_report = CustomizeVariableReport(
+            header_image_url=None,
+            footer_image_url=None,
+            penanggung_jawab_hasil=None,
+            perujuk_lab=None,
+            terms_analisis_fit=None,
+            dokter_internal=None,
+            penanggung_jawab_hasil_signature_url=None,
+            dokter_internal_signature_url=None,
+            perujuk_lab_signature_url=None,
+        )
+
+        return {
+            "patient_id": patient_data['patient_id'],
+            "patient_data": patient_data,
+            "file_path": None,
+            "url_file_path": "",
+            "files": None,
+            "error": None,
+            "customize_variable_report": customize_variable_report,
+            "need_to_cleaned_file": []
+        }
+
+    @staticmethod
+    def _checked(state: _ReportGeneratorState) -> _ReportGeneratorState:
+        if state.get("error"):
+            raise Exception(state["error"])
+        return state
+
+    def prepare_report(self, patient_data: Dict) -> _ReportGeneratorState:
+        """Pipeline stage 1: customize variables, formatting and attachment downloads"""
+        logger.info(f"Preparing report for patient {patient_data['patient_id']}")
+        return self._checked(self.stage_chains["prepare"].invoke(self._initial_state(patient_data)))
+
+    def render_prepared(self, state: _ReportGeneratorState) -> _ReportGeneratorState:
+        """Pipeline stage 2: lay out and write the PDF of a prepared report"""
+        return self._checked(self.stage_chains["render"].invoke(state))
+
+    def upload_report(self, state: _ReportGeneratorState) -> str:
+        """Pipeline stage 3: upload the rendered PDF, record it and clean up; returns its URL"""
+        return self._checked(self.stage_chains["upload"].invoke(state))["url_file_path"]
+
+    def cleanup_files(self, state: _ReportGeneratorState) -> None:
+        """Remove the work files of a report that did not reach the upload stage"""
+        for file in state.get("need_to_cleaned_file") or []:
+            root_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            file_path = os.path.join(root_folder, file)
+            if os.path.exists(file_path):
+                os.remove(file_path)
 
     def run_with_data(self, patient_data: Dict) -> str:
         """Run the report generation process with provided patient data"""
@@ -110,43 +264,18 @@ class AgentReportGenerator:
         logger.info(f"Starting report generation for patient {patient_data['patient_id']}")
         
         try:
-            # Initialize state with provided data
-            customize_variable_report = CustomizeVariableReport(
-                header_image_url=None,
-                footer_image_url=None,
-                penanggung_jawab_hasil=None,
-                perujuk_lab=None,
-                terms_analisis_fit=None,
-                dokter_internal=None,
-                penanggung_jawab_hasil_signature_url=None,
-                dokter_internal_signature_url=None,
-                perujuk_lab_signature_url=None,
-            )
-            
-            state: _ReportGeneratorState = {
-                "patient_id": patient_data['patient_id'],
-                "patient_data": patient_data,
-                "file_path": None,
-                "url_file_path": "",
-                "files": None,
-                "error": None,
-                "customize_variable_report": customize_variable_report,
-                "need_to_cleaned_file": []
-            }
-            
             # Run the graph
-            final_state = self.chain.invoke(state)
-            
-            if final_state.get("error"):
-                raise Exception(final_state["error"])
+            final_state = self._checked(self.chain.invoke(self._initial_state(patient_data)))
             
             execution_time = time.time() - start_time
+            metrics.observe("report_total_duration_seconds", execution_time, outcome="success")
             logger.info(f"Report generation completed in {execution_time:.2f} seconds")
             logger.info(f"URL file path: {final_state['url_file_path']}")
             
             return final_state["url_file_path"]
             
         except Exception as e:
+            metrics.observe("report_total_duration_seconds", time.time() - start_time, outcome="error")
             logger.error(f"Error generating report: {str(e)}")
             raise
 
@@ -157,74 +286,32 @@ class AgentReportGenerator:
         language = state["patient_data"]["language"]
 
         try:
-            # Get customize variable report
+            # Get customize variable report (the consumer passes the appointment's cached variables)
             get_customize_variable_report_query = """
                 SELECT bacv.key, bacv.value FROM b2b_bumame_appointment_customize_variable bacv
                 LEFT JOIN b2b_bumame_appointment_patient bap ON bacv.appointment_id = bap.appointment_id
                 WHERE bap.id = %s AND bap.is_deleted = 0 AND bacv.is_deleted = 0
             """
             try:
-                customize_variable_report = db_postgres.fetch_query(get_customize_variable_report_query, (state["patient_data"]["patient_id"],))
-                if customize_variable_report:
-                    for row in customize_variable_report:
-                        # Access tuple elements by index: row[0] = key, row[1] = value
-                        state["customize_variable_report"][row[0]] = row[1]
-                        logger.info(f"Customize variable report: {row[0]} = {row[1]}")
-                
-                current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-                assets_dir = os.path.join(current_dir, "assets")
-
-                if state["customize_variable_report"].get("header_image_url") is not None:
-                    state["customize_variable_report"]["header_image_url"] = state["customize_variable_report"]["header_image_url"]
-                else:
-                    state["customize_variable_report"]["header_image_url"] = os.path.join(assets_dir, "top-bumame.png")
-
-                logger.info(f"Header image URL: {state['customize_variable_report']['header_image_url']}")
-
-                if state["customize_variable_report"].get("footer_image_url") is not None:
-                    state["customize_variable_report"]["footer_image_url"] = state["customize_variable_report"]["footer_image_url"]
-                else:
-                    state["customize_variable_report"]["footer_image_url"] = os.path.join(assets_dir, "bottom-bumame.png")
-
-                dokter_pemeriksa_data = {
-                    "name": "dr. Muhammad Reza Kurniawan",
-                    "title": get_text("examining_doctor", language),
-                    "signature_url": os.path.join(assets_dir, "internal_reza_signature.png")
-                }
-                penanggung_jawab_lab_data = {
-                    "name": "dr. Dwi Utomo Nusantara, Sp. PK",
-                    "title": get_text("laboratory_supervisor", language),
-                    "signature_url": os.path.join(assets_dir, "penanggung_jawab_dwi_utomo_signature.jpg")
-                }
-                diperiksa_oleh_data = {
-                    "name": "Yaufita Lokananta",
-                    "title": get_text("examined_by", language),
-                    "signature_url": os.path.join(assets_dir, "pemeriksa_yaufita_signature.jpg")
-                }
-
-                if state["customize_variable_report"].get("dokter_internal_signature_url") is not None:
-                    dokter_pemeriksa_data["signature_url"] = state["customize_variable_report"]["dokter_internal_signature_url"]
-        
-                if state["customize_variable_report"].get("dokter_internal") is not None:
-                    dokter_pemeriksa_data["name"] = state["customize_variable_report"]["dokter_internal"]
-
-                if state["customize_variable_report"].get("penanggung_jawab_hasil") is not None:
-                    penanggung_jawab_lab_data["name"] = state["customize_variable_report"]["penanggung_jawab_hasil"]
-
-                if state["customize_variable_report"].get("perujuk_lab") is not None:
-                    diperiksa_oleh_data["name"] = state["customize_variable_report"]["perujuk_lab"]
-
-                if state["customize_variable_report"].get("penanggung_jawab_hasil_signature_url") is not None:
-                    penanggung_jawab_lab_data["signature_url"] = state["customize_variable_report"]["penanggung_jawab_hasil_signature_url"]
-
-                if state["customize_variable_report"].get("perujuk_lab_signature_url") is not None:
-                    diperiksa_oleh_data["signature_url"] = state["customize_variable_report"]["perujuk_lab_signature_url"]
-
-                state["formatted_dokter_pemeriksa_data"] = dokter_pemeriksa_data
-                state["formatted_penanggung_jawab_lab_data"] = penanggung_jawab_lab_data
-                state["formatted_diperiksa_oleh_data"] = diperiksa_oleh_data
-                state["header_image_url"] = state["customize_variable_report"].get("header_image_url")
-                state["footer_image_url"] = state["customize_variable_report"].get("footer_image_url")
+                customize_variables = state["patient_data"].get("customize_variables")
+                if customize_variables is None:
+                    customize_variable_report = db_postgres.fetch_query(get_customize_variable_report_query, (state["patient_data"]["patient_id"],))
+                    # Access tuple elements by index: row[0] = key, row[1] = value
+                    customize_variables = {row[0]: row[1] for row in customize_variable_report or []}
+                for key, value in customize_variables.items():
+                    state["customize_variable_report"][key] = value
+                    logger.debug(f"Customize variable report: {key}", extra={"sample_rate": None})
+
+                branding = build_report_branding(state["customize_variable_report"], language)
+                state["customize_variable_report"]["header_image_url"] = branding["header_image_url"]
+                state["customize_variable_report"]["footer_image_url"] = branding["footer_image_url"]
+                logger.info(f"Header image URL: {branding['header_image_url']}")
+
+                state["formatted_dokter_pemeriksa_data"] = branding["dokter_pemeriksa_data"]
+                state["formatted_penanggung_jawab_lab_data"] = branding["penanggung_jawab_lab_data"]
+                state["formatted_diperiksa_oleh_data"] = branding["diperiksa_oleh_data"]
+                state["header_image_url"] = branding["header_image_url"]
+                state["footer_image_url"] = branding["footer_image_url"]
 
 
                 logger.info(f"Get customize variable report for patient {state['patient_data']['appointment_id']}")
@@ -588,7 +675,6 @@ class AgentReportGenerator:
                         })
             else:
                 for lab_data_key, lab_data_value in lab_section_data.items():
-                    print(lab_data_value)
                     sections_name = translate_service.lab_label(lab_data_value["name"], language)
                     subsections_data = lab_data_value["subsections"]
 
@@ -616,6 +702,7 @@ class AgentReportGenerator:
             electromedical_data = state["patient_data"]["electromedical_examination"]
             translate_service = TranslateService()
             language = state["patient_data"]["language"]
+            render_options = self._render_options(state)
 
             formatted_electromedical_data = []
 
@@ -691,19 +778,28 @@ class AgentReportGenerator:
                 downloaded_url_image = url_image
                 new_width = 0
                 max_height = 0
+                vector_attachment = None
                 if url_image != "" and url_image != None:
                     if key_electromedical_data == "audiometri":
                         downloaded_url_image = url_image
                     else:
                         logger.info(f"Downloading and converting PDF to image: {key_electromedical_data}")
                         
-                        if "drive.google.com" in url_image:
-                            downloaded_url_image, new_width, max_height = self.download_and_convert_pdf_to_image(url_image)
+                        if "drive.google.com" in url_image and render_options["attachment_mode"] == "vector":
+                            vector_attachment = self.download_attachment_pdf(url_image, key_electromedical_data)
+                            downloaded_url_image = vector_attachment["pdf_path"]
+                            clip = vector_attachment["clip"]
+                            new_width, max_height = clip[2] - clip[0], clip[3] - clip[1]
+                        elif "drive.google.com" in url_image:
+                            downloaded_url_image, new_width, max_height = self.download_and_convert_pdf_to_image(
+                                url_image, key_electromedical_data, render_options
+                            )
                         else:
                             bucket_name = url_image.split("/")[3]
                             source_blob_name = "/".join(url_image.split("/")[4:])
                             logger.info(f"Downloading from GCS: {bucket_name}, {source_blob_name}")
-                            downloaded_url_image = download_from_gcs(bucket_name, source_blob_name)
+                            with metrics.timer("attachment_download_duration_seconds", attachment_type=key_electromedical_data, source="gcs"):
+                                downloaded_url_image = download_from_gcs(bucket_name, source_blob_name)
 
                         state["need_to_cleaned_file"].append(downloaded_url_image)
                         # get root folder
@@ -716,12 +812,14 @@ class AgentReportGenerator:
                     "key": key_electromedical_data,
                     "title": get_text(f"electromedical_label_{key_electromedical_data}", language),
                     "data": items_data,
-                    "url": downloaded_url_image,
+                    "url": "" if vector_attachment else downloaded_url_image,
                     "diagnosis": diagnosa_audiometri,
                     "is_landscape": new_width > max_height,
+                    # Vector mode: the source page is placed after rendering, see _place_vector_attachments
+                    "vector_attachment": vector_attachment,
                 })
             
-            logger.info(f"Formatted electromedical data: {formatted_electromedical_data}")
+            logger.info(f"Formatted electromedical data: {[item['key'] for item in formatted_electromedical_data]}")
 
             state["formatted_electromedical_data"] = formatted_electromedical_data
         except Exception as e:
@@ -736,9 +834,7 @@ class AgentReportGenerator:
         logger.info(f"Generating report for patient {state['patient_data']['appointment_id']}/{state['patient_data']['patient_id']}")
         """Generate PDF report and upload directly to GCS"""
         try:            
-            # Set up Jinja2 environment
-            template_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
-            env = Environment(loader=FileSystemLoader(template_dir))
+            template_dir = self.template_dir
 
             language = state["patient_data"]["language"]
 
@@ -772,9 +868,25 @@ class AgentReportGenerator:
                 'location': get_text("specimen_location", language),
             }
             
-            # Load and render the main template
-            template = env.get_template('reports.html')
-            html_content = template.render(patient_data=state["formatted_patient_data"], prescreening_test_data=state["formatted_prescreening_test_data"], physical_examination_data=state["formatted_physical_examination_data"], vital_signs_data=state["formatted_vital_signs_data"], conclusions_data=state["formatted_conclusions_data"], advice_data=state["formatted_advice_data"], analysis_data=state["formatted_analysis_data"], lab_header_data=state["formatted_lab_header_data"], lab_section_data=state["formatted_lab_section_data"], electromedical_data=state["formatted_electromedical_data"], dokter_pemeriksa_data=state["formatted_dokter_pemeriksa_data"], penanggung_jawab_lab_data=state["formatted_penanggung_jawab_lab_data"], diperiksa_oleh_data=state["formatted_diperiksa_oleh_data"], header_image_url=state["header_image_url"], footer_image_url=state["footer_image_url"], placeholder=placeholder_string)
+            template_context = {
+                "patient_data": state["formatted_patient_data"],
+                "prescreening_test_data": state["formatted_prescreening_test_data"],
+                "physical_examination_data": state["formatted_physical_examination_data"],
+                "vital_signs_data": state["formatted_vital_signs_data"],
+                "conclusions_data": state["formatted_conclusions_data"],
+                "advice_data": state["formatted_advice_data"],
+                "analysis_data": state["formatted_analysis_data"],
+                "lab_header_data": state["formatted_lab_header_data"],
+                "lab_section_data": state["formatted_lab_section_data"],
+                "electromedical_data": state["formatted_electromedical_data"],
+                "dokter_pemeriksa_data": state["formatted_dokter_pemeriksa_data"],
+                "penanggung_jawab_lab_data": state["formatted_penanggung_jawab_lab_data"],
+                "diperiksa_oleh_data": state["formatted_diperiksa_oleh_data"],
+                "header_image_url": state["header_image_url"],
+                "footer_image_url": state["footer_image_url"],
+                "placeholder": placeholder_string,
+                "vector_attachment_box": VECTOR_ATTACHMENT_BOX_PX,
+            }
 
             patient_name = state["patient_data"]["identity"]["basic_info"][1][1]
             company_name = state["patient_data"]["company"]
@@ -787,11 +899,20 @@ class AgentReportGenerator:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"{appointment_id}_{appointment_patient_id}_{safe_patient_name}_{safe_company_name}_{timestamp}"
 
-            # Convert to PDF using WeasyPrint
-            HTML(string=html_content, base_url=template_dir).write_pdf(
-                f"tmp/{filename}.pdf",
-                stylesheets=[CSS("templates/print.css")]
-            )
+            pdf_write_options = self._pdf_write_options(self._render_options(state))
+            if self.section_cache.enabled:
+                self._render_sections(template_context, f"tmp/{filename}.pdf", pdf_write_options)
+            else:
+                # Convert to PDF using WeasyPrint, timing layout and serialisation separately
+                html_content = self.jinja_env.get_template('reports.html').render(**template_context)
+                with metrics.timer("pdf_layout_duration_seconds"):
+                    document = HTML(string=html_content, base_url=template_dir).render(
+                        stylesheets=[self.print_css], **self._render_image_options(pdf_write_options)
+                    )
+                with metrics.timer("pdf_write_duration_seconds"):
+                    document.write_pdf(f"tmp/{filename}.pdf", **pdf_write_options)
+                self._place_vector_attachments(document, f"tmp/{filename}.pdf", template_context["electromedical_data"], pdf_write_options)
+            metrics.observe("pdf_size_bytes", os.path.getsize(f"tmp/{filename}.pdf"))
             
             state["need_to_cleaned_file"].append(f"tmp/{filename}.pdf")
             state["file_path"] = f"tmp/{filename}.pdf"
@@ -801,6 +922,94 @@ class AgentReportGenerator:
             logger.error(f"Error generating report: {str(e)}")
             raise
 
+    @staticmethod
+    def _present_sections(template_context: Dict) -> List[str]:
+        """Sections reports.html will output for this context (same conditions as the template)"""
+        electromedical_data = template_context["electromedical_data"] or []
+        present = {
+            "prescreening": bool(template_context["prescreening_test_data"]),
+            "physical_examination": bool(template_context["physical_examination_data"]),
+            "vital_signs": bool(template_context["vital_signs_data"]),
+            "conclusions": True,
+            "laboratory": True,
+            "electromedical": bool(electromedical_data),
+            "attachments": any(item["key"] != "audiometri" for item in electromedical_data),
+        }
+        return [section for section, _ in REPORT_SECTIONS if present[section]]
+
+    def _render_sections(self, template_context: Dict, output_path: str, pdf_write_options: Dict) -> None:
+        """
+        Render the report one section at a time, reusing the cached PDF pages of every section
+        whose inputs did not change, and assemble the fragments into output_path.
+        """
+        section_inputs = dict(REPORT_SECTIONS)
+        sections = self._present_sections(template_context)
+        template = self.jinja_env.get_template('reports.html')
+        report = fitz.open()
+        try:
+            for index, section in enumerate(sections):
+                # The report title sits above the first section, so it belongs to that fragment
+                show_title = index == 0
+                key = section_key(
+                    section,
+                    {name: template_context[name] for name in REPORT_SHARED_INPUTS + section_inputs[section]}
+                    | {"show_title": show_title, "pdf_write_options": pdf_write_options},
+                    self.template_fingerprint,
+                )
+                fragment = self.section_cache.get(key)
+                metrics.inc("report_section_cache_total", section=section, result="hit" if fragment else "miss")
+                if not fragment:
+                    html_content = template.render(**template_context, section_filter=[section], show_title=show_title)
+                    with metrics.timer("pdf_layout_duration_seconds", section=section):
+                        document = HTML(string=html_content, base_url=self.template_dir).render(
+                            stylesheets=[self.print_css], **self._render_image_options(pdf_write_options)
+                        )
+                    rendered_path = f"tmp/section_{uuid.uuid4()}.pdf"
+                    with metrics.timer("pdf_write_duration_seconds", section=section):
+                        document.write_pdf(rendered_path, **pdf_write_options)
+                    self._place_vector_attachments(document, rendered_path, template_context["electromedical_data"], pdf_write_options)
+                    fragment = self.section_cache.put(key, rendered_path)
+
+                with fitz.open(stream=fragment, filetype="pdf") as fragment_pdf:
+                    report.insert_pdf(fragment_pdf)
+
+            with metrics.timer("pdf_write_duration_seconds", section="assemble"):
+                # garbage=3 merges the font and image objects the fragments have in common
+                report.save(output_path, garbage=3, deflate=not pdf_write_options["uncompressed_pdf"])
+        finally:
+            report.close()
+
+    @staticmethod
+    def _place_vector_attachments(document, pdf_path: str, electromedical_data: Optional[List[Dict]], pdf_write_options: Dict) -> None:
+        """
+        Draw vector attachments into the rendered PDF: each source page goes into the box its
+        template placeholder reserved, found through the placeholder's anchor in the WeasyPrint
+        layout (positions are CSS px, PDF pages are in points)
+        """
+        attachments = {
+            f"attachment-{item['key']}": item["vector_attachment"]
+            for item in electromedical_data or [] if item.get("vector_attachment")
+        }
+        placements = [
+            (page_number, anchor, position)
+            for page_number, page in enumerate(document.pages)
+            for anchor, position in page.anchors.items() if anchor in attachments
+        ] if attachments else []
+        if not placements:
+            return
+
+        box_width, box_height = VECTOR_ATTACHMENT_BOX_PX
+        placed_path = f"tmp/placed_{uuid.uuid4()}.pdf"
+        with metrics.timer("attachment_place_duration_seconds"):
+            with fitz.open(pdf_path) as report:
+                for page_number, anchor, (x, y) in placements:
+                    attachment = attachments[anchor]
+                    rect = fitz.Rect(x, y, x + box_width, y + box_height) * CSS_PX_TO_PT
+                    with fitz.open(attachment["pdf_path"]) as source:
+                        report[page_number].show_pdf_page(rect, source, 0, clip=fitz.Rect(attachment["clip"]))
+                report.save(placed_path, garbage=3, deflate=not pdf_write_options["uncompressed_pdf"])
+        os.replace(placed_path, pdf_path)
+
     def _upload_cleanup_files(self, state: _ReportGeneratorState) -> _ReportGeneratorState:
         logger.info(" Upload and cleanup files ".center(LOG_SIZE, "-"))
 
@@ -818,20 +1027,15 @@ class AgentReportGenerator:
         state["url_file_path"] = f"https://storage.googleapis.com/{bucket_name}/{blob_name}"
         
         # Upload file and make it public
-        blob.upload_from_filename(state["file_path"])
+        with metrics.timer("report_upload_duration_seconds"):
+            blob.upload_from_filename(state["file_path"])
         
         # Get the public URL
         # url = blob.generate_signed_url(expiration=timedelta(hours=1))
         # logger.info(f"URL report: {url}")
-        update_status_query = """
-        UPDATE b2b_bumame_appointment_patient_analysis
-        SET examination_status = 'generated',
-            medical_report_url_v2 = %s,
-            result_issued_at = NOW()
-        WHERE appointment_patient_id = %s AND is_deleted = 0
-        """
-        db_postgres.execute_query(update_status_query, (state["url_file_path"], state["patient_data"]["patient_id"]))
-        logger.info(f"Updated examination_status to 'generated' and saved URL for patient {state['patient_data']['patient_id']}")
+        # Written in batches with other reports' updates (see ReportStatusWriter)
+        ReportStatusWriter().mark_generated(state["patient_data"]["patient_id"], state["url_file_path"])
+        logger.info(f"Recorded examination_status 'generated' and URL for patient {state['patient_data']['patient_id']}")
 
         logger.info(f"Cleanup files for patient {state['patient_data']['patient_id']}")
         """Cleanup files"""
@@ -849,29 +1053,69 @@ class AgentReportGenerator:
             raise
         return state
     
-    def download_and_convert_pdf_to_image(self, url) -> Tuple[str, int, int]:
+    def download_drive_pdf(self, url, attachment_type: str = "unknown") -> str:
+        """Download a PDF from Google Drive to a temp file; the caller removes it"""
+        # Extract file ID from Google Drive URL
+        file_id = self.get_google_drive_file_id(url)
+        if not file_id:
+            raise ValueError(f"Invalid Google Drive URL: {url}")
+        
+        # Create direct download link
+        download_url = f"https://drive.google.com/uc?id={file_id}&export=download"
+        
+        # Download PDF with proper headers
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+        }
+        # Streamed to disk (PyMuPDF opens it by path), with timeouts, a size limit and the Drive circuit breaker
+        filename = f"tmp/attachment_source_{uuid.uuid4()}.pdf"
+        with metrics.timer("attachment_download_duration_seconds", attachment_type=attachment_type, source="drive"):
+            AttachmentFetcher().fetch_to_file(download_url, filename, headers=headers)
+        return filename
+
+    def download_attachment_pdf(self, url, attachment_type: str = "unknown") -> Dict:
+        """
+        Download a PDF attachment from Google Drive for vector placement: the first page is kept
+        as a one-page PDF, with the bounding box of its content (the vector counterpart of the
+        white-border crop of download_and_convert_pdf_to_image)
+        """
+        source_path = None
+        try:
+            source_path = self.download_drive_pdf(url, attachment_type)
+            with fitz.open(source_path, filetype="pdf") as source:
+                if source.page_count == 0:
+                    raise Exception("PDF document is empty")
+                first_page = source[0]
+                clip = fitz.Rect()
+                for _, rect in first_page.get_bboxlog():
+                    clip |= fitz.Rect(rect)
+                clip &= first_page.rect
+                if clip.is_empty:
+                    clip = first_page.rect
+
+                filename = f"tmp/attachment_{uuid.uuid4()}.pdf"
+                with fitz.open() as single_page:
+                    single_page.insert_pdf(source, from_page=0, to_page=0)
+                    # no_new_id: same source, same bytes, so the section cache key is stable
+                    single_page.save(filename, garbage=3, deflate=True, no_new_id=True)
+            return {"pdf_path": filename, "clip": [clip.x0, clip.y0, clip.x1, clip.y1]}
+        except Exception as e:
+            logger.error(f"Error downloading PDF attachment: {str(e)}")
+            raise
+        finally:
+            if source_path and os.path.exists(source_path):
+                os.remove(source_path)
+
+    def download_and_convert_pdf_to_image(self, url, attachment_type: str = "unknown", render_options: Optional[Dict] = None) -> Tuple[str, int, int]:
         """Download PDF from Google Drive and convert to image"""
+        source_path = None
         try:
-            # Extract file ID from Google Drive URL
-            file_id = self.get_google_drive_file_id(url)
-            if not file_id:
-                raise ValueError(f"Invalid Google Drive URL: {url}")
-            
-            # Create direct download link
-            download_url = f"https://drive.google.com/uc?id={file_id}&export=download"
-            
-            # Download PDF with proper headers
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            response = requests.get(download_url, headers=headers, allow_redirects=True)
-            
-            if response.status_code != 200:
-                raise Exception(f"Failed to download PDF. Status code: {response.status_code}")
+            source_path = self.download_drive_pdf(url, attachment_type)
+
+            rasterize_start_time = time.perf_counter()
             
             # Convert PDF to image
-            pdf_content = io.BytesIO(response.content)
-            pdf_document = fitz.open(stream=pdf_content, filetype="pdf")
+            pdf_document = fitz.open(source_path, filetype="pdf")
             
             if pdf_document.page_count == 0:
                 raise Exception("PDF document is empty")
@@ -905,21 +1149,25 @@ class AgentReportGenerator:
             # Resize image
             image = image.resize(new_size, Image.Resampling.LANCZOS)
             
-            # Create bytes buffer with compression
-            img_buffer = io.BytesIO()
-            image.save(img_buffer, format='PNG', optimize=True, quality=85)
-            img_buffer.seek(0)
-
-            # save image to temp file
-            filename = f"tmp/temp_image_{uuid.uuid4()}.png"
-            image.save(filename, optimize=True, quality=85)
+            # Save to a temp file; JPEG is several times smaller than PNG for scanned/graphical pages
+            render_options = render_options or REPORT_RENDER_OPTIONS
+            if render_options["attachment_image_format"] == "jpeg":
+                filename = f"tmp/temp_image_{uuid.uuid4()}.jpg"
+                image.save(filename, format='JPEG', quality=render_options["attachment_jpeg_quality"], optimize=True)
+            else:
+                filename = f"tmp/temp_image_{uuid.uuid4()}.png"
+                image.save(filename, format='PNG', optimize=True)
             
             pdf_document.close()
+            metrics.observe("attachment_rasterize_duration_seconds", time.perf_counter() - rasterize_start_time, attachment_type=attachment_type)
             return filename, new_width, max_height
             
         except Exception as e:
             logger.error(f"Error converting PDF to image: {str(e)}")
             raise
+        finally:
+            if source_path and os.path.exists(source_path):
+                os.remove(source_path)
 
     def get_google_drive_file_id(self, url):
         """Extract file ID from Google Drive URL"""
@@ -4,11 +4,12 @@ from typing import Dict, Any
 from config.logging import logger
 from schema.base import BaseResponse
 from helper.cloud_run_job import _run_job
+from service.autoscaler_service import QueueAutoscaler, CONSUMERS_PER_TASK
 import os
-import math
 
 router = APIRouter()
 rmq_helper = RabbitMQHelper()
+autoscaler = QueueAutoscaler()
 
 @router.post("/activate", response_model=BaseResponse[Dict[str, Any]])
 async def activate_cloud_run_job():
@@ -26,61 +27,34 @@ async def activate_cloud_run_job():
             )
         
         queue_name = os.getenv('QUEUE_NAME_REPORT_CONSUMER', 'report_generation')
-        
-        # Check how many messages in RMQ queue are available
-        queueAvailable = await rmq_helper.get_queue_message_count(queue_name)
-        logger.info(f"Queue available: {queueAvailable}")
-
-
-        # Check how many consumers are running for that queue
-        consumerRunning = await rmq_helper.get_queue_consumer_count(queue_name)
-        logger.info(f"Consumer running: {consumerRunning}")
+        interactive_queue_name = os.getenv('QUEUE_NAME_REPORT_INTERACTIVE', 'report_generation_interactive')
 
-        # Determine criterion consumer vs queue count
-        consumerVsQueueCrit = [
-            {
-                "queue": 700,
-                "consumer": 15
-            },
-            {
-                "queue": 300,
-                "consumer": 12
-            },
-            {
-                "queue": 100,
-                "consumer": 9
-            },
-            {
-                "queue": 50,
-                "consumer": 6
-            },
-            {
-                "queue": 1,
-                "consumer": 3
-            },
-        ]
+        # Size the scale-up from the depth of both lanes, publish/ack rates and tasks already starting
+        decision = await autoscaler.evaluate(queue_name, interactive_queue_name)
+        queueAvailable = decision["queue_depth"]
+        consumerRunning = decision["consumers_running"]
+        taskToActivate = decision["tasks_to_start"]
+        consumerNeedToActivate = taskToActivate * CONSUMERS_PER_TASK
 
-        consumerNeedToActivate = 0
-        for crit in consumerVsQueueCrit:
-            if queueAvailable >= crit["queue"] and consumerRunning < crit["consumer"]:
-                consumerNeedToActivate = crit["consumer"] - consumerRunning
-                logger.info(f"Activating {crit["consumer"]} Cloud Run Job")
-                break
-
-
-        if consumerNeedToActivate > 0:
-            taskToActivate = math.ceil(consumerNeedToActivate / 3)
-            logger.info(f"Activating {consumerNeedToActivate} Cloud Run Job")
+        if taskToActivate > 0:
+            logger.info(f"Activating {taskToActivate} Cloud Run Job task(s) for {consumerNeedToActivate} consumers")
             job = os.getenv('CLOUD_RUN_JOB_NAME', 'report_generation')
-            for _ in range(taskToActivate):
-                await _run_job(job)
+            # One execution with K parallel tasks instead of K single-task executions
+            started = await _run_job(
+                job,
+                task_count=taskToActivate,
+                env_vars=[{"name": "CONSUMER_CONCURRENCY", "value": str(CONSUMERS_PER_TASK)}]
+            )
+            if started:
+                autoscaler.record_scale_up(taskToActivate)
 
         return BaseResponse(
             message="Cloud Run Job activated successfully",
             data={
                 "queueAvailable": queueAvailable,
                 "consumerRunning": consumerRunning,
-                "consumerNeedToActivate": consumerNeedToActivate
+                "consumerNeedToActivate": consumerNeedToActivate,
+                "autoscaler": decision
             }
         )
     except Exception as e:
@@ -1,35 +1,48 @@
 from fastapi import APIRouter, HTTPException, status
-from helper.database import db_postgres
-from typing import Dict
+from fastapi.responses import JSONResponse
+from helper.health import HealthMonitor
+from typing import Any, Dict
 
 router = APIRouter()
+health_monitor = HealthMonitor()
+
+@router.get("/livez", response_model=Dict[str, Any])
+async def livez():
+    """
+    Liveness: the process is up and its event loop is serving requests.
+    Never touches a dependency.
+    """
+    return health_monitor.liveness()
+
+@router.get("/readyz", response_model=Dict[str, Any])
+async def readyz():
+    """
+    Readiness from the cached background checks (database, RabbitMQ).
+    Returns:
+        200 OK if every check passed on its last run
+        503 Service Unavailable otherwise
+    """
+    readiness = health_monitor.readiness()
+    return JSONResponse(
+        readiness,
+        status_code=status.HTTP_200_OK if readiness["status"] == "ready" else status.HTTP_503_SERVICE_UNAVAILABLE
+    )
 
 @router.get("/healthcheck", response_model=Dict[str, str])
 async def healthcheck():
     """
-    Check the health of database and Redis connections.
+    Check the health of the database connection (cached result of the background check).
     Returns:
         200 OK if all services are healthy
         503 Service Unavailable if any service is down
     """
-    try:
-        database_status = "disconnected"
-        # Check database connection
-        if db_postgres.fetch_query("SELECT 1") is None:
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail="Database connection failed"
-            )
-        else:
-            database_status = "connected"
-
-        
-        return {
-            "status": "healthy",
-            "database": database_status,
-        }
-    except Exception as e:
+    database = health_monitor.readiness()["checks"].get("database", {"ok": False, "detail": "not monitored"})
+    if not database["ok"]:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail=f"Service unhealthy: {str(e)}"
+            detail=f"Service unhealthy: {database['detail']}"
         )
+    return {
+        "status": "healthy",
+        "database": "connected",
+    }
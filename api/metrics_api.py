@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from helper.metrics import metrics
+
+router = APIRouter()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Prometheus metrics of this process, in the text exposition format.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
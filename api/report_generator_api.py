@@ -1,19 +1,24 @@
 from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import StreamingResponse
 from helper.database import db_postgres
 from helper.rmq import RabbitMQHelper
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Literal
 from pydantic import BaseModel
 from helper.database import DatabaseError
-from config.logging import logger
+from config.logging import logger, mask_patient_phi
 import uuid
 from datetime import datetime
 from service.patient_service import PatientService
 import os
-from agent.report_generator_agent import AgentReportGenerator
 from schema.base import BaseResponse
+from service.report_job_service import ReportJobRegistry, ReportJobStatus, publish_report_status
+from service.customize_variable_service import publish_customize_variable_invalidation
+from service.appointment_export_service import AppointmentExportService
+import json
 
 router = APIRouter()
 rmq_helper = RabbitMQHelper()
+report_job_registry = ReportJobRegistry()
 
 
 class GenerateReportRequest(BaseModel):
@@ -67,10 +72,23 @@ class GetReportByNIKRequest(BaseModel):
     nik: str
     appointment_id: str
 
+class AppointmentExportRequest(BaseModel):
+    appointment_id: str
+    format: Literal["pdf", "zip"] = "pdf"
+
+class InvalidateCustomizeVariableRequest(BaseModel):
+    # None invalidates every appointment
+    appointment_id: Optional[str] = None
+
 class ReportStatusResponse(BaseModel):
     status: str
     message: str
     url: Optional[str] = None
+    batch_id: Optional[str] = None
+    appointment_patient_id: Optional[str] = None
+    error: Optional[str] = None
+    total: Optional[int] = None
+    counts: Optional[Dict[str, int]] = None
 
 @router.post("/generate", response_model=GenerateReportResponse)
 async def generate_report(request: GenerateReportRequest, language: str = "id"):
@@ -116,6 +134,7 @@ async def generate_report(request: GenerateReportRequest, language: str = "id"):
         
         # Get patient data from database with appointment_id
         patient_data = PatientService.get_patient_data(request.appointment_patient_id, request.appointment_id, language)
+        mask_patient_phi(patient_data)
         
         # Add filename and language to patient data
         patient_data['filename'] = filename
@@ -129,11 +148,19 @@ async def generate_report(request: GenerateReportRequest, language: str = "id"):
 
         PatientService.update_status_to_generating(request.appointment_patient_id, request.appointment_id)
 
-        queue_name = os.getenv('QUEUE_NAME_REPORT_CONSUMER', 'report_generation')
+        # Single reports go to the interactive lane, ahead of appointment-wide bulk runs
+        queue_name = os.getenv('QUEUE_NAME_REPORT_INTERACTIVE', 'report_generation_interactive')
         await rmq_helper.publish(queue_name, {
             "batch_id": batch_id,
             "patient_data": patient_data
         })
+
+        report_job_registry.apply_event(await publish_report_status(
+            batch_id,
+            ReportJobStatus.QUEUED,
+            appointment_id=request.appointment_id,
+            appointment_patient_id=request.appointment_patient_id,
+        ))
         
         return GenerateReportResponse(
             status="processing",
@@ -151,68 +178,33 @@ async def generate_report(request: GenerateReportRequest, language: str = "id"):
 @router.post("/generate-appointment-report", response_model=GenerateReportResponse)
 async def generate_appointment_report(request: GenerateAppointmentReportRequest, language: str = "id"):
     """
-    Queue report generation request for asynchronous processing.
-    Returns immediately with a batch ID that can be used to check status.
+    Queue report generation for every checked-out patient of an appointment.
+    Returns immediately with a batch ID that can be used to check status: a consumer lists the
+    patients and fans the work out in shards, so this makes no database query whatever the
+    appointment size.
     """
     try:
-        # Get patient name from database
-        patient_query = """
-        SELECT p.name as patient_name, cc.name as company_name, p.id as patient_id
-        FROM b2b_bumame_appointment_patient p
-        JOIN b2b_bumame_appointment a ON p.appointment_id = a.id
-        JOIN b2b_bumame_company_client cc ON a.company_client_id = cc.id
-        WHERE p.appointment_id = %s AND p.is_deleted = 0 AND a.is_deleted = 0 AND cc.is_deleted = 0 AND p.status = 'check_out_examination'
-        """
-        try:
-            patient_data = db_postgres.fetch_query(
-                patient_query, 
-                (request.appointment_id,)
-            )
-        except DatabaseError as de:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=str(de)
-            )
-        
-        if len(patient_data) == 0:
-            raise ValueError(f"Patient not found with Appointment ID: {request.appointment_id}")
-        
-        for patient in patient_data:
-            patient_name = patient[0]
-            company_name = patient[1]
-            
-            # Create safe names for filename
-            unique_id = str(uuid.uuid4())[:8]
-            safe_patient_name = "".join(c for c in patient_name if c.isalnum() or c.isspace()).replace(" ", "_")
-            safe_company_name = "".join(c for c in company_name if c.isalnum() or c.isspace()).replace(" ", "_")
-            
-            # Add timestamp to filename
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{request.appointment_id}_{patient[2]}_{safe_patient_name}_{safe_company_name}_{timestamp}"
-            
-            # Get patient data from database with appointment_id (default to Indonesian)
-            patient_data = PatientService.get_patient_data(patient[2], request.appointment_id, language)
-
-            print(patient[2])
-            # Add filename to patient data
-            patient_data['filename'] = filename
-            patient_data['language'] = language
-            
-            # Generate unique batch ID
-            batch_id = str(uuid.uuid4())
-            
-            # Queue the report generation request
-            queue_name = os.getenv('QUEUE_NAME_REPORT_CONSUMER', 'report_generation')
-            print(queue_name)
-            await rmq_helper.publish(queue_name, {
-                "batch_id": batch_id,
-                "patient_data": patient_data
-            })
-        
+        # One id for the whole appointment, aggregating the progress of every patient job
+        appointment_batch_id = str(uuid.uuid4())
+        queue_name = os.getenv('QUEUE_NAME_REPORT_CONSUMER', 'report_generation')
+        await rmq_helper.publish(queue_name, {
+            "type": "appointment_report",
+            "batch_id": appointment_batch_id,
+            "appointment_id": request.appointment_id,
+            "language": language,
+        })
+        # The total arrives once the consumer has listed the patients
+        report_job_registry.apply_event(await publish_report_status(
+            None,
+            None,
+            appointment_id=request.appointment_id,
+            appointment_batch_id=appointment_batch_id,
+        ))
+
         return GenerateReportResponse(
             status="processing",
             message="Report generation has been queued",
-            batch_id="292"
+            batch_id=appointment_batch_id
         )
 
     except Exception as e:
@@ -222,6 +214,88 @@ async def generate_appointment_report(request: GenerateAppointmentReportRequest,
             detail=str(e)
         )
     
+@router.post("/appointment-export", response_model=GenerateReportResponse)
+async def export_appointment_reports(request: AppointmentExportRequest):
+    """
+    Queue a whole-appointment export: every generated report merged into one PDF (with a
+    bookmark per patient) or packed in a ZIP. Track it with /status/{batch_id} or
+    /appointment-export/{batch_id}?appointment_id=...; the finished status carries the file URL.
+    """
+    try:
+        export_id = str(uuid.uuid4())
+        queue_name = os.getenv('QUEUE_NAME_REPORT_CONSUMER', 'report_generation')
+        await rmq_helper.publish(queue_name, {
+            "type": "appointment_export",
+            "batch_id": export_id,
+            "appointment_id": request.appointment_id,
+            "format": request.format
+        })
+
+        report_job_registry.apply_event(await publish_report_status(
+            export_id,
+            ReportJobStatus.QUEUED,
+            appointment_id=request.appointment_id,
+        ))
+
+        return GenerateReportResponse(
+            status="processing",
+            message=f"Appointment export ({request.format}) has been queued",
+            batch_id=export_id
+        )
+    except Exception as e:
+        logger.error(f"Error queueing appointment export: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+
+@router.get("/appointment-export/{export_id}", response_model=ReportStatusResponse)
+async def get_appointment_export(export_id: str, appointment_id: Optional[str] = None):
+    """
+    Status of an appointment export; `url` is set once it is generated. An export this instance
+    has no status events for falls back to the uploaded file when appointment_id is given.
+    """
+    export_status = report_job_registry.get_job(export_id)
+    if export_status is None and appointment_id:
+        try:
+            export_url = AppointmentExportService().find_export(appointment_id, export_id)
+        except Exception as e:
+            logger.error(f"Error looking up export {export_id} of appointment {appointment_id}: {str(e)}")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=str(e)
+            )
+        if export_url:
+            export_status = {"batch_id": export_id, "status": ReportJobStatus.GENERATED, "url": export_url}
+    if export_status is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown export id: {export_id}"
+        )
+    return _to_report_status_response(export_status)
+
+
+@router.post("/customize-variable/invalidate", response_model=BaseResponse[Dict[str, Any]])
+async def invalidate_customize_variable(request: InvalidateCustomizeVariableRequest):
+    """
+    Call after an appointment's customize variables change: consumers cache them per
+    appointment and reload them on their next report.
+    """
+    try:
+        await publish_customize_variable_invalidation(request.appointment_id)
+        return BaseResponse(
+            message="Customize variable cache invalidated",
+            data={"appointment_id": request.appointment_id}
+        )
+    except Exception as e:
+        logger.error(f"Error invalidating customize variable cache: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+
 @router.post("/awaited-generate", response_model=BaseResponse[Dict[str, Any]])
 async def awaited_generate_report(request: GenerateReportRequest, language: str = "id"):
     """
@@ -266,6 +340,7 @@ async def awaited_generate_report(request: GenerateReportRequest, language: str
         
         # Get patient data from database with appointment_id
         patient_data = PatientService.get_patient_data(request.appointment_patient_id, request.appointment_id, language)
+        mask_patient_phi(patient_data)
         
         # Add filename and language to patient data
         patient_data['filename'] = filename
@@ -274,6 +349,8 @@ async def awaited_generate_report(request: GenerateReportRequest, language: str
         # Generate unique batch ID
         batch_id = str(uuid.uuid4())
 
+        # Imported on first use: the render stack (WeasyPrint, PyMuPDF, langgraph) is slow to import
+        from agent.report_generator_agent import AgentReportGenerator
         agent = AgentReportGenerator()
         file_path = agent.run_with_data(patient_data)
 
@@ -289,4 +366,152 @@ async def awaited_generate_report(request: GenerateReportRequest, language: str
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
-        )
\ No newline at end of file
+        )
+
+
+def _to_report_status_response(job_status: Dict[str, Any]) -> ReportStatusResponse:
+    if "counts" in job_status:
+        counts = job_status["counts"]
+        finished = counts[ReportJobStatus.GENERATED] + counts[ReportJobStatus.FAILED]
+        return ReportStatusResponse(
+            status=job_status["status"],
+            message=f"{finished}/{job_status['total']} reports finished",
+            batch_id=job_status["appointment_batch_id"],
+            total=job_status["total"],
+            counts=counts,
+        )
+
+    return ReportStatusResponse(
+        status=job_status["status"],
+        message=f"Report is {job_status['status']}",
+        url=job_status.get("url"),
+        batch_id=job_status["batch_id"],
+        appointment_patient_id=job_status.get("appointment_patient_id"),
+        error=job_status.get("error"),
+    )
+
+
+def _stored_report_status(batch_id: str, appointment_id: str, appointment_patient_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Status of a job or appointment batch without status events here, from the stored examination status"""
+    rows = PatientService.get_report_statuses(appointment_id, appointment_patient_id)
+    if not rows:
+        return None
+    if appointment_patient_id:
+        _, examination_status, report_url = rows[0]
+        return {
+            "batch_id": batch_id,
+            "status": ReportJobStatus.from_examination_status(examination_status),
+            "url": report_url,
+            "appointment_patient_id": appointment_patient_id,
+        }
+
+    counts = {
+        ReportJobStatus.QUEUED: 0,
+        ReportJobStatus.PROCESSING: 0,
+        ReportJobStatus.GENERATED: 0,
+        ReportJobStatus.FAILED: 0,
+    }
+    for _, examination_status, _ in rows:
+        counts[ReportJobStatus.from_examination_status(examination_status)] += 1
+    return {
+        "appointment_batch_id": batch_id,
+        "status": ReportJobStatus.aggregate(counts, len(rows)),
+        "total": len(rows),
+        "counts": counts,
+    }
+
+
+@router.get("/status/{batch_id}", response_model=ReportStatusResponse)
+async def get_report_status(batch_id: str, appointment_id: Optional[str] = None, appointment_patient_id: Optional[str] = None):
+    """
+    Get the status of a report job (batch_id from /generate) or of a whole appointment
+    (batch_id from /generate-appointment-report), served from memory. A batch_id this instance
+    has no status events for (it started after the job was queued, or they expired) falls back
+    to the stored examination status when appointment_id (and for a job, appointment_patient_id)
+    is given.
+    """
+    job_status = report_job_registry.get_status(batch_id)
+    if job_status is None and appointment_id:
+        try:
+            job_status = _stored_report_status(batch_id, appointment_id, appointment_patient_id)
+        except DatabaseError as de:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=str(de)
+            )
+    if job_status is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown batch_id: {batch_id}"
+        )
+    return _to_report_status_response(job_status)
+
+
+@router.get("/status/{batch_id}/stream")
+async def stream_report_status(batch_id: str):
+    """
+    Server-Sent Events stream of status changes for a report job or an appointment batch.
+    The stream closes once the job (or every job of the appointment) is finished.
+    """
+    if report_job_registry.get_status(batch_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown batch_id: {batch_id}"
+        )
+
+    async def event_stream():
+        async for job_status in report_job_registry.watch(batch_id):
+            if job_status is None:
+                yield "event: expired\ndata: {}\n\n"
+                return
+            payload = _to_report_status_response(job_status).model_dump(exclude_none=True)
+            yield f"event: status\ndata: {json.dumps(payload)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/report", response_model=GetReportByIDResponse)
+async def get_report_by_id(request: GetReportByIDRequest):
+    """
+    Get the report URL of a patient. Jobs tracked by this instance are answered from memory;
+    otherwise the stored examination status is read once from the database.
+    """
+    job = report_job_registry.get_latest_job_for_patient(request.appointment_patient_id)
+    if job and job["status"] == ReportJobStatus.GENERATED and job.get("url"):
+        return GetReportByIDResponse(status=job["status"], message="Report is generated", url=job["url"])
+
+    report_query = """
+    SELECT examination_status, medical_report_url_v2
+    FROM b2b_bumame_appointment_patient_analysis
+    WHERE appointment_patient_id = %s AND appointment_id = %s AND is_deleted = 0
+    """
+    try:
+        report_data = db_postgres.fetch_query(
+            report_query,
+            (request.appointment_patient_id, request.appointment_id)
+        )
+    except DatabaseError as de:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(de)
+        )
+
+    if not report_data:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Report not found for patient: {request.appointment_patient_id}"
+        )
+
+    examination_status, report_url = report_data[0]
+    if job and job["status"] in (ReportJobStatus.QUEUED, ReportJobStatus.PROCESSING):
+        examination_status = job["status"]
+
+    return GetReportByIDResponse(
+        status=examination_status or "-",
+        message=f"Report is {examination_status}" if examination_status else "Report has not been generated",
+        url=report_url or ""
+    )
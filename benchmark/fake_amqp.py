@@ -0,0 +1,226 @@
+"""
+In-process stand-in for the parts of aio_pika used by RabbitMQHelper and report_consumer:
+connection/channel/queue/exchange objects with prefetch, ack/reject/nack and redelivery.
+"""
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional
+import asyncio
+import itertools
+
+
+class FakeDeclarationResult:
+    def __init__(self, queue: "FakeQueue"):
+        self._queue = queue
+
+    @property
+    def message_count(self) -> int:
+        return len(self._queue.pending)
+
+    @property
+    def consumer_count(self) -> int:
+        return sum(1 for consumer in self._queue.consumers if consumer is not None)
+
+
+class FakeIncomingMessage:
+    _delivery_tags = itertools.count(1)
+
+    def __init__(self, queue: "FakeQueue", body: bytes, headers: Optional[Dict[str, Any]], redelivered: bool = False):
+        self.queue = queue
+        self.body = body
+        self.headers = headers or {}
+        self.redelivered = redelivered
+        self.delivery_tag = next(self._delivery_tags)
+        self.processed = False
+        self.consumer_index: Optional[int] = None
+
+    @property
+    def routing_key(self) -> str:
+        return self.queue.name
+
+    def _settle(self):
+        if self.processed:
+            raise RuntimeError("Message already processed")
+        self.processed = True
+        self.queue.in_flight -= 1
+        if self.consumer_index is not None:
+            self.queue.consumer_in_flight[self.consumer_index] -= 1
+        self.queue.wakeup()
+
+    async def ack(self, multiple: bool = False):
+        self._settle()
+        self.queue.broker.acked += 1
+        self.queue.broker.notify_settled(self, "ack")
+
+    async def reject(self, requeue: bool = False):
+        self._settle()
+        self.queue.broker.rejected += 1
+        self.queue.broker.notify_settled(self, "requeue" if requeue else "reject")
+        if requeue:
+            self.queue.requeue(self)
+
+    async def nack(self, requeue: bool = True):
+        await self.reject(requeue=requeue)
+
+    @asynccontextmanager
+    async def process(self, requeue: bool = False, reject_on_redelivered: bool = False, ignore_processed: bool = False):
+        """Same contract as aio_pika.IncomingMessage.process() (aio_pika 9/10)"""
+        try:
+            yield self
+        except BaseException:
+            if not ignore_processed or not self.processed:
+                if reject_on_redelivered and self.redelivered:
+                    await self.reject(requeue=False)
+                else:
+                    await self.reject(requeue=requeue)
+            raise
+        else:
+            if not ignore_processed or not self.processed:
+                await self.ack()
+
+
+class FakeQueue:
+    def __init__(self, broker: "FakeBroker", name: str):
+        self.broker = broker
+        self.name = name
+        self.pending: List[FakeIncomingMessage] = []
+        self.consumers: List[Callable] = []
+        self.consumer_in_flight: List[int] = []
+        self.in_flight = 0
+        self.declaration_result = FakeDeclarationResult(self)
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def put(self, body: bytes, headers: Optional[Dict[str, Any]]):
+        self.pending.append(FakeIncomingMessage(self, body, headers))
+        self.broker.published += 1
+        self.wakeup()
+
+    def requeue(self, message: FakeIncomingMessage):
+        self.pending.insert(0, FakeIncomingMessage(self, message.body, message.headers, redelivered=True))
+        self.broker.redelivered += 1
+        self.wakeup()
+
+    def wakeup(self):
+        self._wakeup.set()
+
+    async def bind(self, exchange, routing_key: str = ""):
+        exchange.bound_queues.append(self)
+
+    async def consume(self, callback: Callable, no_ack: bool = False) -> str:
+        self.consumers.append(callback)
+        self.consumer_in_flight.append(0)
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+        return f"ctag-{self.name}-{len(self.consumers)}"
+
+    async def cancel(self, consumer_tag: str):
+        """Stop deliveries to one consumer; its unacked messages can still be settled"""
+        index = int(consumer_tag.rsplit("-", 1)[1]) - 1
+        self.consumers[index] = None
+
+    async def _deliver(self, callback: Callable, message: FakeIncomingMessage):
+        try:
+            await callback(message)
+        except Exception:
+            # aio_pika only logs exceptions escaping a consumer callback; count them instead
+            self.broker.callback_errors += 1
+            if not message.processed:
+                await message.reject(requeue=False)
+
+    async def _dispatch(self):
+        """Round-robin delivery; prefetch limits unacked messages per consumer, like basic.qos(global=False)"""
+        next_consumer = 0
+        while True:
+            prefetch = self.broker.prefetch_count or float("inf")
+            while self.pending and self.consumers:
+                candidates = [
+                    (next_consumer + offset) % len(self.consumers) for offset in range(len(self.consumers))
+                ]
+                index = next(
+                    (i for i in candidates if self.consumers[i] is not None and self.consumer_in_flight[i] < prefetch), None
+                )
+                if index is None:
+                    break
+                message = self.pending.pop(0)
+                message.consumer_index = index
+                self.in_flight += 1
+                self.consumer_in_flight[index] += 1
+                next_consumer = index + 1
+                asyncio.get_running_loop().create_task(self._deliver(self.consumers[index], message))
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+
+class FakeExchange:
+    def __init__(self, broker: "FakeBroker", name: str):
+        self.broker = broker
+        self.name = name
+        self.bound_queues: List[FakeQueue] = []
+
+    async def publish(self, message, routing_key: str = ""):
+        if self.name == "":
+            self.broker.queue(routing_key).put(message.body, message.headers)
+            return
+        self.broker.broadcasts += 1
+        for queue in self.bound_queues:
+            queue.put(message.body, message.headers)
+
+
+class FakeChannel:
+    def __init__(self, broker: "FakeBroker"):
+        self.broker = broker
+        self.default_exchange = FakeExchange(broker, "")
+        self.is_closed = False
+
+    async def set_qos(self, prefetch_count: int = 0, **kwargs):
+        self.broker.prefetch_count = prefetch_count
+
+    async def declare_queue(self, name: Optional[str] = None, **kwargs) -> FakeQueue:
+        return self.broker.queue(name or f"amq.gen-{next(self.broker.anonymous_names)}")
+
+    async def declare_exchange(self, name: str, *args, **kwargs) -> FakeExchange:
+        return self.broker.exchanges.setdefault(name, FakeExchange(self.broker, name))
+
+    async def close(self):
+        self.is_closed = True
+
+
+class FakeConnection:
+    def __init__(self, broker: "FakeBroker"):
+        self.broker = broker
+        self.is_closed = False
+
+    async def channel(self) -> FakeChannel:
+        return FakeChannel(self.broker)
+
+    async def close(self):
+        self.is_closed = True
+
+
+class FakeBroker:
+    """Holds the queues and the counters the load test reports on"""
+
+    def __init__(self):
+        self.queues: Dict[str, FakeQueue] = {}
+        self.exchanges: Dict[str, FakeExchange] = {}
+        self.prefetch_count = 0
+        self.anonymous_names = itertools.count(1)
+        self.published = 0
+        self.acked = 0
+        self.rejected = 0
+        self.redelivered = 0
+        self.broadcasts = 0
+        self.callback_errors = 0
+        self.settle_listeners: List[Callable[[Any, str], None]] = []
+
+    def notify_settled(self, message: FakeIncomingMessage, outcome: str):
+        for listener in self.settle_listeners:
+            listener(message, outcome)
+
+    def queue(self, name: str) -> FakeQueue:
+        if name not in self.queues:
+            self.queues[name] = FakeQueue(self, name)
+        return self.queues[name]
+
+    def connection(self) -> FakeConnection:
+        return FakeConnection(self)
@@ -0,0 +1,173 @@
+"""
+Size-versus-quality benchmark of the PDF render options (REPORT_RENDER_OPTIONS).
+
+Renders the same synthetic patient once per preset and reports, for each one, the PDF size,
+render time and how far its pages drift from the baseline preset (WeasyPrint defaults, PNG
+attachments) when rasterised: PSNR in dB (higher is closer, "inf" means pixel identical) and
+the worst page.
+
+Usage (from the repository root):
+    uv run python -m benchmark.pdf_size --attachments 4 --output pdf_size.json
+"""
+from typing import Any, Dict, List
+import argparse
+import io
+import json
+import math
+import os
+import sys
+import time
+
+from benchmark.stubs import BENCHMARK_DIR, ROOT_DIR, install_database_stub, install_pipeline_stubs
+from benchmark.synthetic_patient import generate_patient_data
+from benchmark.run_benchmark import _git_commit
+
+BASELINE_PRESET = "baseline"
+PRESETS: Dict[str, Dict[str, Any]] = {
+    # What reports were rendered with before the options existed
+    BASELINE_PRESET: {
+        "optimize_images": False, "dpi": 0, "full_fonts": False, "uncompressed_pdf": False,
+        "attachment_mode": "image", "attachment_image_format": "png",
+    },
+    "full_fonts": {
+        "optimize_images": False, "dpi": 0, "full_fonts": True, "uncompressed_pdf": False,
+        "attachment_image_format": "png",
+    },
+    "optimized_png": {
+        "optimize_images": True, "dpi": 150, "full_fonts": False, "uncompressed_pdf": False,
+        "attachment_image_format": "png",
+    },
+    # The shipped defaults
+    "default": {},
+    "aggressive": {
+        "optimize_images": True, "dpi": 110, "jpeg_quality": 70, "full_fonts": False, "uncompressed_pdf": False,
+        "attachment_image_format": "jpeg", "attachment_jpeg_quality": 70,
+    },
+    # Attachment pages drawn as vectors from the source PDF instead of rasterised
+    "vector_attachments": {"attachment_mode": "vector"},
+}
+
+
+def _local_path(report_url: str) -> str:
+    """Where the local storage stub put an uploaded report"""
+    bucket_and_blob = report_url.split("https://storage.googleapis.com/", 1)[1]
+    return os.path.join(BENCHMARK_DIR, "gcs", bucket_and_blob)
+
+
+def rasterize(pdf_path: str, dpi: int) -> List[bytes]:
+    import fitz  # PyMuPDF
+
+    with fitz.open(pdf_path) as document:
+        return [page.get_pixmap(dpi=dpi, alpha=False).tobytes("png") for page in document]
+
+
+def psnr(reference: bytes, candidate: bytes) -> float:
+    """Peak signal-to-noise ratio of two rasterised pages, in dB"""
+    from PIL import Image, ImageChops, ImageStat
+
+    reference_image = Image.open(io.BytesIO(reference)).convert("RGB")
+    candidate_image = Image.open(io.BytesIO(candidate)).convert("RGB")
+    if candidate_image.size != reference_image.size:
+        candidate_image = candidate_image.resize(reference_image.size)
+    squared_errors = ImageStat.Stat(ImageChops.difference(reference_image, candidate_image)).sum2
+    pixels = reference_image.size[0] * reference_image.size[1]
+    mse = sum(squared_errors) / (pixels * len(squared_errors))
+    return math.inf if mse == 0 else 20 * math.log10(255 / math.sqrt(mse))
+
+
+def run_pdf_size_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    os.chdir(ROOT_DIR)
+    os.makedirs("tmp", exist_ok=True)
+    install_database_stub()
+
+    import agent.report_generator_agent as agent_module
+
+    install_pipeline_stubs(agent_module)
+    agent = agent_module.AgentReportGenerator()
+
+    patient_data = generate_patient_data(
+        lab_panels=args.lab_panels,
+        tests_per_panel=args.tests_per_panel,
+        electromedical_attachments=args.attachments,
+        prescreening_sections=args.prescreening_sections,
+        language=args.language,
+        seed=0,
+    )
+    agent.run_with_data(dict(patient_data))  # warm-up: fonts, templates
+
+    presets = {name: PRESETS[name] for name in args.presets} if args.presets else PRESETS
+    if BASELINE_PRESET not in presets:
+        presets = {BASELINE_PRESET: PRESETS[BASELINE_PRESET], **presets}
+
+    results: Dict[str, Dict[str, Any]] = {}
+    baseline_pages: List[bytes] = []
+    for name, options in presets.items():
+        render_seconds = []
+        for _ in range(args.repeat):
+            start_time = time.perf_counter()
+            report_url = agent.run_with_data(dict(patient_data, render_options=options))
+            render_seconds.append(time.perf_counter() - start_time)
+
+        pages = rasterize(_local_path(report_url), args.compare_dpi)
+        if name == BASELINE_PRESET:
+            baseline_pages = pages
+        page_psnr = [psnr(reference, candidate) for reference, candidate in zip(baseline_pages, pages)]
+        size_bytes = os.path.getsize(_local_path(report_url))
+        results[name] = {
+            "options": dict(agent_module.REPORT_RENDER_OPTIONS, **options),
+            "size_bytes": size_bytes,
+            "render_seconds": min(render_seconds),
+            "pages": len(pages),
+            "psnr_db_mean": _json_float(sum(page_psnr) / len(page_psnr)) if page_psnr else None,
+            "psnr_db_worst": _json_float(min(page_psnr)) if page_psnr else None,
+        }
+
+    baseline_size = results[BASELINE_PRESET]["size_bytes"]
+    for result in results.values():
+        result["size_vs_baseline"] = round(result["size_bytes"] / baseline_size, 3) if baseline_size else None
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "params": {
+            "lab_panels": args.lab_panels,
+            "tests_per_panel": args.tests_per_panel,
+            "attachments": args.attachments,
+            "prescreening_sections": args.prescreening_sections,
+            "language": args.language,
+            "compare_dpi": args.compare_dpi,
+        },
+        "presets": results,
+    }
+
+
+def _json_float(value: float) -> Any:
+    return "inf" if math.isinf(value) else round(value, 2)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare PDF size and visual quality across render options")
+    parser.add_argument("--presets", nargs="*", choices=list(PRESETS), help="Presets to run (baseline is always included)")
+    parser.add_argument("--repeat", type=int, default=3, help="Renders per preset (the fastest is reported)")
+    parser.add_argument("--compare-dpi", type=int, default=100, help="Resolution pages are rasterised at for PSNR")
+    parser.add_argument("--lab-panels", type=int, default=5)
+    parser.add_argument("--tests-per-panel", type=int, default=8)
+    parser.add_argument("--attachments", type=int, default=3)
+    parser.add_argument("--prescreening-sections", type=int, default=3)
+    parser.add_argument("--language", default="id", choices=["id", "en"])
+    parser.add_argument("--output", help="Write the JSON result to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = json.dumps(run_pdf_size_benchmark(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+End-to-end benchmark of the report pipeline with local stand-ins for DB, GCS and Drive.
+
+Usage (from the repository root):
+    uv run python -m benchmark.run_benchmark --iterations 10 --lab-panels 8 --attachments 4 --output bench.json
+
+Emits one JSON document with per-node and end-to-end timings so runs can be compared
+across commits (see compare_results for a quick diff of two result files).
+"""
+from typing import Any, Dict, List
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmark.stubs import ROOT_DIR, install_database_stub, install_pipeline_stubs
+from benchmark.synthetic_patient import generate_patient_data
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Distribution summary of a list of samples"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    return {
+        "count": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "min": ordered[0],
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "p99": percentile(99),
+        "max": ordered[-1],
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    os.chdir(ROOT_DIR)
+    os.makedirs("tmp", exist_ok=True)
+    install_database_stub()
+
+    # Imported after the stubs are in place: the agent binds helper.database at import time
+    import agent.report_generator_agent as agent_module
+    from helper.metrics import metrics
+
+    install_pipeline_stubs(agent_module)
+    agent = agent_module.AgentReportGenerator()
+
+    node_samples: Dict[str, List[float]] = {}
+    metric_samples: Dict[str, List[float]] = {}
+    total_samples: List[float] = []
+
+    for iteration in range(args.warmup + args.iterations):
+        patient_data = generate_patient_data(
+            lab_panels=args.lab_panels,
+            tests_per_panel=args.tests_per_panel,
+            electromedical_attachments=args.attachments,
+            prescreening_sections=args.prescreening_sections,
+            language=args.language,
+            seed=iteration,
+        )
+        metrics.reset()
+        start_time = time.perf_counter()
+        agent.run_with_data(patient_data)
+        elapsed = time.perf_counter() - start_time
+
+        if iteration < args.warmup:
+            continue
+
+        total_samples.append(elapsed)
+        snapshot = metrics.snapshot()
+        for labels, value in snapshot.get("report_node_duration_seconds", {}).items():
+            node_samples.setdefault(labels.replace("node=", ""), []).append(value["sum"])
+        for name, series in snapshot.items():
+            if name == "report_node_duration_seconds":
+                continue
+            for labels, value in series.items():
+                key = name if labels == "_" else f"{name}{{{labels}}}"
+                metric_samples.setdefault(key, []).append(value["sum"])
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "lab_panels": args.lab_panels,
+            "tests_per_panel": args.tests_per_panel,
+            "attachments": args.attachments,
+            "prescreening_sections": args.prescreening_sections,
+            "language": args.language,
+        },
+        "run_with_data": summarize(total_samples),
+        "nodes": {node: summarize(samples) for node, samples in node_samples.items()},
+        "metrics": {name: summarize(samples) for name, samples in metric_samples.items()},
+    }
+
+
+def compare_results(baseline: Dict[str, Any], candidate: Dict[str, Any]) -> Dict[str, float]:
+    """Relative change of the mean (candidate vs baseline) for run_with_data and each node"""
+    def change(before: Dict[str, float], after: Dict[str, float]) -> float:
+        if not before or not after or not before.get("mean"):
+            return float("nan")
+        return (after["mean"] - before["mean"]) / before["mean"]
+
+    result = {"run_with_data": change(baseline["run_with_data"], candidate["run_with_data"])}
+    for node, stats in candidate["nodes"].items():
+        result[node] = change(baseline["nodes"].get(node, {}), stats)
+    return result
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the report generation pipeline")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed iterations (imports, font loading)")
+    parser.add_argument("--lab-panels", type=int, default=5)
+    parser.add_argument("--tests-per-panel", type=int, default=8)
+    parser.add_argument("--attachments", type=int, default=3, help="Electromedical PDF attachments per patient")
+    parser.add_argument("--prescreening-sections", type=int, default=3)
+    parser.add_argument("--language", default="id", choices=["id", "en"])
+    parser.add_argument("--output", help="Write the JSON result to this file instead of stdout")
+    parser.add_argument("--compare", help="Baseline result file to compare against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = run_benchmark(args)
+
+    if args.compare:
+        with open(args.compare) as f:
+            result["comparison"] = compare_results(json.load(f), result)
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
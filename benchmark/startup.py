@@ -0,0 +1,148 @@
+"""
+Cold-start benchmark of the API server.
+
+Measures, in fresh interpreters:
+- import cost of run_api_server via `python -X importtime` (total and the heaviest modules)
+- time until uvicorn answers its first HTTP request (--serve)
+
+Usage (from the repository root):
+    uv run python -m benchmark.startup --repeat 5 --serve --output startup.json
+"""
+from typing import Any, Dict, List, Optional
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from benchmark.stubs import ROOT_DIR
+from benchmark.run_benchmark import _git_commit, summarize
+
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """Parse `-X importtime` lines: 'import time: self [us] | cumulative | imported package'"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        entries.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip())) // 2,
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+        })
+    return entries
+
+
+def measure_imports(module: str) -> Dict[str, Any]:
+    started_at = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR, capture_output=True, text=True,
+    )
+    wall_seconds = time.perf_counter() - started_at
+    entries = parse_importtime(completed.stderr)
+    target = next((entry for entry in entries if entry["module"] == module), None)
+
+    # Aggregate self time per top-level package (e.g. all of weasyprint.*)
+    packages: Dict[str, int] = {}
+    for entry in entries:
+        package = entry["module"].split(".", 1)[0]
+        packages[package] = packages.get(package, 0) + entry["self_us"]
+
+    return {
+        "ok": completed.returncode == 0,
+        "error": completed.stderr.strip().splitlines()[-1] if completed.returncode else None,
+        "wall_seconds": wall_seconds,
+        "import_seconds": target["cumulative_us"] / 1e6 if target else None,
+        "modules_imported": len(entries),
+        "packages": packages,
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_first_response(path: str, timeout: float) -> Optional[float]:
+    """Seconds from spawning uvicorn until it answers `path` (any HTTP status counts)"""
+    port = _free_port()
+    started_at = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "run_api_server:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=ROOT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        env=dict(os.environ, API_WARMUP=os.getenv("API_WARMUP", "true")),
+    )
+    try:
+        while time.perf_counter() - started_at < timeout:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=1)
+                return time.perf_counter() - started_at
+            except urllib.error.HTTPError:
+                return time.perf_counter() - started_at
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.02)
+        return None
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def run_startup_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    import_runs = [measure_imports(args.module) for _ in range(args.repeat)]
+    packages: Dict[str, List[int]] = {}
+    for run in import_runs:
+        for package, self_us in run["packages"].items():
+            packages.setdefault(package, []).append(self_us)
+    heaviest = sorted(packages.items(), key=lambda item: -sum(item[1]) / len(item[1]))[:args.top]
+
+    result = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "module": args.module,
+        "import_ok": all(run["ok"] for run in import_runs),
+        "import_error": next((run["error"] for run in import_runs if run["error"]), None),
+        "import_seconds": summarize([run["import_seconds"] for run in import_runs if run["import_seconds"] is not None]),
+        "interpreter_wall_seconds": summarize([run["wall_seconds"] for run in import_runs]),
+        "modules_imported": import_runs[-1]["modules_imported"],
+        "heaviest_packages_ms": {package: round(sum(values) / len(values) / 1000, 1) for package, values in heaviest},
+    }
+
+    if args.serve:
+        samples = [measure_first_response(args.path, args.serve_timeout) for _ in range(args.repeat)]
+        result["first_response_seconds"] = summarize([sample for sample in samples if sample is not None])
+        result["first_response_failures"] = sum(1 for sample in samples if sample is None)
+    return result
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark API server cold start")
+    parser.add_argument("--module", default="run_api_server")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Heaviest packages to list")
+    parser.add_argument("--serve", action="store_true", help="Also time uvicorn until the first response")
+    parser.add_argument("--path", default="/healthcheck")
+    parser.add_argument("--serve-timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="Write the JSON result to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = json.dumps(run_startup_benchmark(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
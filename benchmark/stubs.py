@@ -0,0 +1,163 @@
+"""
+Local stand-ins for the database, Google Cloud Storage and Google Drive, so the report
+pipeline can be benchmarked without network access or credentials.
+
+install_database_stub() must run before anything imports helper.database.
+"""
+from typing import Any, Dict, List, Optional
+import os
+import shutil
+import sys
+import types
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_DIR = os.path.join(ROOT_DIR, "tmp", "benchmark")
+
+
+class StubDatabase:
+    """Answers the pipeline's queries from memory and records writes"""
+
+    def __init__(self, customize_variables: Optional[Dict[str, str]] = None):
+        self.customize_variables = customize_variables or {}
+        self.executed: List[Any] = []
+
+    def fetch_query(self, query, params=None):
+        if "b2b_bumame_appointment_customize_variable" in query:
+            return list(self.customize_variables.items())
+        return []
+
+    def execute_query(self, query, params=None):
+        self.executed.append((query, params))
+        return True
+
+    def execute_values(self, query, rows, template=None, page_size=500):
+        self.executed.append((query, list(rows)))
+        return len(rows)
+
+    def set_max_connections(self, max_connections: int):
+        pass
+
+    def close_all(self):
+        pass
+
+
+def install_database_stub(customize_variables: Optional[Dict[str, str]] = None) -> StubDatabase:
+    """Replace helper.database with an in-memory module before the pipeline imports it"""
+    db = StubDatabase(customize_variables)
+    module = types.ModuleType("helper.database")
+
+    class DatabaseError(Exception):
+        def __init__(self, message, original_error=None):
+            self.message = message
+            self.original_error = original_error
+            super().__init__(self.message)
+
+    module.DatabaseError = DatabaseError
+    module.db_postgres = db
+    sys.modules["helper.database"] = module
+    return db
+
+
+class _LocalBlob:
+    def __init__(self, root: str, name: str):
+        self.path = os.path.join(root, name)
+
+    def upload_from_filename(self, filename: str, **kwargs):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        shutil.copyfile(filename, self.path)
+
+    def download_to_filename(self, filename: str, **kwargs):
+        shutil.copyfile(self.path, filename)
+
+    def download_to_file(self, file_obj, **kwargs):
+        with open(self.path, "rb") as f:
+            shutil.copyfileobj(f, file_obj)
+
+
+class _LocalBucket:
+    def __init__(self, root: str):
+        self.root = root
+
+    def blob(self, name: str) -> _LocalBlob:
+        return _LocalBlob(self.root, name)
+
+
+class LocalStorageClient:
+    """Drop-in for google.cloud.storage.Client writing under tmp/benchmark/gcs"""
+
+    def __init__(self, *args, **kwargs):
+        self.root = os.path.join(BENCHMARK_DIR, "gcs")
+
+    def bucket(self, name: str) -> _LocalBucket:
+        return _LocalBucket(os.path.join(self.root, name))
+
+
+def make_attachment_pdf(pages: int = 1) -> bytes:
+    """A small vector PDF resembling an EKG/spirometri printout"""
+    import fitz
+
+    document = fitz.open()
+    for page_number in range(pages):
+        page = document.new_page(width=842, height=595)  # A4 landscape
+        page.insert_text((40, 40), f"Synthetic attachment, page {page_number + 1}", fontsize=14)
+        for row in range(12):
+            y = 80 + row * 40
+            points = [fitz.Point(40 + x * 8, y + (12 if (x + row) % 9 == 0 else 0)) for x in range(95)]
+            page.draw_polyline(points, color=(0, 0, 0), width=0.6)
+    pdf_bytes = document.tobytes()
+    document.close()
+    return pdf_bytes
+
+
+class _StubResponse:
+    def __init__(self, content: bytes, status_code: int = 200):
+        self.content = content
+        self.status_code = status_code
+        self.headers = {"Content-Type": "application/pdf", "Content-Length": str(len(content))}
+
+    def iter_content(self, chunk_size: int = 65536):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StubDrive:
+    """Stands in for the `requests` module the attachment fetcher downloads Google Drive files with"""
+
+    def __init__(self, pdf_bytes: Optional[bytes] = None):
+        self.pdf_bytes = pdf_bytes or make_attachment_pdf()
+        self.calls = 0
+
+    def get(self, url, **kwargs) -> _StubResponse:
+        self.calls += 1
+        return _StubResponse(self.pdf_bytes)
+
+
+def install_pipeline_stubs(agent_module) -> Dict[str, Any]:
+    """Point the report generator agent module at the local stand-ins"""
+    from helper import attachment_fetcher
+
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    drive = StubDrive()
+    agent_module.storage = types.SimpleNamespace(Client=LocalStorageClient)
+    attachment_fetcher.requests = drive
+
+    def download_from_gcs(bucket_name: str, source_blob_name: str, destination_file_name: Optional[str] = None) -> str:
+        destination_path = os.path.join("tmp", destination_file_name or os.path.basename(source_blob_name))
+        with open(destination_path, "wb") as f:
+            f.write(drive.pdf_bytes)
+        return destination_path
+
+    agent_module.download_from_gcs = download_from_gcs
+    return {"drive": drive}
@@ -0,0 +1,159 @@
+from typing import Any, Dict, List
+import random
+
+# Attachment types rendered from a downloaded PDF (audiometri is charted from its diagnosis data)
+ELECTROMEDICAL_TYPES = ["rontgen", "ekg", "spirometri", "treadmill", "usg_abdomen", "usg_mammae"]
+
+PHYSICAL_EXAMINATION_LABELS = [
+    "Kepala & Leher", "Kelenjar Tiroid/Gondok", "Kelenjar Limfe", "Kulit", "Status Mental", "Keadaan Umum",
+    "Mata", "Kelainan Mata", "Buta Warna", "Telinga", "Tenggorokan", "Tonsil", "Hidung", "Sinus", "Gigi",
+    "Dada", "Paru", "Jantung", "Abdomen", "Hati", "Ginjal", "Tulang Belakang", "Neurologis", "Extrimitas",
+    "CARPAL TUNNEL SYNDROME - Tinel", "CARPAL TUNNEL SYNDROME - Phalen", "LOW BACK PAIN - Lasegue",
+    "ROMBERG TEST - Terbuka", "SMELL TEST - Smell",
+]
+
+LAB_TESTS = [
+    ("Hemoglobin (HGB)", "g/dL", "13.5 - 17.5"),
+    ("Leukosit (WBC)", "10^3/uL", "4.0 - 10.0"),
+    ("Trombosit (PLT)", "10^3/uL", "150 - 400"),
+    ("Hematokrit (HCT)", "%", "40 - 52"),
+    ("SGOT / AST", "U/L", "< 40"),
+    ("SGPT / ALT", "U/L", "< 41"),
+    ("Glukosa Puasa", "mg/dL", "70 - 100"),
+    ("Kolesterol Total", "mg/dL", "< 200"),
+    ("Trigliserida", "mg/dL", "< 150"),
+    ("Asam Urat", "mg/dL", "3.4 - 7.0"),
+    ("Kreatinin", "mg/dL", "0.7 - 1.2"),
+    ("Ureum", "mg/dL", "15 - 40"),
+]
+
+
+def _pairs(rng: random.Random, prefix: str, count: int) -> List[List[str]]:
+    return [
+        [f"{chr(ord('a') + i % 26)}. {prefix} {i + 1}", rng.choice(["Tidak Ada", "Ada", "Ya", "Tidak", "-"])]
+        for i in range(count)
+    ]
+
+
+def _lab_results(rng: random.Random, panel_count: int, tests_per_panel: int) -> Dict[str, Any]:
+    sections = {}
+    for panel in range(panel_count):
+        subsections = {}
+        for test in range(tests_per_panel):
+            name, unit, reference = LAB_TESTS[(panel * tests_per_panel + test) % len(LAB_TESTS)]
+            value = round(rng.uniform(1, 300), 1)
+            subsections[f"test_{panel}_{test}"] = {
+                "name": name,
+                "hasil": f"{value} *" if rng.random() < 0.15 else str(value),
+                "satuan": unit,
+                "nilai_rujukan": reference,
+                "keterangan": rng.choice(["Normal", "Tinggi", "-"]),
+                "biosys_code": f"LAB{panel:02d}{test:02d}",
+            }
+        sections[f"panel_{panel}"] = {"name": f"PANEL {panel + 1}", "subsections": subsections}
+
+    return {
+        "header": {
+            "no_barcode": "2507283091",
+            "tanggal_periksa": "2025-07-28 00:00:00",
+            "nama": "Pasien Sintetis",
+            "tgl_lahir": "1989-07-21 00:00:00",
+            "jenis_kelamin": "Perempuan",
+            "lokasi_pengambilan": "HO",
+            "perusahaan": "PT. Benchmark Sejahtera",
+            "nohp": "",
+            "alamat": "JAKARTA",
+        },
+        "sections": sections,
+    }
+
+
+def _electromedical(rng: random.Random, attachment_count: int) -> Dict[str, Any]:
+    electromedical = {}
+    for i in range(attachment_count):
+        exam_type = ELECTROMEDICAL_TYPES[i % len(ELECTROMEDICAL_TYPES)]
+        key = exam_type if i < len(ELECTROMEDICAL_TYPES) else f"{exam_type}_{i}"
+        electromedical[key] = {
+            "title": key,
+            "subtitle": key,
+            "hasil": "Dalam batas normal.\nTidak tampak kelainan.",
+            "kesimpulan": rng.choice(["Normal", "Sinus Rhythm", "Dalam batas normal"]),
+            "saran": "Pola hidup sehat dan olahraga teratur",
+            "dokter": {"name": "dr. Benchmark", "title": "Dokter Pemeriksa"},
+            "url": f"https://drive.google.com/file/d/synthetic{i:04d}/view",
+        }
+    return electromedical
+
+
+def generate_patient_data(
+    lab_panels: int = 5,
+    tests_per_panel: int = 8,
+    electromedical_attachments: int = 3,
+    prescreening_sections: int = 3,
+    items_per_section: int = 5,
+    language: str = "id",
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """
+    Build a patient_data dict shaped like PatientService.get_patient_data() output.
+    Values are deterministic for a given seed so runs are comparable across commits.
+    """
+    rng = random.Random(seed)
+    patient_id = f"synthetic-{seed}"
+    appointment_id = "synthetic-appointment"
+
+    keluhan_sekarang = {
+        "riwayat_penyakit_sendiri": _pairs(rng, "Riwayat Penyakit", items_per_section),
+        "riwayat_penyakit_keluarga": _pairs(rng, "Riwayat Penyakit", items_per_section),
+        "kebiasaan": _pairs(rng, "Kebiasaan", items_per_section),
+    }
+    # Sections beyond the three fixed ones are rendered as dynamic sections
+    for i in range(max(0, prescreening_sections - 3)):
+        keluhan_sekarang[f"Pertanyaan Tambahan {i + 1}"] = _pairs(rng, "Pertanyaan", items_per_section)
+
+    return {
+        "patient_id": patient_id,
+        "appointment_id": appointment_id,
+        "company": "PT. Benchmark Sejahtera",
+        "patient_photo_url": None,
+        "nik": "0000000000000000",
+        "nama": "Pasien Sintetis",
+        "tanggal_lahir": "21-07-1989",
+        "jenis_kelamin": "Perempuan",
+        "kelompok": "-",
+        "checkin_date": "28-07-2025",
+        "identity": {
+            "basic_info": [
+                ["NIK", "0000000000000000"],
+                ["Nama", "Pasien Sintetis"],
+                ["Tanggal Lahir", "21-07-1989"],
+                ["Tanggal Pemeriksaan", "28-07-2025"],
+            ],
+            "extended_info": [["Jenis Kelamin", "Perempuan"], ["Kelompok", "-"]],
+        },
+        "keluhan_sekarang": keluhan_sekarang,
+        "pemeriksaan_fisik": [[label, rng.choice(["Normal", "Tidak Normal", "Caries"])] for label in PHYSICAL_EXAMINATION_LABELS],
+        "vital_signs": [
+            ["Tensi (mmHg)", "120/80"],
+            ["Nadi (X/menit)", "80"],
+            ["Suhu", "36.5 c"],
+            ["Berat Badan (kg)", str(rng.randint(50, 95))],
+            ["Tinggi Badan (cm)", str(rng.randint(150, 185))],
+            ["BMI", ""],
+            ["Visus Mata Kanan", "6/6"],
+            ["Visus Mata Kiri", "6/6"],
+        ],
+        "laboratory_results": _lab_results(rng, lab_panels, tests_per_panel),
+        "electromedical_examination": _electromedical(rng, electromedical_attachments),
+        "conclusions": [
+            ["Hasil Darah", "Peningkatan Kolesterol Total (220 *)"],
+            ["Tanda Vital", "Prahipertensi (116/85)"],
+            ["Pemeriksaan Fisik", "Caries"],
+        ],
+        "advice": "Olahraga ringan rutin 3x dalam seminggu.\nMenjaga asupan makan.",
+        "analysis": "Fit with note",
+        "doctor": {"name": "dr. Benchmark", "title": "Dokter Pemeriksa"},
+        "status": "Completed",
+        "filename": f"benchmark_{patient_id}",
+        "language": language,
+    }
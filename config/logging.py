@@ -1,5 +1,16 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
 import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional, Pattern
 
 # Check if colorama is installed, if not, install it
 try:
@@ -13,6 +24,158 @@ except ImportError:
 # Initialize colorama
 init(autoreset=True)
 
+# "color" (human readable, default) or "json" (one object per line, for Cloud Logging)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "color").strip().lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+# Write through a background thread so log I/O never blocks rendering or the event loop
+LOG_ASYNC = os.getenv("LOG_ASYNC", "true" if LOG_FORMAT == "json" else "false").strip().lower() == "true"
+# Longest message / extra field written, longer values are truncated
+LOG_MAX_FIELD_LENGTH = int(os.getenv("LOG_MAX_FIELD_LENGTH", 2000))
+# Default keep-rate for records logged with extra={"sample_rate": ...} and no explicit rate
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.01))
+
+# Keys that hold patient identifying information (PHI) and are never written as-is
+PHI_KEYS = {
+    "nik", "nama", "name", "patient_name", "tanggal_lahir", "tgl_lahir", "birth_date",
+    "nohp", "phone", "alamat", "address", "no_identitas_ktp_sim", "patient_photo_url",
+    "d_day_photo_proof_url", "npk",
+}
+# Indonesian NIK (16 digits) and mobile numbers appearing in free text
+NIK_PATTERN = re.compile(r"\b\d{16}\b")
+PHONE_PATTERN = re.compile(r"(?<![\d+])(?:\+62|62|0)8\d{7,11}\b")
+REDACTED = "[REDACTED]"
+# PHI values of the patient being processed (see mask_patient_phi), masked wherever they appear
+_patient_phi_pattern: ContextVar[Optional[Pattern]] = ContextVar("patient_phi_pattern", default=None)
+
+_RESERVED_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample_rate"}
+
+
+def truncate(value: str, max_length: int = LOG_MAX_FIELD_LENGTH) -> str:
+    """Cap a string to max_length characters, keeping a note of how much was cut"""
+    if len(value) <= max_length:
+        return value
+    return f"{value[:max_length]}...[truncated {len(value) - max_length} chars]"
+
+
+def mask_patient_phi(patient_data: Dict[str, Any]) -> None:
+    """
+    Mask the PHI values of this patient payload (name, NIK, birth date...) in every message logged
+    by the current task or thread from now on, including threads it starts with asyncio.to_thread.
+    Free text can't be told apart from a name, so the known values are matched instead.
+    """
+    values = set()
+    for key, value in patient_data.items():
+        if str(key).lower() in PHI_KEYS and isinstance(value, str) and len(value.strip()) >= 3:
+            values.add(value.strip())
+            # As it appears in report filenames
+            values.add("".join(c for c in value.strip() if c.isalnum() or c.isspace()).replace(" ", "_"))
+    _patient_phi_pattern.set(_values_pattern(values))
+
+
+def _values_pattern(values: Iterable[str]) -> Optional[Pattern]:
+    values = sorted((value for value in values if value), key=len, reverse=True)
+    if not values:
+        return None
+    return re.compile("|".join(re.escape(value) for value in values), re.IGNORECASE)
+
+
+def redact_text(text: str) -> str:
+    """Mask NIKs, phone numbers and the current patient's PHI values in free text"""
+    text = PHONE_PATTERN.sub(REDACTED, NIK_PATTERN.sub(REDACTED, text))
+    pattern = _patient_phi_pattern.get()
+    return pattern.sub(REDACTED, text) if pattern else text
+
+
+def redact(value):
+    """Return a copy of a (nested) dict/list with PHI values replaced"""
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if str(key).lower() in PHI_KEYS else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    if isinstance(value, str):
+        return redact_text(value)
+    return value
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Drop a share of high-volume records. Only records logged with
+    extra={"sample_rate": <0..1 or None>} are sampled; every other record passes.
+    """
+    def filter(self, record):
+        if not hasattr(record, "sample_rate"):
+            return True
+        rate = record.sample_rate if record.sample_rate is not None else LOG_SAMPLE_RATE
+        return random.random() < rate
+
+
+class RedactingFilter(logging.Filter):
+    """
+    Mask PHI in messages and structured extra fields before they reach any handler. Attached to
+    the queueing handler, so it runs on the caller's thread before the record is queued: that is
+    where the mask_patient_phi ContextVar holds the current patient's values.
+    """
+    def filter(self, record):
+        message = record.getMessage()
+        redacted_message = truncate(redact_text(message))
+        if redacted_message != message:
+            record.msg = redacted_message
+            record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        if record.exc_text:
+            # Formatters use exc_text when it is set, so only the redacted traceback is written
+            record.exc_text = redact_text(record.exc_text)
+        for key, value in list(vars(record).items()):
+            if key not in _RESERVED_RECORD_ATTRIBUTES:
+                setattr(record, key, REDACTED if key.lower() in PHI_KEYS else redact(value))
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with size-capped fields"""
+    def format(self, record):
+        payload = {
+            "timestamp": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": truncate(record.getMessage()),
+        }
+        for key, value in vars(record).items():
+            if key in _RESERVED_RECORD_ATTRIBUTES:
+                continue
+            try:
+                encoded = json.dumps(value, default=str)
+            except (TypeError, ValueError):
+                encoded = json.dumps(str(value))
+            payload[key] = json.loads(encoded) if len(encoded) <= LOG_MAX_FIELD_LENGTH else truncate(encoded)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            # Set (and redacted) before the record was queued when logging is async
+            payload["exception"] = truncate(record.exc_text, LOG_MAX_FIELD_LENGTH * 4)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class TracebackQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that keeps the traceback as exc_text (QueueHandler.prepare drops it, and folds it
+    into the message) and leaves formatting to the handler behind the queue
+    """
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            # Traceback objects can't wait in the queue: format it here
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+
 class Logger:
     """Logger class that logs messages to the console with color formatting."""
 
@@ -31,7 +194,7 @@ class Logger:
             log_message = super().format(record)
             return f"{log_color}{log_message}{Fore.RESET}"
 
-    def __init__(self, name=__name__, level=logging.INFO):
+    def __init__(self, name=__name__, level=getattr(logging, LOG_LEVEL, logging.INFO)):
         self.logger = logging.getLogger(name)
         self.logger.setLevel(level)
 
@@ -40,15 +203,34 @@ class Logger:
         console_handler.setLevel(level)
 
         # Custom formatter
-        formatter = self.ColoredFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        if LOG_FORMAT == "json":
+            formatter = JsonFormatter()
+        else:
+            formatter = self.ColoredFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         console_handler.setFormatter(formatter)
 
         # Avoid adding multiple handlers
         if not self.logger.hasHandlers():
-            self.logger.addHandler(console_handler)
+            handler = console_handler
+            if LOG_ASYNC:
+                # The caller only enqueues the record; a background thread formats and writes it
+                log_queue = queue.SimpleQueue()
+                handler = TracebackQueueHandler(log_queue)
+                self.listener = logging.handlers.QueueListener(log_queue, console_handler, respect_handler_level=True)
+                self.listener.start()
+                atexit.register(self.listener.stop)
+                # Forked children (render workers) inherit the queue but not the thread
+                if hasattr(os, "register_at_fork"):
+                    os.register_at_fork(after_in_child=self.listener.start)
+
+            # Both run on the caller: dropped records cost nothing further, and redaction needs
+            # the caller's context (mask_patient_phi) and must happen before anything is queued
+            handler.addFilter(SamplingFilter())
+            handler.addFilter(RedactingFilter())
+            self.logger.addHandler(handler)
 
     def get_logger(self):
         return self.logger
 
 # Usage example
-logger = Logger().get_logger()
\ No newline at end of file
+logger = Logger().get_logger()
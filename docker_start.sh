@@ -6,6 +6,9 @@ if [ "$WORKER_TYPE" = "api_server" ]; then
 elif [ "$WORKER_TYPE" = "consumer_server" ]; then
     echo "Running in consumer server mode..."
     uv run report_consumer.py
+elif [ "$WORKER_TYPE" = "report_listener" ]; then
+    echo "Running in report listener mode..."
+    uv run report_listener.py
 else
     echo "Running nothing. Only eternity."
 fi
@@ -0,0 +1,250 @@
+from typing import Any, Dict, List, Optional, Tuple
+from config.logging import logger
+from helper.singleton import singleton
+from helper.attachment_fetcher import AttachmentFetcher
+from PIL import Image, ImageOps
+from pathlib import Path
+import hashlib
+import html
+import io
+import json
+import math
+import os
+import threading
+import time
+import uuid
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets")
+ASSET_BUNDLE_DIR = os.getenv('ASSET_BUNDLE_DIR', os.path.join(ASSETS_DIR, "optimized"))
+ASSET_BUNDLE_MANIFEST = os.path.join(ASSET_BUNDLE_DIR, "manifest.json")
+# Assets are resized for this output resolution (the default report dpi)
+ASSET_BUNDLE_DPI = int(os.getenv('ASSET_BUNDLE_DPI', os.getenv('REPORT_PDF_DPI', 150)) or 150)
+ASSET_BUNDLE_JPEG_QUALITY = int(os.getenv('ASSET_BUNDLE_JPEG_QUALITY', 85))
+# Company headers/footers from customize variables are fetched again after this long
+ASSET_BUNDLE_REMOTE_TTL_SECONDS = float(os.getenv('ASSET_BUNDLE_REMOTE_TTL_SECONDS', 24 * 3600))
+# A source that could not be bundled is used as is for this long before it is tried again
+ASSET_BUNDLE_RETRY_SECONDS = float(os.getenv('ASSET_BUNDLE_RETRY_SECONDS', 300))
+
+# Box (width, height) in CSS px each role is drawn in by reports.html / print.css:
+# header and footer span the A4 page (210mm), signatures are 80px high
+ASSET_ROLE_BOX_PX = {
+    "header": (794, None),
+    "footer": (794, None),
+    "signature": (None, 80),
+}
+
+# Bundled with the image, built by `python -m helper.asset_bundle`
+STATIC_ASSETS = {
+    "top-bumame.png": "header",
+    "bottom-bumame.png": "footer",
+    "internal_reza_signature.png": "signature",
+    "penanggung_jawab_dwi_utomo_signature.jpg": "signature",
+    "pemeriksa_yaufita_signature.jpg": "signature",
+}
+
+
+def optimize_image(image_bytes: bytes, role: str) -> Tuple[bytes, str, Tuple[int, int]]:
+    """
+    Downscale an image to its rendered size at ASSET_BUNDLE_DPI (never up) and recompress it.
+    JPEG sources stay JPEG; everything else becomes PNG, without its alpha channel if it is opaque.
+    Returns (bytes, extension, (width, height)).
+    """
+    box_width, box_height = ASSET_ROLE_BOX_PX[role]
+    scale = ASSET_BUNDLE_DPI / 96
+    with Image.open(io.BytesIO(image_bytes)) as source:
+        source_format = source.format
+        image = ImageOps.exif_transpose(source)
+        if box_width:
+            width = math.ceil(box_width * scale)
+            size = (width, max(1, round(image.height * width / image.width)))
+        else:
+            height = math.ceil(box_height * scale)
+            size = (max(1, round(image.width * height / image.height)), height)
+        if size[0] < image.width:
+            image = image.resize(size, Image.Resampling.LANCZOS)
+
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        if has_alpha:
+            image = image.convert("RGBA")
+            if image.getchannel("A").getextrema()[0] == 255:
+                has_alpha = False
+        if not has_alpha and image.mode != "RGB":
+            image = image.convert("RGB")
+
+        output = io.BytesIO()
+        if source_format == "JPEG" and not has_alpha:
+            image.save(output, format="JPEG", quality=ASSET_BUNDLE_JPEG_QUALITY, optimize=True)
+            extension = "jpg"
+        else:
+            image.save(output, format="PNG", optimize=True)
+            extension = "png"
+        return output.getvalue(), extension, image.size
+
+
+@singleton
+class AssetBundle:
+    """
+    Report images (header, footer, signatures) pre-sized for the page and recompressed.
+
+    The bundled assets are built ahead of time into ASSET_BUNDLE_DIR with a manifest; company
+    headers/footers/signatures from customize variables are added the first time they are seen.
+    resolve() maps a source path or URL to the optimised file's URL, and image_cache() gives
+    WeasyPrint an image cache pre-seeded with those images already decoded, so renders neither
+    fetch nor re-encode them.
+    """
+
+    def __init__(self):
+        self.manifest: Dict[str, Dict[str, Any]] = self._load_manifest()
+        self._image_caches: Dict[Tuple, Dict] = {}
+        # key -> time.monotonic() after which bundling it is tried again
+        self._failed: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _load_manifest() -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(ASSET_BUNDLE_MANIFEST) as f:
+                manifest = json.load(f)
+            if manifest.get("dpi") == ASSET_BUNDLE_DPI:
+                return manifest["assets"]
+            logger.info(f"Asset bundle was built for {manifest.get('dpi')} dpi, rebuilding for {ASSET_BUNDLE_DPI}")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable asset manifest {ASSET_BUNDLE_MANIFEST}: {str(e)}")
+        return {}
+
+    def _save_manifest(self) -> None:
+        """Merge into the manifest on disk (other processes may have added entries) and replace it"""
+        on_disk = self._load_manifest()
+        self.manifest = {**on_disk, **self.manifest}
+        temp_path = f"{ASSET_BUNDLE_MANIFEST}.{uuid.uuid4().hex}"
+        with open(temp_path, "w") as f:
+            json.dump({"dpi": ASSET_BUNDLE_DPI, "assets": self.manifest}, f, indent=2, sort_keys=True)
+        os.replace(temp_path, ASSET_BUNDLE_MANIFEST)
+
+    @staticmethod
+    def _is_remote(source: str) -> bool:
+        return source.startswith(("http://", "https://"))
+
+    def _entry_url(self, entry: Optional[Dict[str, Any]]) -> Optional[str]:
+        """file:// URL of a manifest entry, or None if it is missing or due for a refresh"""
+        if not entry:
+            return None
+        path = os.path.join(ASSET_BUNDLE_DIR, entry["path"])
+        if not os.path.exists(path):
+            return None
+        if "fetched_at" in entry and time.time() - entry["fetched_at"] > ASSET_BUNDLE_REMOTE_TTL_SECONDS:
+            return None
+        return Path(path).as_uri()
+
+    def _add(self, key: str, source: str, role: str) -> str:
+        """Optimise one source into the bundle and record it in the manifest; returns its URL"""
+        os.makedirs(ASSET_BUNDLE_DIR, exist_ok=True)
+        name = os.path.splitext(os.path.basename(source))[0]
+        entry: Dict[str, Any] = {"source": key.split(":", 1)[1], "role": role}
+        if self._is_remote(source):
+            # Named after the URL: company asset URLs rarely have a meaningful basename
+            name = f"{role}_{hashlib.sha256(source.encode()).hexdigest()[:12]}"
+            download_path = os.path.join(ASSET_BUNDLE_DIR, f"download_{uuid.uuid4().hex}")
+            try:
+                AttachmentFetcher().fetch_to_file(source, download_path)
+                with open(download_path, "rb") as f:
+                    source_bytes = f.read()
+            finally:
+                if os.path.exists(download_path):
+                    os.remove(download_path)
+            entry["fetched_at"] = time.time()
+        else:
+            with open(source, "rb") as f:
+                source_bytes = f.read()
+
+        optimized, extension, (width, height) = optimize_image(source_bytes, role)
+        filename = f"{name}.{hashlib.sha256(optimized).hexdigest()[:12]}.{extension}"
+        with open(os.path.join(ASSET_BUNDLE_DIR, filename), "wb") as f:
+            f.write(optimized)
+        entry.update(path=filename, width=width, height=height, bytes=len(optimized), source_bytes=len(source_bytes))
+        self.manifest[key] = entry
+        self._save_manifest()
+        # Rebuilt on next use so the new image is pre-decoded too
+        self._image_caches.clear()
+        logger.info(f"Bundled {role} asset {source}: {len(source_bytes)} -> {len(optimized)} bytes, {width}x{height}px")
+        return Path(os.path.join(ASSET_BUNDLE_DIR, filename)).as_uri()
+
+    def resolve(self, source: Optional[str], role: str) -> Optional[str]:
+        """
+        URL of the optimised copy of `source` (a local path or http(s) URL) drawn as `role`.
+        Anything that cannot be bundled is returned unchanged, for WeasyPrint to load as before.
+        """
+        if not source or role not in ASSET_ROLE_BOX_PX:
+            return source
+        if not self._is_remote(source) and not os.path.isfile(source):
+            return source
+
+        key = f"{role}:{os.path.relpath(source, ASSETS_DIR) if not self._is_remote(source) else source}"
+        url = self._entry_url(self.manifest.get(key))
+        if url:
+            return url
+        if self._failed.get(key, 0) > time.monotonic():
+            return source
+        with self._lock:
+            # Another thread may have added it while this one waited, or another process
+            # (e.g. the consumer preparing a shard for its render workers)
+            url = self._entry_url(self.manifest.get(key))
+            if not url:
+                entry = self._load_manifest().get(key)
+                url = self._entry_url(entry)
+                if url:
+                    self.manifest[key] = entry
+                    self._image_caches.clear()
+            if url:
+                return url
+            try:
+                return self._add(key, source, role)
+            except Exception as e:
+                logger.warning(f"Could not bundle {role} asset {source}, using it as is: {str(e)}")
+                self._failed[key] = time.monotonic() + ASSET_BUNDLE_RETRY_SECONDS
+                return source
+
+    def build(self) -> List[Dict[str, Any]]:
+        """(Re)build the bundled STATIC_ASSETS; run at image build time"""
+        entries = []
+        for name, role in STATIC_ASSETS.items():
+            source = os.path.join(ASSETS_DIR, name)
+            key = f"{role}:{name}"
+            self.manifest.pop(key, None)
+            self._add(key, source, role)
+            entries.append(self.manifest[key])
+        return entries
+
+    def image_cache(self, image_options: Dict[str, Any]) -> Dict:
+        """
+        A WeasyPrint `cache` for one render, pre-seeded with every bundled image decoded for
+        `image_options` (optimize_images, jpeg_quality, dpi). Per render, so the report's own
+        images (attachments) do not accumulate in the shared one.
+        """
+        dpi = image_options.get("dpi")
+        if dpi and dpi < ASSET_BUNDLE_DPI:
+            # WeasyPrint would downsample the shared images in place
+            return {}
+        cache_key = tuple(sorted(image_options.items()))
+        shared = self._image_caches.get(cache_key)
+        if shared is None:
+            shared = self._preload(image_options)
+            self._image_caches[cache_key] = shared
+        return dict(shared)
+
+    def _preload(self, image_options: Dict[str, Any]) -> Dict:
+        """Decode every bundled image once by laying out a page that shows them all"""
+        from weasyprint import HTML
+
+        shared: Dict = {}
+        urls = [url for url in (self._entry_url(entry) for entry in list(self.manifest.values())) if url]
+        if urls:
+            images = "".join(f'<img src="{html.escape(url)}">' for url in urls)
+            HTML(string=images).render(cache=shared, **image_options)
+        return shared
+
+
+if __name__ == "__main__":
+    AssetBundle().build()
@@ -0,0 +1,261 @@
+from typing import Dict, Optional
+from urllib.parse import urlparse
+from config.logging import logger
+from helper.singleton import singleton
+from helper.metrics import metrics
+import os
+import threading
+import time
+import requests
+from requests import RequestException, Timeout
+from urllib3.exceptions import HTTPError as TransportError
+
+# Connection and per-read socket timeouts: a hung Drive response fails instead of blocking a render slot
+ATTACHMENT_CONNECT_TIMEOUT_SECONDS = float(os.getenv('ATTACHMENT_CONNECT_TIMEOUT_SECONDS', 5))
+ATTACHMENT_READ_TIMEOUT_SECONDS = float(os.getenv('ATTACHMENT_READ_TIMEOUT_SECONDS', 30))
+# Wall-clock limit for a whole download (a server dripping bytes never trips the read timeout)
+ATTACHMENT_TOTAL_TIMEOUT_SECONDS = float(os.getenv('ATTACHMENT_TOTAL_TIMEOUT_SECONDS', 120))
+ATTACHMENT_MAX_BYTES = int(os.getenv('ATTACHMENT_MAX_BYTES', 100 * 1024 * 1024))
+ATTACHMENT_CHUNK_BYTES = 64 * 1024
+# A host is skipped for ATTACHMENT_BREAKER_COOLDOWN_SECONDS after this many consecutive failures
+ATTACHMENT_BREAKER_FAILURES = int(os.getenv('ATTACHMENT_BREAKER_FAILURES', 5))
+ATTACHMENT_BREAKER_COOLDOWN_SECONDS = float(os.getenv('ATTACHMENT_BREAKER_COOLDOWN_SECONDS', 30))
+
+GCS_HOST = "storage.googleapis.com"
+
+
+class AttachmentFetchError(Exception):
+    """An attachment could not be downloaded"""
+
+
+class AttachmentTooLargeError(AttachmentFetchError):
+    """The attachment is larger than ATTACHMENT_MAX_BYTES"""
+
+
+class HTTPStatusError(AttachmentFetchError):
+    """The server answered with a status other than 200"""
+
+    def __init__(self, status_code: int, url: str):
+        self.status_code = status_code
+        super().__init__(f"Failed to download {url}. Status code: {status_code}")
+
+
+class CircuitOpenError(AttachmentFetchError):
+    """The host failed repeatedly and is not being called until its cooldown ends"""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker for one host.
+
+    closed: calls go through. open (after `failure_threshold` failures in a row): calls fail fast
+    with CircuitOpenError for `cooldown` seconds. half-open: one trial call is let through; its
+    success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, host: str, failure_threshold: int, cooldown: float):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError unless a call to the host may go ahead"""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return
+            retry_in = max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+        raise CircuitOpenError(f"Circuit open for {self.host} after {self.failures} failures (retry in {retry_in:.0f}s)")
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info(f"Circuit for {self.host} closed")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            reopen = self.trial_in_flight
+            self.trial_in_flight = False
+            if reopen or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                logger.warning(f"Circuit for {self.host} opened after {self.failures} consecutive failures")
+
+    def release(self) -> None:
+        """End a call that says nothing about the host's health (e.g. a 404 or an oversized file)"""
+        with self._lock:
+            self.trial_in_flight = False
+
+
+class _LimitedWriter:
+    """File wrapper enforcing ATTACHMENT_MAX_BYTES and the total deadline on every write"""
+
+    def __init__(self, file, label: str, max_bytes: int, deadline: float):
+        self.file = file
+        self.label = label
+        self.max_bytes = max_bytes
+        self.deadline = deadline
+        self.written = 0
+
+    def write(self, data: bytes) -> int:
+        self.written += len(data)
+        if self.written > self.max_bytes:
+            raise AttachmentTooLargeError(f"{self.label} exceeds {self.max_bytes} bytes")
+        if time.monotonic() > self.deadline:
+            raise TimeoutError(f"{self.label} took longer than {ATTACHMENT_TOTAL_TIMEOUT_SECONDS}s")
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+@singleton
+class AttachmentFetcher:
+    """
+    Shared download layer for report attachments (Google Drive over HTTP, GCS blobs).
+
+    Bodies are streamed to a file in ATTACHMENT_CHUNK_BYTES chunks, never held in memory whole,
+    with connect/read timeouts, an overall deadline and a size limit. Failures that point at the
+    host (connection errors, timeouts, 5xx/429) count towards a per-host CircuitBreaker, so when
+    Drive degrades, renders fail fast instead of each waiting out its own timeouts.
+    Breaker state is per process.
+    """
+
+    def __init__(self):
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self._storage_client = None
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        with self._lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(host, ATTACHMENT_BREAKER_FAILURES, ATTACHMENT_BREAKER_COOLDOWN_SECONDS)
+            return self.breakers[host]
+
+    def _call(self, host: str, label: str, destination_path: str, download) -> int:
+        """Run `download(writer)` into destination_path under the host's breaker; returns the size"""
+        breaker = self.breaker(host)
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            metrics.inc("attachment_fetch_total", host=host, result="circuit_open")
+            raise
+
+        writer = None
+        try:
+            with open(destination_path, "wb") as f:
+                writer = _LimitedWriter(f, label, ATTACHMENT_MAX_BYTES, time.monotonic() + ATTACHMENT_TOTAL_TIMEOUT_SECONDS)
+                download(writer)
+        except Exception as e:
+            if os.path.exists(destination_path):
+                os.remove(destination_path)
+            if _is_host_failure(e):
+                breaker.record_failure()
+                result = "timeout" if _is_timeout(e) else "error"
+            else:
+                breaker.release()
+                result = "too_large" if isinstance(e, AttachmentTooLargeError) else "rejected"
+            metrics.inc("attachment_fetch_total", host=host, result=result)
+            logger.error(f"Error downloading {label}: {str(e)}")
+            if isinstance(e, AttachmentFetchError):
+                raise
+            raise AttachmentFetchError(f"Error downloading {label}: {str(e)}") from e
+
+        breaker.record_success()
+        metrics.inc("attachment_fetch_total", host=host, result="ok")
+        return writer.written
+
+    def fetch_to_file(self, url: str, destination_path: str, headers: Optional[Dict[str, str]] = None) -> int:
+        """Stream an HTTP(S) URL to destination_path; returns the number of bytes written"""
+        host = urlparse(url).hostname or "unknown"
+
+        def download(writer: _LimitedWriter):
+            with requests.get(
+                url,
+                headers=headers,
+                allow_redirects=True,
+                stream=True,
+                timeout=(ATTACHMENT_CONNECT_TIMEOUT_SECONDS, ATTACHMENT_READ_TIMEOUT_SECONDS),
+            ) as response:
+                if response.status_code != 200:
+                    raise HTTPStatusError(response.status_code, url)
+                content_length = response.headers.get("Content-Length")
+                if content_length and content_length.isdigit() and int(content_length) > ATTACHMENT_MAX_BYTES:
+                    raise AttachmentTooLargeError(f"{url} is {content_length} bytes (limit {ATTACHMENT_MAX_BYTES})")
+                for chunk in _iter_received(response):
+                    writer.write(chunk)
+
+        return self._call(host, url, destination_path, download)
+
+    def fetch_gcs_to_file(self, bucket_name: str, blob_name: str, destination_path: str) -> int:
+        """Stream a GCS blob to destination_path; returns the number of bytes written"""
+        def download(writer: _LimitedWriter):
+            blob = self.storage_client().bucket(bucket_name).blob(blob_name)
+            blob.download_to_file(writer, timeout=(ATTACHMENT_CONNECT_TIMEOUT_SECONDS, ATTACHMENT_READ_TIMEOUT_SECONDS))
+
+        return self._call(GCS_HOST, f"gs://{bucket_name}/{blob_name}", destination_path, download)
+
+    def storage_client(self):
+        """One GCS client per process (creating one resolves credentials every time)"""
+        if self._storage_client is None:
+            # Imported here: google-cloud-storage is slow to import and only needed by the renderer
+            from google.cloud import storage
+            self._storage_client = storage.Client()
+        return self._storage_client
+
+
+def _iter_received(response):
+    """
+    Yield the body as it arrives. iter_content() blocks until a whole chunk is read, so a server
+    dripping bytes would only be caught by the deadline at the end; read1() returns after each
+    socket read, which the read timeout bounds.
+    """
+    raw = getattr(response, "raw", None)
+    if raw is None or not hasattr(raw, "read1"):
+        yield from response.iter_content(chunk_size=ATTACHMENT_CHUNK_BYTES)
+        return
+    while True:
+        chunk = raw.read1(ATTACHMENT_CHUNK_BYTES, decode_content=True)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _is_timeout(error: Exception) -> bool:
+    return isinstance(error, (TimeoutError, Timeout)) or "timeout" in type(error).__name__.lower()
+
+
+def _is_host_failure(error: Exception) -> bool:
+    """Whether an error says the host is unhealthy (rather than this one file being bad)"""
+    if isinstance(error, HTTPStatusError):
+        return error.status_code >= 500 or error.status_code == 429
+    if isinstance(error, AttachmentFetchError):
+        return False
+    # Body reads go through urllib3 directly (see _iter_received), so its errors arrive unwrapped
+    if isinstance(error, (TimeoutError, ConnectionError, RequestException, TransportError)):
+        return True
+    # google-api-core errors carry `code`, google-resumable-media errors the HTTP response
+    status_code = getattr(error, "code", None)
+    if not isinstance(status_code, int):
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status_code, int):
+        return status_code >= 500 or status_code == 429
+    return False
@@ -1,47 +1,124 @@
-
 import os
+import asyncio
+import time
 import aiohttp
-from typing import Any, Dict, List, Optional
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Union
 from config.logging import logger
 
 METADATA_TOKEN_URL = "http://metadata.google.internal/computeMetadata/v1/instance/service-accounts/default/token"
 METADATA_HEADERS = {"Metadata-Flavor": "Google"}
+# Overridable so a local fake of the Run Admin API can be used
+CLOUD_RUN_API_BASE_URL = os.getenv("CLOUD_RUN_API_BASE_URL", "https://run.googleapis.com").strip().rstrip("/")
+# Tokens are refreshed this long before they expire
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("CLOUD_RUN_TOKEN_REFRESH_MARGIN_SECONDS", 300))
+# Connection pool size of the shared session
+CLOUD_RUN_HTTP_POOL_SIZE = int(os.getenv("CLOUD_RUN_HTTP_POOL_SIZE", 20))
+
+_token_cache: Dict[str, Any] = {"token": None, "expires_at": 0.0}
+_token_lock: Optional[asyncio.Lock] = None
+_credentials = None
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def _get_token_lock() -> asyncio.Lock:
+    global _token_lock
+    if _token_lock is None:
+        _token_lock = asyncio.Lock()
+    return _token_lock
+
+
+def _get_session() -> aiohttp.ClientSession:
+    """Long-lived session shared by every Run API call (keeps TLS connections alive)"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=10),
+            connector=aiohttp.TCPConnector(limit=CLOUD_RUN_HTTP_POOL_SIZE, ttl_dns_cache=300),
+        )
+    return _session
+
+
+async def close_session() -> None:
+    """Close the shared session (call on application shutdown)"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def _fetch_adc_token() -> Optional[Dict[str, Any]]:
+    """Blocking: discover Application Default Credentials once, refresh them when needed"""
+    global _credentials
+    # Import lazily to avoid hard dependency if not installed
+    import google.auth
+    from google.auth.transport.requests import Request
+
+    if _credentials is None:
+        _credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+    if not _credentials.valid:
+        _credentials.refresh(Request())
+    if not _credentials.token:
+        return None
+
+    expires_at = time.time() + 3600
+    if _credentials.expiry:
+        # google-auth reports expiry as a naive UTC datetime
+        expires_at = _credentials.expiry.replace(tzinfo=timezone.utc).timestamp()
+    return {"token": _credentials.token, "expires_at": expires_at}
+
+
+async def _fetch_metadata_token() -> Optional[Dict[str, Any]]:
+    session = _get_session()
+    async with session.get(METADATA_TOKEN_URL, headers=METADATA_HEADERS, timeout=aiohttp.ClientTimeout(total=5)) as resp:
+        if resp.status != 200:
+            logger.warning(f"Failed to get metadata token (status={resp.status})")
+            return None
+        data = await resp.json()
+        if not data.get("access_token"):
+            return None
+        return {"token": data["access_token"], "expires_at": time.time() + int(data.get("expires_in", 3600))}
 
 
 async def _get_access_token() -> Optional[str]:
-    """Fetch an OAuth2 access token.
+    """Fetch an OAuth2 access token, cached until shortly before it expires.
 
     Preference order:
+    0) CLOUD_RUN_ACCESS_TOKEN (static token, e.g. for a local fake of the Run API)
     1) Application Default Credentials (supports GOOGLE_APPLICATION_CREDENTIALS)
     2) GCE Metadata server (when running on GCP)
     """
-    # Try ADC first (works with GOOGLE_APPLICATION_CREDENTIALS and many environments)
-    try:
-        # Import lazily to avoid hard dependency if not installed
-        import google.auth
-        from google.auth.transport.requests import Request
-
-        credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-        if not credentials.valid:
-            credentials.refresh(Request())
-        if credentials.token:
-            return credentials.token
-    except Exception as exc:
-        logger.debug(f"ADC token fetch error: {exc}")
+    static_token = _get_env("CLOUD_RUN_ACCESS_TOKEN")
+    if static_token:
+        return static_token
 
-    # Fallback to metadata server
-    try:
-        timeout = aiohttp.ClientTimeout(total=5)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(METADATA_TOKEN_URL, headers=METADATA_HEADERS) as resp:
-                if resp.status != 200:
-                    logger.warning(f"Failed to get metadata token (status={resp.status})")
-                    return None
-                data = await resp.json()
-                return data.get("access_token")
-    except Exception as exc:
-        logger.debug(f"Metadata token fetch error: {exc}")
-        return None
+    if _token_cache["token"] and time.time() < _token_cache["expires_at"] - TOKEN_REFRESH_MARGIN_SECONDS:
+        return _token_cache["token"]
+
+    # Concurrent callers wait for a single refresh instead of each discovering credentials
+    async with _get_token_lock():
+        if _token_cache["token"] and time.time() < _token_cache["expires_at"] - TOKEN_REFRESH_MARGIN_SECONDS:
+            return _token_cache["token"]
+
+        fetched = None
+        # Try ADC first (works with GOOGLE_APPLICATION_CREDENTIALS and many environments)
+        try:
+            fetched = await asyncio.to_thread(_fetch_adc_token)
+        except Exception as exc:
+            logger.debug(f"ADC token fetch error: {exc}")
+
+        # Fallback to metadata server
+        if not fetched:
+            try:
+                fetched = await _fetch_metadata_token()
+            except Exception as exc:
+                logger.debug(f"Metadata token fetch error: {exc}")
+
+        if not fetched:
+            return None
+        _token_cache.update(fetched)
+        logger.debug(f"Access token refreshed, valid until {datetime.fromtimestamp(fetched['expires_at'], tz=timezone.utc).isoformat()}")
+        return fetched["token"]
 
 
 def _get_env(name: str) -> Optional[str]:
@@ -65,19 +142,18 @@ async def _list_job_executions(project: str, region: str, job: str) -> List[Dict
     token = await _get_access_token()
     if not token:
         logger.debug("No access token available; skipping Cloud Run Job trigger")
-        return
+        return []
 
-    url = f"https://run.googleapis.com/v2/projects/{project}/locations/{region}/jobs/{job}/executions?pageSize=10"
+    url = f"{CLOUD_RUN_API_BASE_URL}/v2/projects/{project}/locations/{region}/jobs/{job}/executions?pageSize=10"
     headers = {"Authorization": f"Bearer {token}"}
-    timeout = aiohttp.ClientTimeout(total=10)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        async with session.get(url, headers=headers) as resp:
-            if resp.status != 200:
-                text = await resp.text()
-                logger.warning(f"List executions failed (status={resp.status}): {text}")
-                return []
-            payload = await resp.json()
-            return payload.get("executions", [])
+    session = _get_session()
+    async with session.get(url, headers=headers) as resp:
+        if resp.status != 200:
+            text = await resp.text()
+            logger.warning(f"List executions failed (status={resp.status}): {text}")
+            return []
+        payload = await resp.json()
+        return payload.get("executions", [])
 
 
 def _has_running_execution(executions: List[Dict[str, Any]]) -> bool:
@@ -92,14 +168,66 @@ def _has_running_execution(executions: List[Dict[str, Any]]) -> bool:
     return False
 
 
+def _count_execution_tasks(executions: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Count tasks of unfinished executions: running, and provisioned but not yet running (starting)"""
+    running = 0
+    starting = 0
+    for execution in executions or []:
+        if execution.get("completionTime") or execution.get("deleteTime"):
+            continue
+        task_count = int(execution.get("taskCount") or 1)
+        running_count = int(execution.get("runningCount") or 0)
+        finished_count = sum(
+            int(execution.get(field) or 0)
+            for field in ("succeededCount", "failedCount", "cancelledCount")
+        )
+        running += running_count
+        starting += max(0, task_count - running_count - finished_count)
+    return {"running": running, "starting": starting}
+
+
+def _build_overrides(
+    args: Optional[List[str]] = None,
+    env_vars: Optional[List[Dict[str, str]]] = None,
+    task_count: Optional[int] = None,
+    timeout: Optional[Union[str, int]] = None,
+) -> Dict[str, Any]:
+    """Build RunJobRequest.overrides; keys left out keep the job's configured values"""
+    overrides: Dict[str, Any] = {}
+    container_override: Dict[str, Any] = {}
+    if args is not None:
+        container_override["args"] = args
+    if env_vars:
+        container_override["env"] = env_vars
+    if container_override:
+        overrides["containerOverrides"] = [container_override]
+    if task_count:
+        overrides["taskCount"] = int(task_count)
+    if timeout:
+        # The API takes a protobuf Duration string, e.g. "3600s"
+        overrides["timeout"] = f"{timeout}s" if isinstance(timeout, int) else timeout
+    return overrides
+
+
 async def _run_job(
     job: str,
+    args: Optional[List[str]] = None,
+    env_vars: Optional[List[Dict[str, str]]] = None,
+    task_count: Optional[int] = None,
+    timeout: Optional[Union[str, int]] = None,
 ) -> bool:
     """Run a Cloud Run job with specified configuration.
-    
+
+    The tasks of one execution start in parallel, up to the job's configured parallelism
+    (the Run API does not allow overriding parallelism per execution).
+
     Args:
         job: Cloud Run job name
-    
+        args: Container arguments overriding the job's
+        env_vars: Extra environment variables in format [{"name": "KEY", "value": "VALUE"}]
+        task_count: Number of tasks in this execution (default: the job's task count)
+        timeout: Per-task timeout, seconds or a duration string like "3600s"
+
     Returns:
         bool: True if job was triggered successfully, False otherwise
     """
@@ -109,27 +237,30 @@ async def _run_job(
 
     if not token:
         logger.debug("No access token available; skipping Cloud Run Job trigger")
-        return
+        return False
     
-    url = f"https://run.googleapis.com/v2/projects/{project}/locations/{region}/jobs/{job}:run"
+    url = f"{CLOUD_RUN_API_BASE_URL}/v2/projects/{project}/locations/{region}/jobs/{job}:run"
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
     
     # Build request body with overrides
-    body = {}    
-    timeout = aiohttp.ClientTimeout(total=10)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        async with session.post(url, headers=headers, json=body) as resp:
-            if resp.status not in (200, 202):
-                text = await resp.text()
-                logger.warning(f"Run job failed (status={resp.status}): {text}")
-                return False
-            return True
+    body = {}
+    overrides = _build_overrides(args=args, env_vars=env_vars, task_count=task_count, timeout=timeout)
+    if overrides:
+        body["overrides"] = overrides
+    session = _get_session()
+    async with session.post(url, headers=headers, json=body) as resp:
+        if resp.status not in (200, 202):
+            text = await resp.text()
+            logger.warning(f"Run job failed (status={resp.status}): {text}")
+            return False
+        return True
+
 
 async def ensure_cloud_run_job_started(
     args: Optional[List[str]] = None,
     env_vars: Optional[List[Dict[str, str]]] = None,
     task_count: int = 1,
-    timeout: Optional[str] = None
+    timeout: Optional[Union[str, int]] = None
 ) -> None:
     """Ensure a Cloud Run Job execution exists if none currently running.
 
@@ -140,7 +271,7 @@ async def ensure_cloud_run_job_started(
         args: List of arguments to pass to the container
         env_vars: List of environment variables in format [{"name": "KEY", "value": "VALUE"}]
         task_count: Number of parallel tasks to run (default: 1)
-        timeout: Job execution timeout in format like "3600s" or "1h"
+        timeout: Per-task timeout, seconds or a duration string like "3600s"
     """
     params = _get_cr_job_params()
     if not params:
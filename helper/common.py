@@ -7,8 +7,8 @@ import json
 import threading
 import time
 from config.logging import logger
+from helper.attachment_fetcher import AttachmentFetcher
 from typing import Any, Callable, Optional
-from google.cloud import storage
 import os
 
 
@@ -20,11 +20,7 @@ def singleton(cls):
     def get_instance(*args, **kwargs):
         if cls not in _global_instances:
             _global_instances[cls] = cls(*args, **kwargs)
-            print(
-                f"Created new global singleton instance of {cls.__name__}")
-        else:
-            print(
-                f"Using existing global singleton instance of {cls.__name__}")
+            logger.debug(f"Created new global singleton instance of {cls.__name__}")
         return _global_instances[cls]
     return get_instance
 
@@ -145,15 +141,6 @@ def download_from_gcs(bucket_name: str, source_blob_name: str, destination_file_
         Exception: If the file cannot be downloaded or if the bucket/blob doesn't exist
     """
     try:
-        # Initialize the GCS client
-        storage_client = storage.Client()
-        
-        # Get the bucket
-        bucket = storage_client.bucket(bucket_name)
-        
-        # Get the blob (file)
-        blob = bucket.blob(source_blob_name)
-        
         # If no destination filename is provided, use the source filename
         if not destination_file_name:
             destination_file_name = os.path.basename(source_blob_name)
@@ -165,9 +152,9 @@ def download_from_gcs(bucket_name: str, source_blob_name: str, destination_file_
         # Create the full destination path
         destination_path = os.path.join(tmp_dir, destination_file_name)
         
-        # Download the file
+        # Download the file (streamed, with timeouts, a size limit and the GCS circuit breaker)
         logger.info(f"Downloading {source_blob_name} from bucket {bucket_name} to {destination_path}")
-        blob.download_to_filename(destination_path)
+        AttachmentFetcher().fetch_gcs_to_file(bucket_name, source_blob_name, destination_path)
         
         logger.info(f"Downloaded file successfully to {destination_path}")
         return destination_path
@@ -1,9 +1,30 @@
 from psycopg2 import pool, OperationalError, InterfaceError
+from psycopg2.extras import execute_values
 from config.logging import logger
 from helper.common import singleton
+from helper.metrics import metrics
 import os
+import re
+import threading
 import time
 
+# A pooled connection is only pinged (SELECT 1) on checkout after sitting idle this long
+DB_POOL_PING_IDLE_SECONDS = float(os.getenv('DB_POOL_PING_IDLE_SECONDS', 30))
+# Connections the pool opens at most; 0 sizes it from the threads that query at once
+# (set_max_connections(), e.g. from the consumer's stage concurrency), or 10 if never set
+DB_POOL_MAX_CONNECTIONS = int(os.getenv('DB_POOL_MAX_CONNECTIONS', 0))
+# While every connection is checked out, a checkout waits this long for one to be returned
+DB_POOL_WAIT_SECONDS = float(os.getenv('DB_POOL_WAIT_SECONDS', 30))
+
+_STATEMENT_TABLE_PATTERN = re.compile(r'\b(?:FROM|UPDATE|INTO)\s+([a-zA-Z0-9_."]+)', re.IGNORECASE)
+
+def _statement_label(query) -> str:
+    """Low-cardinality metric label for a statement, e.g. 'SELECT b2b_bumame_appointment'"""
+    text = str(query).strip()
+    verb = text.split(None, 1)[0].upper() if text else "UNKNOWN"
+    match = _STATEMENT_TABLE_PATTERN.search(text)
+    return f"{verb} {match.group(1)}" if match else verb
+
 class DatabaseError(Exception):
     """Custom exception for database errors with user-friendly messages"""
     def __init__(self, message, original_error=None):
@@ -23,17 +44,40 @@ class DatabaseHelper:
         }
         self.max_retries = 3
         self.retry_delay = 1  # seconds
-        self._initialize_pool()
+        # Opened on first use, so importing this module never waits on Postgres
+        self.pool = None
+        self._pool_lock = threading.Lock()
+        self.max_connections = DB_POOL_MAX_CONNECTIONS or 10
+        # id(connection) -> when it was last returned to the pool
+        self._released_at = {}
+
+    def set_max_connections(self, max_connections: int):
+        """Size the pool for this many threads querying at once (unless DB_POOL_MAX_CONNECTIONS is set)"""
+        max_connections = max(1, max_connections)
+        if DB_POOL_MAX_CONNECTIONS or max_connections == self.max_connections:
+            return
+        with self._pool_lock:
+            self.max_connections = max_connections
+            if self.pool is not None:
+                logger.warning(f"Connection pool already open, {self.max_connections} connection(s) apply once it is reinitialized")
+
+    def _get_pool(self):
+        if self.pool is None:
+            with self._pool_lock:
+                if self.pool is None:
+                    self._initialize_pool()
+        return self.pool
 
     def _initialize_pool(self):
         try:
-            self.pool = pool.SimpleConnectionPool(
+            # Threaded: connections are checked out from the asyncio.to_thread() workers at once
+            self.pool = pool.ThreadedConnectionPool(
                 minconn=1,
-                maxconn=10,
+                maxconn=self.max_connections,
                 **self.db_config
             )
-            print(f"[DEBUG] Connection pool initialized successfully: {self.pool}")
-            logger.info("Connection pool initialized successfully")
+            self._released_at = {}
+            logger.info(f"Connection pool initialized successfully (up to {self.max_connections} connections)")
         except Exception as e:
             logger.error(f"Failed to initialize connection pool: {e}")
             raise DatabaseError(
@@ -41,30 +85,65 @@ class DatabaseHelper:
                 original_error=e
             )
 
+    def _checkout(self):
+        """Check out a pooled connection, waiting up to DB_POOL_WAIT_SECONDS while all are in use"""
+        deadline = time.monotonic() + DB_POOL_WAIT_SECONDS
+        delay = 0.05
+        while True:
+            try:
+                return self._get_pool().getconn()
+            except pool.PoolError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 0.5)
+
     def get_connection(self):
         for attempt in range(self.max_retries):
+            conn = None
             try:
-                conn = self.pool.getconn()
+                conn = self._checkout()
                 if conn:
-                    # Test connection
-                    with conn.cursor() as cursor:
-                        cursor.execute("SELECT 1")
-                        conn.commit()
+                    if conn.closed:
+                        raise InterfaceError("connection already closed")
+                    # Test connections that sat idle long enough for the server or a proxy to drop them
+                    idle_seconds = time.monotonic() - self._released_at.get(id(conn), float("-inf"))
+                    if idle_seconds >= DB_POOL_PING_IDLE_SECONDS:
+                        with conn.cursor() as cursor:
+                            cursor.execute("SELECT 1")
+                            conn.commit()
                     return conn
             except (OperationalError, InterfaceError) as e:
                 logger.error(f"Connection attempt {attempt + 1} failed: {e}")
                 if conn:
-                    self.pool.putconn(conn)
+                    # Broken: close it instead of handing it out again
+                    self._released_at.pop(id(conn), None)
+                    self.pool.putconn(conn, close=True)
                 if attempt == self.max_retries - 1:
                     logger.info("Reinitializing connection pool")
                     self._initialize_pool()
                 else:
                     time.sleep(self.retry_delay)
+            except pool.PoolError as e:
+                logger.error(f"No pooled connection free after {DB_POOL_WAIT_SECONDS}s: {e}")
+                raise DatabaseError(
+                    "Maaf, sistem sedang mengalami gangguan. Silakan coba beberapa saat lagi.",
+                    original_error=e
+                )
         raise DatabaseError(
             "Maaf, sistem sedang mengalami gangguan. Silakan coba beberapa saat lagi."
         )
 
+    def put_connection(self, conn):
+        """Return a connection from get_connection() to the pool"""
+        self._released_at[id(conn)] = time.monotonic()
+        self.pool.putconn(conn)
+
     def fetch_query(self, query, params=None):
+        with metrics.timer("db_query_duration_seconds", statement=_statement_label(query)):
+            return self._fetch_query(query, params)
+
+    def _fetch_query(self, query, params=None):
         conn = None
         try:
             conn = self.get_connection()
@@ -72,8 +151,7 @@ class DatabaseHelper:
                 cursor.execute(query, params)
                 result = cursor.fetchall()
                 conn.commit()
-                logger.info(f"Query executed successfully: {query}")
-                logger.info(f"Result: {result}")
+                logger.debug(f"Query executed successfully: {_statement_label(query)} ({len(result)} rows)", extra={"sample_rate": None})
                 
                 return result
                 
@@ -90,16 +168,20 @@ class DatabaseHelper:
             )
         finally:
             if conn:
-                self.pool.putconn(conn)
+                self.put_connection(conn)
 
     def execute_query(self, query, params=None):
+        with metrics.timer("db_query_duration_seconds", statement=_statement_label(query)):
+            return self._execute_query(query, params)
+
+    def _execute_query(self, query, params=None):
         conn = None
         try:
             conn = self.get_connection()
             with conn.cursor() as cursor:
                 cursor.execute(query, params)
                 conn.commit()
-                logger.info(f"Query executed successfully: {query}")
+                logger.debug(f"Query executed successfully: {_statement_label(query)}", extra={"sample_rate": None})
                 return True
         except Exception as e:
             logger.error(f"Error executing query: {e}")
@@ -111,10 +193,37 @@ class DatabaseHelper:
             )
         finally:
             if conn:
-                self.pool.putconn(conn)
+                self.put_connection(conn)
+
+    def execute_values(self, query, rows, template=None, page_size=500):
+        """Run a `... VALUES %s` statement for many rows in one round trip per page_size rows"""
+        with metrics.timer("db_query_duration_seconds", statement=_statement_label(query)):
+            return self._execute_values(query, rows, template, page_size)
+
+    def _execute_values(self, query, rows, template=None, page_size=500):
+        conn = None
+        try:
+            conn = self.get_connection()
+            with conn.cursor() as cursor:
+                execute_values(cursor, query, rows, template=template, page_size=page_size)
+                row_count = cursor.rowcount
+                conn.commit()
+                logger.debug(f"Query executed successfully: {_statement_label(query)} ({len(rows)} values)", extra={"sample_rate": None})
+                return row_count
+        except Exception as e:
+            logger.error(f"Error executing batch query: {e}")
+            if conn:
+                conn.rollback()
+            raise DatabaseError(
+                "Maaf, terjadi kesalahan saat menyimpan data. Silakan coba beberapa saat lagi.",
+                original_error=e
+            )
+        finally:
+            if conn:
+                self.put_connection(conn)
 
     def close_all(self):
-        if hasattr(self, 'pool'):
+        if self.pool is not None:
             self.pool.closeall()
             logger.info("All database connections closed")
 
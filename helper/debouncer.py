@@ -0,0 +1,83 @@
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+from config.logging import logger
+import asyncio
+import time
+
+
+class KeyedDebouncer:
+    """
+    Coalesces bursts of events per key and hands them to `flush` in batches.
+
+    A key is flushed once it has been quiet for `quiet_seconds`, or `max_delay_seconds` after
+    its first event if events keep arriving. Later events for a pending key replace its value.
+    Every key that is due at the same time is flushed in one call, so a burst over many keys
+    becomes one batch.
+    """
+
+    def __init__(
+        self,
+        quiet_seconds: float,
+        max_delay_seconds: float,
+        flush: Callable[[Dict[Hashable, Any]], Awaitable[None]],
+    ):
+        self.quiet_seconds = quiet_seconds
+        self.max_delay_seconds = max(quiet_seconds, max_delay_seconds)
+        self.flush = flush
+        # key -> [first event at, last event at, latest value]
+        self.pending: Dict[Hashable, List[Any]] = {}
+        self._wakeup = asyncio.Event()
+        self._flushing: Optional[asyncio.Future] = None
+
+    def add(self, key: Hashable, value: Any = None) -> bool:
+        """Record an event; returns False when it was folded into a pending one"""
+        now = time.monotonic()
+        entry = self.pending.get(key)
+        if entry is not None:
+            entry[1] = now
+            entry[2] = value
+            return False
+        self.pending[key] = [now, now, value]
+        self._wakeup.set()
+        return True
+
+    def _due_at(self, entry: List[Any]) -> float:
+        return min(entry[1] + self.quiet_seconds, entry[0] + self.max_delay_seconds)
+
+    async def _flush(self, keys: List[Hashable]):
+        batch = {key: self.pending.pop(key)[2] for key in keys}
+        # Shielded: cancelling run() must not drop a batch that already left `pending`
+        self._flushing = asyncio.ensure_future(self.flush(batch))
+        try:
+            await asyncio.shield(self._flushing)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error flushing {len(batch)} debounced key(s): {str(e)}")
+
+    async def run(self):
+        """Flush keys as they become due, until cancelled"""
+        while True:
+            if not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            due_keys = [key for key, entry in self.pending.items() if self._due_at(entry) <= now]
+            if due_keys:
+                await self._flush(due_keys)
+                continue
+
+            next_due = min(self._due_at(entry) for entry in self.pending.values())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=next_due - now)
+            except asyncio.TimeoutError:
+                pass
+
+    async def flush_all(self):
+        """Flush everything pending right away (on shutdown), after any batch still in flight"""
+        if self._flushing is not None and not self._flushing.done():
+            await asyncio.gather(self._flushing, return_exceptions=True)
+        if self.pending:
+            await self._flush(list(self.pending))
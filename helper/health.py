@@ -0,0 +1,164 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from config.logging import logger
+from helper.singleton import singleton
+from helper.metrics import metrics
+from aiohttp import web
+import asyncio
+import os
+import time
+
+# Dependency checks run in the background at this interval; probes only read the last result
+HEALTH_CHECK_INTERVAL_SECONDS = float(os.getenv('HEALTH_CHECK_INTERVAL_SECONDS', 10))
+HEALTH_CHECK_TIMEOUT_SECONDS = float(os.getenv('HEALTH_CHECK_TIMEOUT_SECONDS', 3))
+# A failing check backs off up to this interval, so probes don't add load to an incident
+HEALTH_CHECK_MAX_INTERVAL_SECONDS = float(os.getenv('HEALTH_CHECK_MAX_INTERVAL_SECONDS', 60))
+LOOP_LAG_SAMPLE_SECONDS = 0.5
+
+
+@singleton
+class HealthMonitor:
+    """
+    Cached liveness/readiness state of this process.
+
+    Each registered check runs in its own background task; /readyz reports the cached results
+    (plus event-loop lag and any registered info), so a probe never waits on a dependency.
+    """
+
+    def __init__(self):
+        self.checks: Dict[str, Callable[[], Awaitable[Any]]] = {}
+        self.info: Dict[str, Callable[[], Any]] = {}
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.loop_lag_seconds = 0.0
+        self.started_at = time.time()
+        self._tasks: List[asyncio.Task] = []
+
+    def add_check(self, name: str, check: Callable[[], Awaitable[Any]]) -> None:
+        """Register an async check; it fails by raising and may return a short detail string"""
+        self.checks[name] = check
+
+    def add_info(self, name: str, provider: Callable[[], Any]) -> None:
+        """Register a cheap, synchronous value shown in the readiness payload"""
+        self.info[name] = provider
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks.append(asyncio.create_task(self._sample_loop_lag()))
+        for name, check in self.checks.items():
+            self._tasks.append(asyncio.create_task(self._run_check(name, check)))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _run_check(self, name: str, check: Callable[[], Awaitable[Any]]):
+        failures = 0
+        while True:
+            started_at = time.monotonic()
+            try:
+                detail = await asyncio.wait_for(check(), timeout=HEALTH_CHECK_TIMEOUT_SECONDS)
+                result = {"ok": True, "detail": detail or "ok"}
+                failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                result = {"ok": False, "detail": str(e) or type(e).__name__}
+                if self.results.get(name, {}).get("ok", True):
+                    logger.warning(f"Health check {name} failed: {result['detail']}")
+                failures += 1
+            result["checked_at"] = time.time()
+            result["duration_seconds"] = round(time.monotonic() - started_at, 4)
+            self.results[name] = result
+            # Doubles from the second consecutive failure on
+            await asyncio.sleep(min(HEALTH_CHECK_INTERVAL_SECONDS * 2 ** max(0, failures - 1), HEALTH_CHECK_MAX_INTERVAL_SECONDS))
+
+    async def _sample_loop_lag(self):
+        while True:
+            started_at = time.monotonic()
+            await asyncio.sleep(LOOP_LAG_SAMPLE_SECONDS)
+            self.loop_lag_seconds = max(0.0, time.monotonic() - started_at - LOOP_LAG_SAMPLE_SECONDS)
+            metrics.observe("event_loop_lag_seconds", self.loop_lag_seconds)
+
+    def liveness(self) -> Dict[str, Any]:
+        return {
+            "status": "alive",
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "loop_lag_seconds": round(self.loop_lag_seconds, 4),
+        }
+
+    def readiness(self) -> Dict[str, Any]:
+        """Cached check results; ready only if every check has passed on its last run"""
+        # A result older than this means its check task stopped running
+        stale_after = HEALTH_CHECK_MAX_INTERVAL_SECONDS + 2 * HEALTH_CHECK_TIMEOUT_SECONDS
+        now = time.time()
+        checks = {}
+        for name in self.checks:
+            result = self.results.get(name)
+            if result is None:
+                checks[name] = {"ok": False, "detail": "pending"}
+            elif now - result["checked_at"] > stale_after:
+                checks[name] = {**result, "ok": False, "detail": "stale"}
+            else:
+                checks[name] = result
+
+        info = {}
+        for name, provider in self.info.items():
+            try:
+                info[name] = provider()
+            except Exception as e:
+                info[name] = f"error: {str(e)}"
+
+        ready = all(check["ok"] for check in checks.values()) and not info.get("draining", False)
+        return {
+            "status": "ready" if ready else "not_ready",
+            "checks": checks,
+            "loop_lag_seconds": round(self.loop_lag_seconds, 4),
+            **info,
+        }
+
+
+async def check_database() -> str:
+    """SELECT 1 through the pool, off the event loop"""
+    from helper.database import db_postgres
+    await asyncio.to_thread(db_postgres.fetch_query, "SELECT 1")
+    return "connected"
+
+
+async def check_rabbitmq() -> str:
+    """State of the shared AMQP connection (no network round trip)"""
+    from helper.rmq import RabbitMQHelper
+    rmq_helper = RabbitMQHelper()
+    connection = rmq_helper.connection
+    if connection is None or connection.is_closed:
+        raise ConnectionError("not connected")
+    # aio_pika's robust connection stays open while it reconnects
+    connected = getattr(connection, "connected", None)
+    if connected is not None and not connected.is_set():
+        raise ConnectionError("reconnecting")
+    if rmq_helper.channel is None or rmq_helper.channel.is_closed:
+        raise ConnectionError("channel closed")
+    return "connected"
+
+
+async def start_probe_server(port: int, monitor: Optional[HealthMonitor] = None):
+    """Serve /livez and /readyz over HTTP (for the consumer, which has no web framework)"""
+    monitor = monitor or HealthMonitor()
+
+    async def handle_livez(request: web.Request) -> web.Response:
+        return web.json_response(monitor.liveness())
+
+    async def handle_readyz(request: web.Request) -> web.Response:
+        readiness = monitor.readiness()
+        return web.json_response(readiness, status=200 if readiness["status"] == "ready" else 503)
+
+    app = web.Application()
+    app.router.add_get("/livez", handle_livez)
+    app.router.add_get("/readyz", handle_readyz)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "0.0.0.0", port)
+    await site.start()
+    logger.info(f"Probe server listening on :{port} (/livez, /readyz)")
+    return runner
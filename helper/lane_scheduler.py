@@ -0,0 +1,81 @@
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional
+import asyncio
+
+
+class LaneScheduler:
+    """
+    Shares a fixed number of render slots between several queues ("lanes").
+
+    Every lane has its own consumers, so a message from any lane can be waiting for a slot.
+    When a slot frees up it goes to the waiting lanes in weighted round robin: with weights
+    {"interactive": 4, "bulk": 1} and both lanes waiting, 4 interactive jobs start for every
+    bulk job, so interactive work never queues behind a bulk backlog and bulk is not starved.
+    Lanes are listed in priority order; the first one wins ties.
+    """
+
+    def __init__(self, slots: int, weights: Dict[str, int]):
+        self.slots = slots
+        self.free = slots
+        self.weights = {lane: max(1, weight) for lane, weight in weights.items()}
+        self.credits = dict(self.weights)
+        self.waiters: Dict[str, Deque[asyncio.Future]] = {lane: deque() for lane in self.weights}
+
+    def waiting(self, lane: Optional[str] = None) -> int:
+        if lane is not None:
+            return len(self.waiters[lane])
+        return sum(len(waiters) for waiters in self.waiters.values())
+
+    def _next_lane(self) -> Optional[str]:
+        waiting_lanes = [lane for lane, waiters in self.waiters.items() if waiters]
+        if not waiting_lanes:
+            return None
+        for lane in waiting_lanes:
+            if self.credits[lane] > 0:
+                self.credits[lane] -= 1
+                return lane
+        # Every waiting lane spent its share of this round: start a new round
+        self.credits = dict(self.weights)
+        lane = waiting_lanes[0]
+        self.credits[lane] -= 1
+        return lane
+
+    def _dispatch(self):
+        while self.free > 0:
+            lane = self._next_lane()
+            if lane is None:
+                return
+            waiter = self.waiters[lane].popleft()
+            if waiter.done():
+                continue
+            self.free -= 1
+            waiter.set_result(None)
+
+    async def acquire(self, lane: str):
+        if self.free > 0 and not self.waiting():
+            self.free -= 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[lane].append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted a slot just before being cancelled: hand it on
+                self.release()
+            elif waiter in self.waiters[lane]:
+                self.waiters[lane].remove(waiter)
+            raise
+
+    def release(self):
+        self.free += 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, lane: str) -> AsyncIterator[None]:
+        await self.acquire(lane)
+        try:
+            yield
+        finally:
+            self.release()
@@ -0,0 +1,215 @@
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+from config.logging import logger
+from aiohttp import web
+import aiohttp
+import asyncio
+import os
+import socket
+import threading
+import time
+
+# Buckets (seconds) covering a fast DB statement up to a slow WeasyPrint layout
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Buckets (bytes) for generated PDFs and downloaded attachments
+SIZE_BUCKETS = (50_000, 100_000, 250_000, 500_000, 1_000_000, 2_500_000, 5_000_000, 10_000_000, 25_000_000)
+# Buckets (bytes) for whole-appointment exports
+EXPORT_SIZE_BUCKETS = (1_000_000, 10_000_000, 50_000_000, 100_000_000, 250_000_000, 500_000_000, 1_000_000_000)
+
+METRIC_DEFINITIONS = {
+    "report_node_duration_seconds": ("histogram", "Duration of each report graph node", DURATION_BUCKETS),
+    "report_total_duration_seconds": ("histogram", "Duration of a full run_with_data call", DURATION_BUCKETS),
+    "db_query_duration_seconds": ("histogram", "Latency of database statements, including pool checkout", DURATION_BUCKETS),
+    "attachment_download_duration_seconds": ("histogram", "Attachment download time per attachment type", DURATION_BUCKETS),
+    "attachment_rasterize_duration_seconds": ("histogram", "PDF to image rasterisation time per attachment type", DURATION_BUCKETS),
+    "attachment_place_duration_seconds": ("histogram", "Time to draw vector attachments into a rendered PDF", DURATION_BUCKETS),
+    "pdf_layout_duration_seconds": ("histogram", "WeasyPrint layout (render) time", DURATION_BUCKETS),
+    "pdf_write_duration_seconds": ("histogram", "WeasyPrint PDF serialisation (write) time", DURATION_BUCKETS),
+    "pdf_size_bytes": ("histogram", "Size of generated report PDFs", SIZE_BUCKETS),
+    "report_upload_duration_seconds": ("histogram", "Upload time of a generated report to GCS", DURATION_BUCKETS),
+    "queue_wait_duration_seconds": ("histogram", "Time a message waited (queue and first stage slot) before processing started, by lane", DURATION_BUCKETS),
+    "report_pipeline_wait_seconds": ("histogram", "Time a report waited between consumer pipeline stages for a slot of the next one, by stage", DURATION_BUCKETS),
+    "appointment_export_duration_seconds": ("histogram", "Time to build and upload an appointment export", DURATION_BUCKETS + (300.0, 600.0, 1800.0)),
+    "appointment_export_size_bytes": ("histogram", "Size of appointment exports (merged PDF or ZIP)", EXPORT_SIZE_BUCKETS),
+    "event_loop_lag_seconds": ("histogram", "Delay of the event loop in waking a 0.5s sleep (health monitor samples)", DURATION_BUCKETS),
+    "report_jobs_total": ("counter", "Report jobs processed by the consumer, by outcome", None),
+    "customize_variable_cache_total": ("counter", "Customize variable cache lookups, by result (hit/miss/coalesced)", None),
+    "report_section_cache_total": ("counter", "Report section cache lookups, by section and result (hit/miss)", None),
+    "report_status_updates_total": ("counter", "Report status rows written by the batched status writer, by status", None),
+    "report_listener_notifications_total": ("counter", "Analysis change notifications seen by the report listener, by result", None),
+    "attachment_fetch_total": ("counter", "Attachment downloads by host and result (ok/timeout/error/too_large/rejected/circuit_open)", None),
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _escape_label_value(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class MetricsRegistry:
+    """
+    Minimal, dependency-free Prometheus metrics registry (counters and histograms).
+    Thread safe, since report rendering may run outside of the event loop thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+
+    @staticmethod
+    def _label_key(labels: Dict[str, str]) -> LabelKey:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def observe(self, name: str, value: float, **labels):
+        _, _, buckets = METRIC_DEFINITIONS.get(name, ("histogram", "", DURATION_BUCKETS))
+        key = self._label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = _Histogram(buckets or DURATION_BUCKETS)
+            series[key].observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """Observe the duration of the wrapped block, whether or not it raises"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time, **labels)
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Histogram sums and counts per label set, e.g. for benchmark reports"""
+        result = {}
+        with self._lock:
+            for name, series in self._histograms.items():
+                result[name] = {
+                    ",".join(f"{k}={v}" for k, v in key) or "_": {"count": hist.count, "sum": hist.sum}
+                    for key, hist in series.items()
+                }
+        return result
+
+    def drain(self) -> Dict[str, Dict]:
+        """Return the raw series recorded so far and clear them (used to ship worker metrics to the parent)"""
+        with self._lock:
+            data = {
+                "histograms": {
+                    name: {key: (hist.buckets, list(hist.counts), hist.sum, hist.count) for key, hist in series.items()}
+                    for name, series in self._histograms.items()
+                },
+                "counters": {name: dict(series) for name, series in self._counters.items()},
+            }
+            self._histograms.clear()
+            self._counters.clear()
+        return data
+
+    def merge(self, data: Optional[Dict[str, Dict]]):
+        """Add series produced by drain() in another process"""
+        if not data:
+            return
+        with self._lock:
+            for name, series in data.get("histograms", {}).items():
+                target = self._histograms.setdefault(name, {})
+                for key, (buckets, counts, total, count) in series.items():
+                    hist = target.setdefault(key, _Histogram(buckets))
+                    hist.counts = [a + b for a, b in zip(hist.counts, counts)]
+                    hist.sum += total
+                    hist.count += count
+            for name, series in data.get("counters", {}).items():
+                target = self._counters.setdefault(name, {})
+                for key, value in series.items():
+                    target[key] = target.get(key, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        def fmt_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+            pairs = list(key) + ([extra] if extra else [])
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{_escape_label_value(v)}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                _, help_text, _ = METRIC_DEFINITIONS.get(name, ("counter", name, None))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{fmt_labels(key)} {value}")
+
+            for name, series in sorted(self._histograms.items()):
+                _, help_text, _ = METRIC_DEFINITIONS.get(name, ("histogram", name, None))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, hist in series.items():
+                    for bound, count in zip(hist.buckets, hist.counts):
+                        lines.append(f"{name}_bucket{fmt_labels(key, ('le', str(bound)))} {count}")
+                    lines.append(f"{name}_bucket{fmt_labels(key, ('le', '+Inf'))} {hist.count}")
+                    lines.append(f"{name}_sum{fmt_labels(key)} {hist.sum}")
+                    lines.append(f"{name}_count{fmt_labels(key)} {hist.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+async def start_metrics_server(port: int):
+    """Serve /metrics over HTTP (sidecar scraping mode for the consumer)"""
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "0.0.0.0", port)
+    await site.start()
+    logger.info(f"Metrics server listening on :{port}/metrics")
+    return runner
+
+
+async def push_metrics_periodically(pushgateway_url: str, job: str, interval: float = 15.0):
+    """Push metrics to a Prometheus Pushgateway (for short-lived Cloud Run Job consumers)"""
+    instance = os.getenv("CLOUD_RUN_EXECUTION", socket.gethostname())
+    url = f"{pushgateway_url.rstrip('/')}/metrics/job/{job}/instance/{instance}"
+    timeout = aiohttp.ClientTimeout(total=10)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        while True:
+            try:
+                async with session.put(url, data=metrics.render().encode()) as resp:
+                    if resp.status >= 300:
+                        logger.warning(f"Failed to push metrics (status={resp.status})")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Error pushing metrics: {str(e)}")
+            await asyncio.sleep(interval)
@@ -0,0 +1,151 @@
+from config.logging import logger
+from typing import Any, Dict, Optional
+import hashlib
+import json
+import os
+import threading
+
+# Where rendered section PDFs are cached: off, local (per container) or gcs (shared by all consumers)
+REPORT_SECTION_CACHE = os.getenv('REPORT_SECTION_CACHE', 'off').lower()
+REPORT_SECTION_CACHE_DIR = os.getenv('REPORT_SECTION_CACHE_DIR', os.path.join('tmp', 'section_cache'))
+# Oldest local fragments are removed beyond this many files
+REPORT_SECTION_CACHE_MAX_FILES = int(os.getenv('REPORT_SECTION_CACHE_MAX_FILES', 5000))
+# GCS backend location
+SECTION_CACHE_BUCKET_NAME = os.getenv('REPORT_SECTION_CACHE_BUCKET', 'bumame-private-document')
+SECTION_CACHE_BLOB_PREFIX = os.getenv('REPORT_SECTION_CACHE_PREFIX', 'b2b-medical-report/section-cache').strip('/')
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _stable_value(value: Any) -> Any:
+    """Replace paths of local files (downloaded attachments get random names) by their content hash"""
+    if isinstance(value, dict):
+        return {str(key): _stable_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_stable_value(item) for item in value]
+    if isinstance(value, str) and value and not value.startswith(("http://", "https://")) and os.path.isfile(value):
+        return f"sha256:{_file_digest(value)}"
+    return value
+
+
+def template_fingerprint(template_dir: str) -> str:
+    """Hash of every file in the template directory, so a template or CSS change invalidates the cache"""
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(template_dir)):
+        path = os.path.join(template_dir, name)
+        if os.path.isfile(path):
+            digest.update(name.encode())
+            digest.update(_file_digest(path).encode())
+    return digest.hexdigest()
+
+
+def section_key(section: str, inputs: Dict[str, Any], fingerprint: str) -> str:
+    """Cache key of a section: its name, the template fingerprint and everything it renders from"""
+    payload = json.dumps(
+        {"section": section, "template": fingerprint, "inputs": _stable_value(inputs)},
+        sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class SectionCache:
+    """
+    Rendered report sections (PDF fragments) keyed by section_key.
+
+    The local backend only helps while a container lives; the GCS backend is shared by every
+    consumer task, so an edit re-rendered by another task still reuses unchanged sections.
+    Fragments are handed out as bytes: any process sharing the directory may trim a file the
+    moment after it was looked up.
+    """
+
+    def __init__(self, backend: str = REPORT_SECTION_CACHE, directory: str = REPORT_SECTION_CACHE_DIR):
+        self.backend = backend
+        self.directory = directory
+        self._bucket = None
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend in ("local", "gcs")
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def _get_bucket(self):
+        with self._lock:
+            if self._bucket is None:
+                from google.cloud import storage
+                self._bucket = storage.Client().bucket(SECTION_CACHE_BUCKET_NAME)
+            return self._bucket
+
+    @staticmethod
+    def _read(path: str) -> Optional[bytes]:
+        """Content of a local fragment, or None if it is gone (trimmed since it was found)"""
+        try:
+            os.utime(path)
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def get(self, key: str) -> Optional[bytes]:
+        """The cached fragment, downloading it from GCS if needed; None on a miss"""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        content = self._read(path)
+        if content is not None or self.backend != "gcs":
+            return content
+        try:
+            blob = self._get_bucket().blob(f"{SECTION_CACHE_BLOB_PREFIX}/{key}.pdf")
+            if not blob.exists():
+                return None
+            blob.download_to_filename(f"{path}.part")
+            os.replace(f"{path}.part", path)
+            return self._read(path)
+        except Exception as e:
+            # A cache failure only costs a re-render
+            logger.warning(f"Section cache download failed for {key}: {str(e)}")
+            return None
+
+    def put(self, key: str, source_path: str) -> bytes:
+        """Store a rendered fragment and return its content"""
+        with open(source_path, "rb") as f:
+            content = f.read()
+        path = self._path(key)
+        os.replace(source_path, path)
+        if self.backend == "gcs":
+            try:
+                self._get_bucket().blob(f"{SECTION_CACHE_BLOB_PREFIX}/{key}.pdf").upload_from_filename(
+                    path, content_type="application/pdf"
+                )
+            except Exception as e:
+                logger.warning(f"Section cache upload failed for {key}: {str(e)}")
+        self._trim()
+        return content
+
+    def _trim(self):
+        if not REPORT_SECTION_CACHE_MAX_FILES:
+            return
+        with self._lock:
+            try:
+                entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".pdf")]
+                if len(entries) <= REPORT_SECTION_CACHE_MAX_FILES:
+                    return
+                entries.sort(key=lambda entry: entry.stat().st_mtime)
+                for entry in entries[:len(entries) - REPORT_SECTION_CACHE_MAX_FILES]:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        # Trimmed by another process sharing the directory
+                        pass
+            except OSError as e:
+                logger.warning(f"Section cache trim failed: {str(e)}")
@@ -0,0 +1,179 @@
+from config.logging import logger, mask_patient_phi
+from helper.metrics import metrics
+from service.report_status_writer import ReportStatusWriter
+from typing import Any, Dict, List, Optional
+import asyncio
+import multiprocessing
+import os
+
+# Recycle a worker after this many reports (0 disables)
+WORKER_MAX_JOBS = int(os.getenv('WORKER_MAX_JOBS', 200))
+# Recycle a worker once its resident memory exceeds this many MB (0 disables)
+WORKER_MAX_RSS_MB = int(os.getenv('WORKER_MAX_RSS_MB', 1536))
+# Imported by the fork server before it forks any worker (loads and warms the render stack)
+WORKER_PRELOAD_MODULES = ["agent.render_warmup"]
+
+
+class WorkerCrashedError(Exception):
+    """A render worker died while processing a job"""
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _worker_main(conn, max_jobs: int, max_rss_bytes: int):
+    """
+    Worker loop: receive (agent method, payload), run it, reply with its result (or error) and
+    drained metrics. Methods: run_with_data (a whole report) or render_prepared (the render stage)
+    """
+    from agent.report_generator_agent import AgentReportGenerator
+    from service.report_status_writer import ReportStatusWriter
+
+    agent = AgentReportGenerator()
+    metrics.drain()  # drop anything recorded before the fork
+    # Status updates go back with the reply and are batched by the consumer process
+    status_writer = ReportStatusWriter()
+    status_writer.collect()
+    jobs = 0
+    try:
+        while True:
+            try:
+                job = conn.recv()
+            except EOFError:
+                break
+            if job is None:
+                break
+
+            try:
+                method, payload = job
+                mask_patient_phi(payload.get("patient_data", payload))
+                reply: Dict[str, Any] = {"ok": True, "result": getattr(agent, method)(payload)}
+            except Exception as e:
+                reply = {"ok": False, "error": str(e)}
+
+            jobs += 1
+            rss_bytes = _rss_bytes()
+            reply["recycle"] = bool(
+                (max_jobs and jobs >= max_jobs) or (max_rss_bytes and rss_bytes >= max_rss_bytes)
+            )
+            reply["jobs"] = jobs
+            reply["rss_bytes"] = rss_bytes
+            reply["metrics"] = metrics.drain()
+            reply["status_updates"] = status_writer.drain()
+            conn.send(reply)
+            if reply["recycle"]:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+
+
+class _Worker:
+    def __init__(self, context, max_jobs: int, max_rss_bytes: int):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, max_jobs, max_rss_bytes), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+    def call(self, method: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Blocking round trip; raises EOFError/OSError if the worker dies"""
+        self.conn.send((method, payload))
+        return self.conn.recv()
+
+    def stop(self, timeout: float = 10):
+        try:
+            if self.process.is_alive():
+                self.conn.send(None)
+        except (OSError, EOFError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class RenderWorkerPool:
+    """
+    Pre-forked render workers for report_consumer (supervisor mode).
+
+    Workers are forked from a fork server that imported and warmed the render stack once
+    (WORKER_PRELOAD_MODULES), so they start warm and share those pages copy-on-write. The
+    consumer process keeps the AMQP connection and hands each job to an idle worker.
+    Workers are replaced after WORKER_MAX_JOBS reports or once they exceed WORKER_MAX_RSS_MB,
+    since WeasyPrint and PyMuPDF memory creeps up over long runs.
+    """
+
+    def __init__(self, size: int, max_jobs: int = WORKER_MAX_JOBS, max_rss_mb: int = WORKER_MAX_RSS_MB):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_rss_bytes = max_rss_mb * 1024 * 1024
+        self.context = multiprocessing.get_context("forkserver")
+        self.context.set_forkserver_preload(WORKER_PRELOAD_MODULES)
+        self.workers: List[_Worker] = []
+        self._idle: Optional[asyncio.Queue] = None
+        self.recycled = 0
+
+    def _spawn(self) -> _Worker:
+        return _Worker(self.context, self.max_jobs, self.max_rss_bytes)
+
+    async def start(self):
+        """Start the fork server (imports and warms the render stack) and fork the workers"""
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            worker = await asyncio.to_thread(self._spawn)
+            self.workers.append(worker)
+            self._idle.put_nowait(worker)
+        logger.info(f"Started {self.size} render worker(s)")
+
+    async def _replace(self, worker: _Worker) -> _Worker:
+        await asyncio.to_thread(worker.stop)
+        self.workers.remove(worker)
+        replacement = await asyncio.to_thread(self._spawn)
+        self.workers.append(replacement)
+        return replacement
+
+    async def run(self, payload: Dict[str, Any], method: str = "run_with_data") -> Any:
+        """
+        Run an AgentReportGenerator method in an idle worker and return its result: by default
+        a whole report (returns its URL), or "render_prepared" for the render stage of a state
+        """
+        worker = await self._idle.get()
+        try:
+            reply = await asyncio.to_thread(worker.call, method, payload)
+        except (EOFError, OSError) as e:
+            logger.error(f"Render worker {worker.process.pid} died (exit code {worker.process.exitcode}): {str(e)}")
+            self._idle.put_nowait(await self._replace(worker))
+            raise WorkerCrashedError(f"Render worker died: {str(e)}")
+
+        metrics.merge(reply.get("metrics"))
+        ReportStatusWriter().merge(reply.get("status_updates"))
+        if reply.get("recycle"):
+            logger.info(
+                f"Recycling render worker {worker.process.pid} after {reply['jobs']} job(s), "
+                f"RSS {reply['rss_bytes'] / 1024 / 1024:.0f} MB"
+            )
+            self.recycled += 1
+            worker = await self._replace(worker)
+        self._idle.put_nowait(worker)
+
+        if not reply["ok"]:
+            raise Exception(reply["error"])
+        return reply["result"]
+
+    async def close(self, timeout: float = 10):
+        """Stop the workers; one still busy after `timeout` seconds is killed"""
+        await asyncio.gather(*(asyncio.to_thread(worker.stop, timeout) for worker in self.workers))
+        self.workers.clear()
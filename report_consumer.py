@@ -1,101 +1,553 @@
 from helper.rmq import RabbitMQHelper
 from agent.report_generator_agent import AgentReportGenerator
+from service.report_job_service import ReportJobRegistry, ReportJobStatus, publish_report_status, start_report_status_listener
+from helper.metrics import metrics, start_metrics_server, push_metrics_periodically
+from helper.worker_pool import RenderWorkerPool
+from helper.lane_scheduler import LaneScheduler
+from helper.health import HealthMonitor, check_rabbitmq, start_probe_server
+from helper.database import db_postgres
+from service.appointment_export_service import AppointmentExportService
+from service.appointment_report_service import AppointmentReportService
+from service.customize_variable_service import CustomizeVariableCache, build_report_branding, start_customize_variable_listener
+from service.patient_service import PatientService
+from service.report_status_writer import ReportStatusWriter, publish_status_updates
+from schema.report_payload import ReportQueueMessage, ShardPatient
+from pydantic import ValidationError
+from contextlib import asynccontextmanager, nullcontext
+from contextvars import ContextVar
 import asyncio
-import json
-from config.logging import logger
+import signal
+import time
+from config.logging import logger, mask_patient_phi
 from dotenv import load_dotenv
 import os
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator
 import aio_pika
 
 load_dotenv()
 
 # Initialize helpers
 rmq_helper = RabbitMQHelper()
+customize_variable_cache = CustomizeVariableCache()
+status_writer = ReportStatusWriter()
+# Jobs already queued (fed from the report status exchange), so a redelivered expansion is not queued twice
+report_job_registry = ReportJobRegistry()
 
 # Constants
 MAX_RETRIES = 3
 RETRY_DELAY = 5  # seconds
 REDIS_TIMEOUT = 10  # seconds
+# Reports rendered concurrently by this process (one AMQP consumer per lane each)
+CONSUMER_CONCURRENCY = max(1, int(os.getenv('CONSUMER_CONCURRENCY', 1)))
+# Supervisor mode: render in this many pre-forked worker processes (0 renders in-process)
+CONSUMER_WORKERS = int(os.getenv('CONSUMER_WORKERS', 0))
+# Interactive jobs (/generate) started per bulk job (/generate-appointment-report) while both wait
+CONSUMER_INTERACTIVE_WEIGHT = int(os.getenv('CONSUMER_INTERACTIVE_WEIGHT', 4))
+# On SIGTERM, in-flight jobs get this long to finish before they are requeued
+# (Cloud Run sends SIGKILL 10 seconds after SIGTERM)
+CONSUMER_DRAIN_SECONDS = float(os.getenv('CONSUMER_DRAIN_SECONDS', 8))
+# Staged pipeline: a report is prepared (database, attachment downloads, formatting), rendered
+# and uploaded in separate stages with their own slots, so one report's downloads overlap another's
+# render and a third's upload. Reports each lane holds per render slot beyond the one rendering
+# (they wait between the stages); 0 runs every report start to finish in one render slot
+CONSUMER_PIPELINE_DEPTH = max(0, int(os.getenv('CONSUMER_PIPELINE_DEPTH', 2)))
+# Reports prepared / uploaded at the same time (0: as many as there are render slots)
+CONSUMER_PREPARE_CONCURRENCY = int(os.getenv('CONSUMER_PREPARE_CONCURRENCY', 0))
+CONSUMER_UPLOAD_CONCURRENCY = int(os.getenv('CONSUMER_UPLOAD_CONCURRENCY', 0))
+QUEUE_NAME_REPORT_BULK = os.getenv('QUEUE_NAME_REPORT_CONSUMER', 'report_generation')
+# A report's message is acked once its generated status is written; if the database has not
+# taken it by then, the update is queued for another consumer to write instead
+REPORT_STATUS_WRITE_TIMEOUT_SECONDS = float(os.getenv('REPORT_STATUS_WRITE_TIMEOUT_SECONDS', 30))
+TMP_DIR = "tmp"
 
-async def process_report_generation(message: Dict[str, Any]) -> None:
+render_pool: Optional[RenderWorkerPool] = None
+# Slots of each pipeline stage (prepare, render, upload), shared by the lanes
+stage_schedulers: Dict[str, LaneScheduler] = {}
+# Per lane: reports admitted into the pipeline, the bound on reports waiting between stages
+pipeline_admission: Dict[str, asyncio.Semaphore] = {}
+shutdown_requested = asyncio.Event()
+# Consumers to cancel on shutdown, and the messages this process holds (keyed by id)
+consumer_tags: List[Tuple[Any, str]] = []
+in_flight_jobs: Dict[int, Dict[str, Any]] = {}
+# The in_flight_jobs entry of the message handled by the current task
+current_job: ContextVar[Optional[Dict[str, Any]]] = ContextVar("current_job", default=None)
+process_started_at = time.time()
+
+
+class DrainingError(Exception):
+    """A report was not started because the consumer is draining; its message is requeued"""
+
+
+def current_lane() -> str:
+    job = current_job.get()
+    return job["lane"] if job else "bulk"
+
+def mark_job_started() -> None:
+    """Mark the current message as started: on shutdown it gets time to finish instead of being requeued"""
+    job = current_job.get()
+    if job is None or job["started"]:
+        return
+    job["started"] = True
+    enqueued_at = (job["message"].headers or {}).get("x-enqueued-at")
+    if enqueued_at:
+        metrics.observe("queue_wait_duration_seconds", max(0.0, time.time() - float(enqueued_at)), lane=job["lane"])
+
+@asynccontextmanager
+async def stage_slot(stage: str) -> AsyncIterator[None]:
+    """Hold a slot of a pipeline stage; waiting lanes get them in weighted round robin"""
+    scheduler = stage_schedulers.get(stage)
+    async with (scheduler.slot(current_lane()) if scheduler else nullcontext()):
+        mark_job_started()
+        yield
+
+def report_admission():
+    """
+    Held by a report for its whole run: a place among the reports its lane has in the pipeline,
+    or without the pipeline, a render slot from fetch to upload
+    """
+    admission = pipeline_admission.get(current_lane())
+    if CONSUMER_PIPELINE_DEPTH > 0 and admission is not None:
+        return admission
+    return stage_slot("render")
+
+async def render_report(patient_data: Dict[str, Any]) -> str:
+    """Render a report in a pre-forked worker (supervisor mode) or in a thread of this process"""
+    if render_pool:
+        return await render_pool.run(patient_data)
+    # Rendering is blocking; run it in a worker thread so the event loop keeps
+    # serving heartbeats and the other consumers of this process
+    agent = AgentReportGenerator()
+    return await asyncio.to_thread(agent.run_with_data, patient_data)
+
+async def render_prepared_report(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Render stage of a prepared report, in a pre-forked worker or in a thread of this process"""
+    if render_pool:
+        return await render_pool.run(state, "render_prepared")
+    return await asyncio.to_thread(AgentReportGenerator().render_prepared, state)
+
+async def run_report_pipeline(patient_data: Dict[str, Any]) -> str:
+    """
+    Prepare, render and upload one report, each stage in one of its slots, and return its URL.
+    Between two stages the report waits with its prepared state only, holding no slot.
+    """
+    agent = AgentReportGenerator()
+    async with stage_slot("prepare"):
+        if shutdown_requested.is_set():
+            raise DrainingError("Consumer is draining")
+        started_at = time.time()
+        try:
+            state = await asyncio.to_thread(agent.prepare_report, patient_data)
+        except BaseException:
+            metrics.observe("report_total_duration_seconds", time.time() - started_at, outcome="error")
+            raise
+
+    try:
+        waited_at = time.time()
+        async with stage_slot("render"):
+            metrics.observe("report_pipeline_wait_seconds", time.time() - waited_at, stage="render")
+            state = await render_prepared_report(state)
+
+        waited_at = time.time()
+        async with stage_slot("upload"):
+            metrics.observe("report_pipeline_wait_seconds", time.time() - waited_at, stage="upload")
+            url = await asyncio.to_thread(agent.upload_report, state)
+    except BaseException:
+        metrics.observe("report_total_duration_seconds", time.time() - started_at, outcome="error")
+        # Downloaded attachments (and the PDF) are otherwise only removed by the upload stage
+        agent.cleanup_files(state)
+        raise
+    metrics.observe("report_total_duration_seconds", time.time() - started_at, outcome="success")
+    return url
+
+async def wait_status_written(appointment_patient_ids: List[str]) -> None:
+    """Wait until the patients' generated status is in the database (queued durably if it is not in time)"""
+    appointment_patient_ids = [patient_id for patient_id in appointment_patient_ids if patient_id]
+    if not appointment_patient_ids:
+        return
+    _, not_written = await asyncio.wait(
+        [asyncio.wrap_future(status_writer.written(patient_id)) for patient_id in appointment_patient_ids],
+        timeout=REPORT_STATUS_WRITE_TIMEOUT_SECONDS
+    )
+    if not_written:
+        logger.warning(f"Report status of {len(not_written)} patient(s) not written after {REPORT_STATUS_WRITE_TIMEOUT_SECONDS}s, queueing it")
+        await publish_status_updates(status_writer.withdraw(appointment_patient_ids))
+
+async def process_report_generation(message: ReportQueueMessage) -> None:
     """Process report generation request from queue"""
-    batch_id = message.get("batch_id")
+    batch_id = message.batch_id
     if not batch_id:
         logger.error("No batch_id in message")
         return
 
+    patient_data = message.patient_data or {}
+    mask_patient_phi(patient_data)
+    job_status = {
+        "appointment_id": patient_data.get("appointment_id"),
+        "appointment_patient_id": patient_data.get("patient_id"),
+        "appointment_batch_id": message.appointment_batch_id,
+    }
+
     try:
         logger.info(f"Starting report generation for batch {batch_id}")
-        patient_data = message.get("patient_data")
         
         if not patient_data:
             raise ValueError("No patient data in message")
 
-        # Generate report using the agent
-        logger.info(f"Initializing report generator agent for batch {batch_id}")
-        agent = AgentReportGenerator()
-        
-        for attempt in range(MAX_RETRIES):
-            try:
-                result = agent.run_with_data(patient_data)
-                
-                if result:
-                    logger.info(f"Report generated successfully for batch {batch_id}")
-                    return
-                else:
-                    raise ValueError("Failed to get URL from report generation")
-                    
-            except Exception as e:
-                if attempt < MAX_RETRIES - 1:
-                    logger.warning(f"Attempt {attempt + 1} failed, retrying in {RETRY_DELAY} seconds: {str(e)}")
-                    await asyncio.sleep(RETRY_DELAY)
-                else:
+        async with report_admission():
+            if shutdown_requested.is_set():
+                raise DrainingError("Consumer is draining")
+
+            await publish_report_status(batch_id, ReportJobStatus.PROCESSING, **job_status)
+
+            # Every patient of an appointment shares the customize variables: load them once per appointment
+            if patient_data.get("customize_variables") is None and patient_data.get("appointment_id"):
+                try:
+                    patient_data["customize_variables"] = await customize_variable_cache.get(patient_data["appointment_id"])
+                except Exception as e:
+                    logger.warning(f"Customize variable cache unavailable, the agent will query them: {str(e)}")
+
+            # Generate report using the agent
+            for attempt in range(MAX_RETRIES):
+                try:
+                    if CONSUMER_PIPELINE_DEPTH > 0:
+                        result = await run_report_pipeline(patient_data)
+                    else:
+                        result = await render_report(patient_data)
+
+                    if result:
+                        break
+                    else:
+                        raise ValueError("Failed to get URL from report generation")
+
+                except DrainingError:
                     raise
-                    
+                except Exception as e:
+                    if attempt < MAX_RETRIES - 1:
+                        logger.warning(f"Attempt {attempt + 1} failed, retrying in {RETRY_DELAY} seconds: {str(e)}")
+                        await asyncio.sleep(RETRY_DELAY)
+                    else:
+                        raise
+
+        # The message is acked when this returns: the status must be stored by then, or a crash
+        # would lose it (the upload stage left it with the status writer)
+        await wait_status_written([job_status["appointment_patient_id"]])
+        logger.info(f"Report generated successfully for batch {batch_id}")
+        metrics.inc("report_jobs_total", outcome="generated")
+        await publish_report_status(batch_id, ReportJobStatus.GENERATED, url=result, **job_status)
+
+    except DrainingError:
+        logger.info(f"Not starting batch {batch_id}: the consumer is draining")
+        raise
     except Exception as e:
         error_msg = str(e)
         logger.error(f"Error processing report generation for batch {batch_id}: {error_msg}")
         logger.exception("Full traceback:")
+        metrics.inc("report_jobs_total", outcome="failed")
+        await publish_report_status(batch_id, ReportJobStatus.FAILED, error=error_msg, **job_status)
+
+async def process_appointment_report(message: ReportQueueMessage) -> None:
+    """Expand an appointment-wide run (queued by /generate-appointment-report) into shard jobs"""
+    appointment_batch_id = message.batch_id
+    appointment_id = message.appointment_id
+    if not appointment_batch_id or not appointment_id:
+        logger.error("No batch_id or appointment_id in appointment report message")
+        return
+    # Quick, and not safe to cut short half way through queueing the shards
+    mark_job_started()
+
+    try:
+        service = AppointmentReportService()
+        patients = await asyncio.to_thread(service.get_report_patients, appointment_id)
+        if not patients:
+            raise ValueError(f"Patient not found with Appointment ID: {appointment_id}")
+
+        shards = service.plan_shards(appointment_id, appointment_batch_id, patients)
+        await publish_report_status(
+            None,
+            None,
+            appointment_id=appointment_id,
+            appointment_batch_id=appointment_batch_id,
+            total=len(patients),
+        )
+        queued = 0
+        for shard in shards:
+            # The batch ids are derived from the appointment batch: the ones already tracked were
+            # queued by an earlier delivery of this message, so a redelivery only queues the rest
+            shard = [patient for patient in shard if report_job_registry.get_job(patient["batch_id"]) is None]
+            if not shard:
+                continue
+            await rmq_helper.publish(QUEUE_NAME_REPORT_BULK, {
+                "type": "appointment_report_shard",
+                "appointment_batch_id": appointment_batch_id,
+                "appointment_id": appointment_id,
+                "language": message.language,
+                "patients": shard,
+            })
+            for patient in shard:
+                report_job_registry.apply_event(await publish_report_status(
+                    patient["batch_id"],
+                    ReportJobStatus.QUEUED,
+                    appointment_id=appointment_id,
+                    appointment_patient_id=patient["appointment_patient_id"],
+                    appointment_batch_id=appointment_batch_id,
+                ))
+            queued += len(shard)
+        metrics.inc("report_jobs_total", outcome="expanded")
+        logger.info(
+            f"Appointment {appointment_id}: {queued} report(s) queued in {len(shards)} shard(s)"
+            + (f", {len(patients) - queued} already queued by an earlier delivery" if queued < len(patients) else "")
+        )
+    except Exception as e:
+        logger.error(f"Error expanding appointment report {appointment_batch_id} of appointment {appointment_id}: {str(e)}")
+        metrics.inc("report_jobs_total", outcome="expand_failed")
+        await publish_report_status(appointment_batch_id, ReportJobStatus.FAILED, appointment_id=appointment_id, error=str(e))
+
+async def process_appointment_report_shard(message: ReportQueueMessage) -> None:
+    """
+    Render a shard of an appointment's reports. Patient data is loaded for the whole shard in
+    one set of queries, and the customize variables and company assets once, before the reports
+    go through the pipeline like single reports (so interactive ones keep their priority).
+    """
+    appointment_id = message.appointment_id
+    patients = message.patients or []
+    if not appointment_id or not patients:
+        logger.error("No appointment_id or patients in appointment report shard message")
+        return
+    job_status = {"appointment_id": appointment_id, "appointment_batch_id": message.appointment_batch_id}
+
+    for attempt in range(MAX_RETRIES):
+        try:
+            patients_data = await asyncio.to_thread(
+                PatientService.get_patients_data,
+                appointment_id,
+                [patient.appointment_patient_id for patient in patients],
+                message.language
+            )
+            break
+        except Exception as e:
+            if attempt < MAX_RETRIES - 1:
+                logger.warning(f"Loading shard of appointment {appointment_id} failed (attempt {attempt + 1}), retrying in {RETRY_DELAY} seconds: {str(e)}")
+                await asyncio.sleep(RETRY_DELAY)
+                continue
+            logger.error(f"Error loading shard of appointment {appointment_id}: {str(e)}")
+            metrics.inc("report_jobs_total", len(patients), outcome="failed")
+            for patient in patients:
+                await publish_report_status(
+                    patient.batch_id,
+                    ReportJobStatus.FAILED,
+                    appointment_patient_id=patient.appointment_patient_id,
+                    error=str(e),
+                    **job_status
+                )
+            return
+
+    customize_variables = None
+    try:
+        customize_variables = await customize_variable_cache.get(appointment_id)
+        # Bundles the company header/footer/signatures now, instead of in the first render
+        await asyncio.to_thread(build_report_branding, customize_variables, message.language)
+    except Exception as e:
+        logger.warning(f"Could not prepare the shared report context of appointment {appointment_id}: {str(e)}")
+
+    # Reports generated or failed; the others are handed back if the shard is cut short
+    finished = set()
+    hand_over_task = None
+
+    async def publish_unfinished():
+        unfinished = [patient for patient in patients if patient.batch_id not in finished]
+        if unfinished:
+            if len(unfinished) == len(patients) and job is not None:
+                # Nothing finished: forward the delivered body untouched instead of encoding it again
+                await rmq_helper.publish(QUEUE_NAME_REPORT_BULK, job["message"].body)
+            else:
+                await rmq_helper.publish(QUEUE_NAME_REPORT_BULK, message.model_copy(update={"patients": unfinished}))
+            logger.info(f"Draining: requeued {len(unfinished)} of {len(patients)} report(s) of a shard of appointment {appointment_id}")
+
+    async def hand_over_unfinished():
+        """Queue the unfinished reports as a smaller shard (once, whether the shard or the drain asks first)"""
+        nonlocal hand_over_task
+        if hand_over_task is None:
+            hand_over_task = asyncio.ensure_future(publish_unfinished())
+        # Shielded: the drain cancels this handler once the hand over is done
+        await asyncio.shield(hand_over_task)
+
+    job = current_job.get()
+    if job is not None:
+        # Used by the drain if the shard does not finish in time, instead of requeueing all of it
+        job["hand_over"] = hand_over_unfinished
+
+    async def render_patient(patient: ShardPatient):
+        patient_data = patients_data.get(patient.appointment_patient_id)
+        if patient_data is None:
+            metrics.inc("report_jobs_total", outcome="failed")
+            await publish_report_status(
+                patient.batch_id,
+                ReportJobStatus.FAILED,
+                appointment_patient_id=patient.appointment_patient_id,
+                error="Patient data not found",
+                **job_status
+            )
+            finished.add(patient.batch_id)
+            return
+
+        patient_data["filename"] = patient.filename
+        patient_data["language"] = message.language
+        patient_data["customize_variables"] = customize_variables
+        try:
+            await process_report_generation(ReportQueueMessage(
+                batch_id=patient.batch_id,
+                appointment_batch_id=message.appointment_batch_id,
+                patient_data=patient_data
+            ))
+            finished.add(patient.batch_id)
+        except DrainingError:
+            pass
+
+    # Every report goes through the pipeline on its own (the lane's admission bounds how many)
+    await asyncio.gather(*(render_patient(patient) for patient in patients))
+
+    if len(finished) < len(patients):
+        # Not started because the consumer began draining: hand the rest back as a smaller shard
+        # rather than have the whole shard requeued
+        await hand_over_unfinished()
+
+async def process_appointment_export(message: ReportQueueMessage) -> None:
+    """Build the merged PDF / ZIP of an appointment's generated reports"""
+    export_id = message.batch_id
+    appointment_id = message.appointment_id
+    if not export_id or not appointment_id:
+        logger.error("No batch_id or appointment_id in export message")
+        return
+
+    # Merging holds a render slot: it is as heavy as rendering
+    async with stage_slot("render"):
+        try:
+            logger.info(f"Starting export {export_id} of appointment {appointment_id}")
+            await publish_report_status(export_id, ReportJobStatus.PROCESSING, appointment_id=appointment_id)
+            export = await asyncio.to_thread(
+                AppointmentExportService().build_export,
+                appointment_id,
+                export_id,
+                message.format
+            )
+            metrics.inc("report_jobs_total", outcome="exported")
+            await publish_report_status(
+                export_id,
+                ReportJobStatus.GENERATED,
+                appointment_id=appointment_id,
+                url=export["url"],
+                total=export["report_count"]
+            )
+        except Exception as e:
+            logger.error(f"Error building export {export_id} of appointment {appointment_id}: {str(e)}")
+            metrics.inc("report_jobs_total", outcome="export_failed")
+            await publish_report_status(export_id, ReportJobStatus.FAILED, appointment_id=appointment_id, error=str(e))
+
+async def process_report_status_updates(message: ReportQueueMessage) -> None:
+    """Write the report statuses another consumer could not (queued by publish_status_updates)"""
+    if not message.updates:
+        return
+    mark_job_started()
+    status_writer.merge(message.updates)
+    await wait_status_written(list(message.updates))
+
+MESSAGE_HANDLERS = {
+    "report": process_report_generation,
+    "appointment_report": process_appointment_report,
+    "appointment_report_shard": process_appointment_report_shard,
+    "appointment_export": process_appointment_export,
+    "report_status_updates": process_report_status_updates,
+}
 
 async def setup_rabbitmq():
     """Setup RabbitMQ connection and queue"""
-    while True:
+    while not shutdown_requested.is_set():
         try:
             logger.info("Connecting to RabbitMQ...")
             await rmq_helper.connect()
             
             channel = rmq_helper.channel
-            queue_name = os.getenv('QUEUE_NAME_REPORT_CONSUMER', 'report_generation')
-            prefixed_queue_name = rmq_helper.get_prefixed_queue_name(queue_name)
-            
-            # Declare main queue without additional configurations
-            queue = await channel.declare_queue(
-                prefixed_queue_name,
-                durable=True  # Keep only durability setting
+            # Lanes in priority order: single reports get their own queue so they never wait
+            # behind the backlog of an appointment-wide run
+            lane_queue_names = {
+                "interactive": os.getenv('QUEUE_NAME_REPORT_INTERACTIVE', 'report_generation_interactive'),
+                "bulk": QUEUE_NAME_REPORT_BULK,
+            }
+            concurrency = render_pool.size if render_pool else CONSUMER_CONCURRENCY
+            weights = {"interactive": CONSUMER_INTERACTIVE_WEIGHT, "bulk": 1}
+            stage_schedulers.update({
+                "prepare": LaneScheduler(CONSUMER_PREPARE_CONCURRENCY or concurrency, weights),
+                "render": LaneScheduler(concurrency, weights),
+                "upload": LaneScheduler(CONSUMER_UPLOAD_CONCURRENCY or concurrency, weights),
+            })
+            # Messages each lane holds: one per render slot, plus the pipeline's reports in between stages
+            lane_capacity = concurrency * (1 + CONSUMER_PIPELINE_DEPTH)
+            pipeline_admission.update({lane: asyncio.Semaphore(lane_capacity) for lane in lane_queue_names})
+            # A connection for every stage slot that can query at once, for every held message (shard
+            # loads, customize variable loads and expansions query outside the slots) and for the
+            # status writer's flushes
+            db_postgres.set_max_connections(
+                sum(scheduler.slots for scheduler in stage_schedulers.values())
+                + lane_capacity * len(lane_queue_names)
+                + 1
             )
-            
-            logger.info(f"Queue '{prefixed_queue_name}' declared successfully")
-            
-            async def process_message(message: aio_pika.IncomingMessage):
-                async with message.process():
+
+            def make_message_processor(lane: str):
+                async def process_message(message: aio_pika.IncomingMessage):
+                    job = {"message": message, "task": asyncio.current_task(), "started": False, "lane": lane}
+                    in_flight_jobs[id(message)] = job
+                    current_job.set(job)
                     try:
-                        body = json.loads(message.body.decode())
-                        await process_report_generation(body)
-                    except json.JSONDecodeError as je:
-                        logger.error(f"Invalid JSON in message: {str(je)}")
-                        # Don't requeue invalid messages
-                        await message.reject(requeue=False)
-                    except Exception as e:
-                        logger.error(f"Error processing message: {str(e)}")
-                        # Requeue only if not redelivered
-                        await message.reject(requeue=not message.redelivered)
-            
-            # Start consuming
-            await queue.consume(process_message)
-            logger.info("Consumer setup completed")
+                        if shutdown_requested.is_set():
+                            # Delivered while draining: hand it straight back to another consumer
+                            await message.nack(requeue=True)
+                            return
+
+                        # ignore_processed: handlers may reject explicitly, don't ack those again on exit
+                        async with message.process(ignore_processed=True):
+                            try:
+                                # Parses, validates and fills defaults in one pass (unknown types are rejected here)
+                                body = ReportQueueMessage.model_validate_json(message.body)
+                            except ValidationError as ve:
+                                logger.error(f"Invalid message: {ve.errors()[0]['msg']}")
+                                # Don't requeue invalid messages
+                                await message.reject(requeue=False)
+                                return
+
+                            # Handlers take the stage slots they need (see stage_slot), which marks the job started
+                            try:
+                                await MESSAGE_HANDLERS[body.type](body)
+                            except DrainingError:
+                                await message.nack(requeue=True)
+                            except Exception as e:
+                                logger.error(f"Error processing message: {str(e)}")
+                                # Requeue only if not redelivered
+                                await message.reject(requeue=not message.redelivered)
+                    finally:
+                        in_flight_jobs.pop(id(message), None)
+                return process_message
+
+            # Every lane gets one consumer per render slot, so the broker's consumer count is what the
+            # autoscaler plans with; each consumer holds its render slot's share of the pipeline through
+            # the per-consumer prefetch, and the schedulers decide which waiting job goes next
+            await channel.set_qos(prefetch_count=1 + CONSUMER_PIPELINE_DEPTH)
+            queues = {}
+            for lane, queue_name in lane_queue_names.items():
+                prefixed_queue_name = rmq_helper.get_prefixed_queue_name(queue_name)
+                queues[lane] = await channel.declare_queue(
+                    prefixed_queue_name,
+                    durable=True  # Keep only durability setting
+                )
+                logger.info(f"Queue '{prefixed_queue_name}' declared successfully")
+                for _ in range(concurrency):
+                    consumer_tag = await queues[lane].consume(make_message_processor(lane))
+                    consumer_tags.append((queues[lane], consumer_tag))
+            logger.info(
+                f"Consumer setup completed with {concurrency} render slot(s) shared by lanes {list(queues)}, "
+                f"{lane_capacity} message(s) per lane"
+            )
             
-            return queue
+            return queues
             
         except aio_pika.exceptions.ConnectionClosed:
             logger.error("RabbitMQ connection closed. Retrying...")
@@ -103,17 +555,133 @@ async def setup_rabbitmq():
         except Exception as e:
             logger.error(f"Error setting up RabbitMQ: {str(e)}")
             await asyncio.sleep(RETRY_DELAY)
+    return {}
+
+async def requeue_job(job: Dict[str, Any]) -> None:
+    """
+    Give an unfinished message back to the broker, then stop its handler. A job that can hand over
+    just its unfinished part (a shard) queues that as a new message and the original is acked.
+    """
+    message = job["message"]
+    try:
+        if not message.processed:
+            hand_over = job.get("hand_over")
+            if hand_over:
+                try:
+                    await hand_over()
+                    await message.ack()
+                except Exception as e:
+                    logger.warning(f"Could not hand over the unfinished part of a message, requeueing all of it: {str(e)}")
+            if not message.processed:
+                await message.nack(requeue=True)
+    except Exception as e:
+        logger.warning(f"Could not requeue message: {str(e)}")
+    job["task"].cancel()
+
+async def drain_in_flight_jobs() -> None:
+    """
+    Graceful shutdown: stop consuming, requeue jobs that are still waiting for their first slot,
+    give running jobs CONSUMER_DRAIN_SECONDS to finish and requeue whatever is left.
+    """
+    for queue, consumer_tag in consumer_tags:
+        try:
+            await queue.cancel(consumer_tag)
+        except Exception as e:
+            logger.warning(f"Could not cancel consumer {consumer_tag}: {str(e)}")
+    consumer_tags.clear()
+
+    waiting = [job for job in in_flight_jobs.values() if not job["started"]]
+    for job in waiting:
+        await requeue_job(job)
+
+    running = [job["task"] for job in in_flight_jobs.values() if job["started"]]
+    logger.info(f"Draining: {len(running)} job(s) running, {len(waiting)} waiting job(s) requeued")
+    if running:
+        await asyncio.wait(running, timeout=CONSUMER_DRAIN_SECONDS)
+
+    unfinished = list(in_flight_jobs.values())
+    for job in unfinished:
+        await requeue_job(job)
+    if unfinished:
+        # Let the cancelled handlers unwind (their message is already settled)
+        await asyncio.wait([job["task"] for job in unfinished], timeout=1)
+        logger.warning(f"Requeued {len(unfinished)} job(s) that did not finish within {CONSUMER_DRAIN_SECONDS}s")
+
+def cleanup_tmp_files() -> None:
+    """Remove the work files this process left in tmp/ (caches live in subdirectories and are kept)"""
+    if not os.path.isdir(TMP_DIR):
+        return
+    removed = 0
+    for entry in os.scandir(TMP_DIR):
+        try:
+            if entry.is_file() and entry.stat().st_mtime >= process_started_at:
+                os.remove(entry.path)
+                removed += 1
+        except OSError as e:
+            logger.warning(f"Could not remove {entry.path}: {str(e)}")
+    logger.info(f"Removed {removed} file(s) from {TMP_DIR}/")
+
+def request_shutdown(sig: signal.Signals) -> None:
+    logger.info(f"Received {sig.name}, draining the consumer...")
+    shutdown_requested.set()
+
+async def start_metrics_exporter():
+    """Expose consumer metrics: scraped on METRICS_PORT and/or pushed to METRICS_PUSHGATEWAY_URL"""
+    metrics_port = os.getenv('METRICS_PORT')
+    if metrics_port:
+        await start_metrics_server(int(metrics_port))
+
+    pushgateway_url = os.getenv('METRICS_PUSHGATEWAY_URL')
+    if pushgateway_url:
+        asyncio.create_task(push_metrics_periodically(
+            pushgateway_url,
+            job=os.getenv('METRICS_JOB_NAME', 'report_consumer'),
+            interval=float(os.getenv('METRICS_PUSH_INTERVAL', 15))
+        ))
+
+async def start_health_probe():
+    """Serve /livez and /readyz on CONSUMER_HEALTH_PORT: queue connection, in-flight jobs, loop lag"""
+    health_monitor = HealthMonitor()
+    health_monitor.add_check("rabbitmq", check_rabbitmq)
+    health_monitor.add_info("in_flight_jobs", lambda: len(in_flight_jobs))
+    health_monitor.add_info("running_jobs", lambda: sum(1 for job in in_flight_jobs.values() if job["started"]))
+    # Reports waiting for a slot of each pipeline stage
+    health_monitor.add_info("stage_waiting", lambda: {stage: scheduler.waiting() for stage, scheduler in stage_schedulers.items()})
+    # Not ready while draining, so nothing routes new work here
+    health_monitor.add_info("draining", shutdown_requested.is_set)
+    health_monitor.start()
+
+    health_port = os.getenv('CONSUMER_HEALTH_PORT')
+    if health_port:
+        await start_probe_server(int(health_port), health_monitor)
 
 async def main():
     """Main consumer function"""
-    while True:
+    global render_pool
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, request_shutdown, sig)
+
+    await start_metrics_exporter()
+    await start_health_probe()
+    status_writer.start()
+
+    if CONSUMER_WORKERS > 0:
+        render_pool = RenderWorkerPool(CONSUMER_WORKERS)
+        await render_pool.start()
+
+    while not shutdown_requested.is_set():
         try:
             logger.info("Starting report generation consumer...")
-            queue = await setup_rabbitmq()
+            await setup_rabbitmq()
+            # Both are cancelled with the connection in the finally below, so they restart with it
+            start_customize_variable_listener()
+            start_report_status_listener()
             
-            # Keep the consumer running
+            # Keep the consumer running until SIGTERM/SIGINT, then drain before disconnecting
             logger.info("Consumer is now running and waiting for messages...")
-            await asyncio.Future()  # run forever
+            await shutdown_requested.wait()
+            await drain_in_flight_jobs()
             
         except asyncio.CancelledError:
             logger.info("Consumer was cancelled, shutting down...")
@@ -129,6 +697,17 @@ async def main():
             except Exception as e:
                 logger.error(f"Error closing RabbitMQ connection: {str(e)}")
 
+    if render_pool:
+        # Kills workers still busy with a job that was requeued
+        await render_pool.close(timeout=1)
+    # After the drain: every report that finished has recorded its status by now; what the
+    # database does not take is queued for the next consumer
+    try:
+        await publish_status_updates(await asyncio.to_thread(status_writer.close))
+    finally:
+        await rmq_helper.close()
+    cleanup_tmp_files()
+
 if __name__ == "__main__":
     try:
         asyncio.run(main())
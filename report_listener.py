@@ -0,0 +1,254 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from helper.rmq import RabbitMQHelper
+from helper.database import db_postgres, DB_CONFIG
+from helper.debouncer import KeyedDebouncer
+from helper.metrics import metrics, start_metrics_server
+from service.patient_service import PatientService
+from service.report_job_service import ReportJobStatus, publish_report_status
+from schema.report_payload import AnalysisChangeNotification
+from pydantic import ValidationError
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from config.logging import logger
+from datetime import datetime
+from typing import Any, Dict, Hashable
+import asyncio
+import psycopg2
+import re
+import signal
+import uuid
+import os
+
+# Regenerates reports when a patient's analysis changes, instead of upstream systems polling and
+# re-triggering whole appointments. A trigger on b2b_bumame_appointment_patient_analysis sends a
+# NOTIFY per changed row; bursts are coalesced per patient and only those patients are queued.
+REPORT_LISTENER_CHANNEL = os.getenv('REPORT_LISTENER_CHANNEL', 'appointment_patient_analysis_changed')
+# A patient is queued once no change arrived for this long...
+REPORT_LISTENER_DEBOUNCE_SECONDS = float(os.getenv('REPORT_LISTENER_DEBOUNCE_SECONDS', 10))
+# ...or this long after its first change, if edits keep coming
+REPORT_LISTENER_MAX_DELAY_SECONDS = float(os.getenv('REPORT_LISTENER_MAX_DELAY_SECONDS', 60))
+# Create/replace the trigger on startup (needs owner rights on the table)
+REPORT_LISTENER_INSTALL_TRIGGER = os.getenv('REPORT_LISTENER_INSTALL_TRIGGER', 'false').lower() == 'true'
+REPORT_LISTENER_LANGUAGE = os.getenv('REPORT_LISTENER_LANGUAGE', 'id')
+# How often the idle LISTEN connection is checked
+REPORT_LISTENER_KEEPALIVE_SECONDS = float(os.getenv('REPORT_LISTENER_KEEPALIVE_SECONDS', 30))
+RECONNECT_DELAY = 5  # seconds
+
+if not re.fullmatch(r'[a-z_][a-z0-9_]*', REPORT_LISTENER_CHANNEL):
+    raise ValueError(f"Invalid REPORT_LISTENER_CHANNEL: {REPORT_LISTENER_CHANNEL}")
+
+# Only the columns the report is built from. The consumer's own writes (examination_status,
+# medical_report_url_v2, result_issued_at) must not notify, or every report would regenerate itself.
+# UPDATE OF also fires when a column is SET to its current value, hence the IS DISTINCT FROM check.
+TRIGGER_DDL = f"""
+CREATE OR REPLACE FUNCTION notify_{REPORT_LISTENER_CHANNEL}() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND ROW(
+        OLD.doctor_examiner_name, OLD.prescreening_test_json, OLD.physical_examination_json,
+        OLD.vital_sign_examination_json, OLD.lab_examination_json, OLD.electromedical_examination_json,
+        OLD.examination_conclusion_json, OLD.examination_advice, OLD.examination_analysis,
+        OLD.specimen_taken_at, OLD.is_deleted
+    ) IS NOT DISTINCT FROM ROW(
+        NEW.doctor_examiner_name, NEW.prescreening_test_json, NEW.physical_examination_json,
+        NEW.vital_sign_examination_json, NEW.lab_examination_json, NEW.electromedical_examination_json,
+        NEW.examination_conclusion_json, NEW.examination_advice, NEW.examination_analysis,
+        NEW.specimen_taken_at, NEW.is_deleted
+    ) THEN
+        RETURN NEW;
+    END IF;
+    -- Identical payloads within one transaction are delivered once
+    PERFORM pg_notify('{REPORT_LISTENER_CHANNEL}', json_build_object(
+        'appointment_patient_id', NEW.appointment_patient_id,
+        'appointment_id', NEW.appointment_id,
+        'op', TG_OP
+    )::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS {REPORT_LISTENER_CHANNEL} ON b2b_bumame_appointment_patient_analysis;
+CREATE TRIGGER {REPORT_LISTENER_CHANNEL}
+AFTER INSERT OR UPDATE OF
+    doctor_examiner_name, prescreening_test_json, physical_examination_json,
+    vital_sign_examination_json, lab_examination_json, electromedical_examination_json,
+    examination_conclusion_json, examination_advice, examination_analysis,
+    specimen_taken_at, is_deleted
+ON b2b_bumame_appointment_patient_analysis
+FOR EACH ROW
+WHEN (NEW.is_deleted = 0)
+EXECUTE FUNCTION notify_{REPORT_LISTENER_CHANNEL}();
+"""
+
+rmq_helper = RabbitMQHelper()
+shutdown_requested = asyncio.Event()
+
+
+def safe_filename_part(value: str) -> str:
+    return "".join(c for c in value if c.isalnum() or c.isspace()).replace(" ", "_")
+
+
+async def enqueue_changed_patients(changed: Dict[Hashable, Any]) -> None:
+    """Queue a report for every changed patient that has checked out (one query for the whole batch)"""
+    patient_query = """
+    SELECT p.name as patient_name, cc.name as company_name, p.id as patient_id, p.appointment_id
+    FROM b2b_bumame_appointment_patient p
+    JOIN b2b_bumame_appointment a ON p.appointment_id = a.id
+    JOIN b2b_bumame_company_client cc ON a.company_client_id = cc.id
+    WHERE p.id IN %s AND p.is_deleted = 0 AND a.is_deleted = 0 AND cc.is_deleted = 0 AND p.status = 'check_out_examination'
+    """
+    patients = await asyncio.to_thread(db_postgres.fetch_query, patient_query, (tuple(changed),))
+    skipped = len(changed) - len(patients)
+    if skipped:
+        # Not checked out yet: the report is generated when the appointment run picks them up
+        metrics.inc("report_listener_notifications_total", value=skipped, result="skipped")
+
+    jobs = []
+    for patient_name, company_name, patient_id, appointment_id in patients:
+        try:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"{appointment_id}_{patient_id}_{safe_filename_part(patient_name)}_{safe_filename_part(company_name)}_{timestamp}"
+
+            patient_data = await asyncio.to_thread(
+                PatientService.get_patient_data, patient_id, appointment_id, REPORT_LISTENER_LANGUAGE
+            )
+            patient_data['filename'] = filename
+            patient_data['language'] = REPORT_LISTENER_LANGUAGE
+            jobs.append((patient_id, appointment_id, patient_data))
+        except Exception as e:
+            metrics.inc("report_listener_notifications_total", result="failed")
+            logger.error(f"Error loading changed patient {patient_id}: {str(e)}")
+
+    # One statement for the whole batch, committed before the jobs can reach a consumer
+    await asyncio.to_thread(
+        PatientService.update_status_to_generating_bulk,
+        [(patient_id, appointment_id) for patient_id, appointment_id, _ in jobs]
+    )
+
+    queue_name = os.getenv('QUEUE_NAME_REPORT_CONSUMER', 'report_generation')
+    for patient_id, appointment_id, patient_data in jobs:
+        try:
+            batch_id = str(uuid.uuid4())
+            await rmq_helper.publish(queue_name, {
+                "batch_id": batch_id,
+                "patient_data": patient_data
+            })
+            await publish_report_status(
+                batch_id,
+                ReportJobStatus.QUEUED,
+                appointment_id=appointment_id,
+                appointment_patient_id=patient_id,
+            )
+            metrics.inc("report_listener_notifications_total", result="enqueued")
+            logger.info(f"Queued report {batch_id} for changed patient {patient_id}")
+        except Exception as e:
+            metrics.inc("report_listener_notifications_total", result="failed")
+            logger.error(f"Error queueing report for changed patient {patient_id}: {str(e)}")
+
+
+def connect_listener() -> "psycopg2.extensions.connection":
+    """Dedicated autocommit connection for LISTEN (pooled connections can't hold a subscription)"""
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    with conn.cursor() as cursor:
+        if REPORT_LISTENER_INSTALL_TRIGGER:
+            cursor.execute(TRIGGER_DDL)
+            logger.info(f"Installed trigger {REPORT_LISTENER_CHANNEL} on b2b_bumame_appointment_patient_analysis")
+        cursor.execute(f"LISTEN {REPORT_LISTENER_CHANNEL}")
+    return conn
+
+
+def drain_notifications(conn, debouncer: KeyedDebouncer) -> None:
+    """Move the notifications psycopg2 has read off the socket into the debouncer"""
+    conn.poll()
+    while conn.notifies:
+        notification = conn.notifies.pop(0)
+        try:
+            change = AnalysisChangeNotification.model_validate_json(notification.payload)
+        except ValidationError as ve:
+            logger.warning(f"Ignoring malformed notification on {notification.channel}: {ve.errors()[0]['msg']}")
+            continue
+        if debouncer.add(change.appointment_patient_id, change.appointment_id):
+            metrics.inc("report_listener_notifications_total", result="received")
+        else:
+            metrics.inc("report_listener_notifications_total", result="coalesced")
+
+
+async def listen(debouncer: KeyedDebouncer) -> None:
+    """Feed notifications into the debouncer until shutdown; raises when the connection is lost"""
+    loop = asyncio.get_running_loop()
+    conn = await asyncio.to_thread(connect_listener)
+    connection_lost: asyncio.Future = loop.create_future()
+
+    def on_readable():
+        try:
+            drain_notifications(conn, debouncer)
+        except Exception as e:
+            if not connection_lost.done():
+                connection_lost.set_exception(e)
+
+    loop.add_reader(conn.fileno(), on_readable)
+    logger.info(f"Listening on {REPORT_LISTENER_CHANNEL} (debounce {REPORT_LISTENER_DEBOUNCE_SECONDS}s, max delay {REPORT_LISTENER_MAX_DELAY_SECONDS}s)")
+    try:
+        while not shutdown_requested.is_set():
+            shutdown = asyncio.ensure_future(shutdown_requested.wait())
+            try:
+                await asyncio.wait({shutdown, connection_lost}, timeout=REPORT_LISTENER_KEEPALIVE_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                shutdown.cancel()
+            if connection_lost.done():
+                connection_lost.result()
+            # A dead TCP connection may never become readable: probe it while idle
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            drain_notifications(conn, debouncer)
+    finally:
+        loop.remove_reader(conn.fileno())
+        conn.close()
+
+
+def request_shutdown(sig: signal.Signals) -> None:
+    logger.info(f"Received {sig.name}, stopping the report listener...")
+    shutdown_requested.set()
+
+
+async def main():
+    """Listen for analysis changes and queue the affected patients' reports"""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, request_shutdown, sig)
+
+    metrics_port = os.getenv('METRICS_PORT')
+    if metrics_port:
+        await start_metrics_server(int(metrics_port))
+
+    debouncer = KeyedDebouncer(REPORT_LISTENER_DEBOUNCE_SECONDS, REPORT_LISTENER_MAX_DELAY_SECONDS, enqueue_changed_patients)
+    flusher = asyncio.create_task(debouncer.run())
+
+    while not shutdown_requested.is_set():
+        try:
+            await listen(debouncer)
+        except Exception as e:
+            # Changes committed while disconnected are not replayed: trigger those through the API
+            logger.error(f"Report listener connection lost: {str(e)}")
+            logger.info(f"Reconnecting in {RECONNECT_DELAY} seconds...")
+            try:
+                await asyncio.wait_for(shutdown_requested.wait(), timeout=RECONNECT_DELAY)
+            except asyncio.TimeoutError:
+                pass
+
+    flusher.cancel()
+    # Queue what is still waiting out its debounce window rather than dropping it
+    await debouncer.flush_all()
+    await rmq_helper.close()
+    db_postgres.close_all()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Report listener stopped by user")
+    except Exception as e:
+        logger.error(f"Fatal error: {str(e)}")
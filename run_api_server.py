@@ -1,21 +1,63 @@
 from dotenv import load_dotenv
+import asyncio
 import os
 import time
 from datetime import datetime
 
 load_dotenv()
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from api import healthcheck_api, report_generator_api, cloud_run_job_api
+from api import healthcheck_api, report_generator_api, cloud_run_job_api, metrics_api
 from config.logging import logger
+from helper.rmq import RabbitMQHelper
+from service.report_job_service import start_report_status_listener
+from service.report_status_writer import ReportStatusWriter, publish_status_updates
+from helper.cloud_run_job import close_session
+from helper.health import HealthMonitor, check_database, check_rabbitmq
 
 # Set timezone to GMT+7 (Asia/Jakarta)
 os.environ['TZ'] = 'Asia/Jakarta'
 if hasattr(time, 'tzset'):
     time.tzset()
 
+# Import the render stack and open the DB pool in the background once the server is serving
+API_WARMUP = os.getenv('API_WARMUP', 'true').lower() == 'true'
+
+def _warm_up():
+    started_at = time.perf_counter()
+    try:
+        import agent.report_generator_agent  # noqa: F401
+        from helper.database import db_postgres
+        db_postgres.fetch_query("SELECT 1")
+    except Exception as e:
+        logger.warning(f"Warm-up incomplete: {str(e)}")
+        return
+    logger.info(f"Warm-up finished in {time.perf_counter() - started_at:.2f}s")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Keep the report job registry in sync with the consumers
+    start_report_status_listener()
+    ReportStatusWriter().start()
+    # /readyz and /healthcheck read these cached results instead of querying on every probe
+    health_monitor = HealthMonitor()
+    health_monitor.add_check("database", check_database)
+    health_monitor.add_check("rabbitmq", check_rabbitmq)
+    health_monitor.start()
+    if API_WARMUP:
+        # Keep a reference so the task isn't garbage collected before it finishes
+        app.state.warmup_task = asyncio.create_task(asyncio.to_thread(_warm_up))
+    yield
+    await health_monitor.stop()
+    # What the database does not take is queued for a consumer to write
+    await publish_status_updates(await asyncio.to_thread(ReportStatusWriter().close))
+    await RabbitMQHelper().close()
+    await close_session()
+
 app = FastAPI(
+    lifespan=lifespan,
     title="Bumame General ML Service",
     description="API for General ML Service",
     version="1.0.0",
@@ -33,6 +75,7 @@ app.add_middleware(
 )
 
 app.include_router(healthcheck_api.router, tags=["system"])
+app.include_router(metrics_api.router, tags=["system"])
 app.include_router(report_generator_api.router, prefix="/report-generator", tags=["report-generator"])
 app.include_router(cloud_run_job_api.router, prefix="/cloud-run-job", tags=["cloud-run-job"])
 
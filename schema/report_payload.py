@@ -0,0 +1,132 @@
+from copy import deepcopy
+from typing import Any, ClassVar, Dict, List, Literal, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, RootModel
+
+# Shapes of the JSON text columns of b2b_bumame_appointment_patient_analysis, with the
+# defaults the report shows when a column is empty or invalid. Validated straight from the
+# column text by pydantic-core (parse and type check in one pass); keys the models do not
+# name are kept as they are.
+
+# [label, value] rows, as the report lists them
+Rows = List[List[Any]]
+
+
+class PrescreeningTest(BaseModel):
+    """prescreening_test_json: rows per history section (other sections are shown as they are)"""
+    riwayat_penyakit_sendiri: Rows = Field(default_factory=lambda: [["a. Riwayat Penyakit", "Tidak Ada"]])
+    riwayat_penyakit_keluarga: Rows = Field(default_factory=lambda: [["a. Riwayat Penyakit", "Tidak Ada"]])
+    kebiasaan: Rows = Field(default_factory=lambda: [["a. Kebiasaan", "Tidak Ada"]])
+
+    model_config = ConfigDict(extra="allow")
+
+
+class ExaminationRows(RootModel[Rows]):
+    """physical_examination_json and vital_sign_examination_json"""
+    root: Rows = Field(default_factory=list)
+
+
+class ExaminationConclusion(RootModel[Rows]):
+    """examination_conclusion_json"""
+    root: Rows = Field(default_factory=lambda: [["Tanda Vital", "-"], ["Pemeriksaan Fisik", "-"]])
+
+
+class LabExamination(BaseModel):
+    """lab_examination_json"""
+    header: Dict[str, Any] = Field(default_factory=lambda: {"nama": "-", "no_rm": "-"})
+    sections: List[Any] = Field(default_factory=list)
+
+    model_config = ConfigDict(extra="allow")
+
+
+def _examination_without_data(title: str, subtitle: str) -> Dict[str, Any]:
+    return {
+        "title": title,
+        "subtitle": subtitle,
+        "hasil": "Tidak ada data",
+        "kesimpulan": "Tidak ada data",
+        "dokter": {"name": "-", "title": "Dokter Pemeriksa"},
+        "url": "-",
+    }
+
+
+class ElectromedicalExamination(BaseModel):
+    """
+    electromedical_examination_json: one result block per examination the patient had.
+    Dumped with exclude_unset, so only those are listed; report_sections() fills in the rest.
+    """
+    rontgen: Optional[Dict[str, Any]] = None
+    audiometri: Optional[Dict[str, Any]] = None
+    ekg: Optional[Dict[str, Any]] = None
+    spirometri: Optional[Dict[str, Any]] = None
+    treadmill: Optional[Dict[str, Any]] = None
+    usg_abdomen: Optional[Dict[str, Any]] = None
+    usg_mammae: Optional[Dict[str, Any]] = None
+
+    model_config = ConfigDict(extra="allow")
+
+    # Block shown for an examination without data
+    DEFAULTS: ClassVar[Dict[str, Dict[str, Any]]] = {
+        "rontgen": _examination_without_data("HASIL PEMERIKSAAN RADIOLOGI", "THORAX FOTO"),
+        "audiometri": {"diagnosis": [["Tidak ada data", "Tidak ada data"]]},
+        "ekg": _examination_without_data("Pemeriksaan Elektrokardiografi (EKG)", "Hasil Perekaman Aktivitas Listrik Jantung"),
+        "spirometri": _examination_without_data("Pemeriksaan Fungsi Paru - Spirometri", "Hasil Pengukuran Kapasitas dan Aliran Udara Paru"),
+        "treadmill": _examination_without_data("Pemeriksaan Treadmill Test", "Hasil Uji Toleransi Jantung terhadap Stres"),
+        "usg_abdomen": _examination_without_data("Pemeriksaan Ultrasonografi - Abdomen", "Hasil Pemindaian USG pada Organ Abdomen"),
+        "usg_mammae": _examination_without_data("Pemeriksaan Ultrasonografi - Mammae", "Hasil Pemindaian USG pada Jaringan Payudara"),
+    }
+
+    def report_sections(self) -> Dict[str, Dict[str, Any]]:
+        """Every examination's block, the default one where there is no data"""
+        return {name: getattr(self, name) or deepcopy(default) for name, default in self.DEFAULTS.items()}
+
+
+ANALYSIS_JSON_COLUMNS = {
+    # column index in the analysis query -> (column name, model)
+    5: ("prescreening_test_json", PrescreeningTest),
+    6: ("physical_examination_json", ExaminationRows),
+    7: ("vital_sign_examination_json", ExaminationRows),
+    8: ("lab_examination_json", LabExamination),
+    9: ("electromedical_examination_json", ElectromedicalExamination),
+    10: ("examination_conclusion_json", ExaminationConclusion),
+}
+
+
+class ShardPatient(BaseModel):
+    """One patient of an appointment_report_shard message"""
+    appointment_patient_id: str
+    batch_id: str
+    filename: str
+
+    model_config = ConfigDict(extra="ignore")
+
+
+class ReportQueueMessage(BaseModel):
+    """Body of a message on the report queues (decoded with model_validate_json)"""
+    type: Literal[
+        "report", "appointment_report", "appointment_report_shard", "appointment_export", "report_status_updates"
+    ] = "report"
+    batch_id: Optional[str] = None
+    appointment_batch_id: Optional[str] = None
+    # report: the payload built by PatientService.get_patient_data, forwarded to the agent as-is
+    patient_data: Optional[Dict[str, Any]] = None
+    # appointment_report, appointment_report_shard and appointment_export
+    appointment_id: Optional[str] = None
+    language: str = "id"
+    # appointment_report_shard: the patients it renders
+    patients: Optional[List[ShardPatient]] = None
+    # appointment_export
+    format: Literal["pdf", "zip"] = "pdf"
+    # report_status_updates: appointment_patient_id -> [url, issued_at] (see ReportStatusWriter)
+    updates: Optional[Dict[str, List[str]]] = None
+
+    model_config = ConfigDict(extra="ignore")
+
+
+class AnalysisChangeNotification(BaseModel):
+    """Payload of the NOTIFY sent by the b2b_bumame_appointment_patient_analysis trigger (see report_listener.py)"""
+    appointment_patient_id: str
+    appointment_id: str
+    op: str = "UPDATE"
+
+    model_config = ConfigDict(extra="ignore")
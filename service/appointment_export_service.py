@@ -0,0 +1,163 @@
+from helper.database import db_postgres
+from helper.common import download_from_gcs
+from helper.metrics import metrics
+from config.logging import logger
+from typing import Any, Dict, List, Optional, Tuple
+import os
+import zipfile
+
+EXPORT_BUCKET_NAME = 'bumame-private-document'
+EXPORT_BLOB_PREFIX = 'b2b-medical-report/exports'
+EXPORT_FORMATS = ("pdf", "zip")
+# Reports appended to the merged PDF between two incremental saves
+EXPORT_MERGE_BATCH_SIZE = int(os.getenv('EXPORT_MERGE_BATCH_SIZE', 20))
+# Upload in chunks so the export never has to fit in memory
+EXPORT_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class AppointmentExportService:
+    """
+    Builds one file per appointment from the patients' generated reports: a merged PDF
+    (with a bookmark per patient) or a ZIP of the individual PDFs.
+
+    Reports are downloaded one at a time and appended to a file on disk, so memory use
+    does not grow with the number of patients. The result is uploaded as a single object.
+    """
+
+    def get_generated_reports(self, appointment_id: str) -> List[Tuple[str, str, str]]:
+        """(appointment_patient_id, patient name, report URL) of every generated report, by name"""
+        report_query = """
+        SELECT p.id, p.name, an.medical_report_url_v2
+        FROM b2b_bumame_appointment_patient p
+        JOIN b2b_bumame_appointment_patient_analysis an
+            ON an.appointment_patient_id = p.id AND an.is_deleted = 0
+        WHERE p.appointment_id = %s AND p.is_deleted = 0
+        AND an.examination_status = 'generated' AND an.medical_report_url_v2 IS NOT NULL
+        ORDER BY p.name, p.id
+        """
+        return db_postgres.fetch_query(report_query, (appointment_id,))
+
+    @staticmethod
+    def _blob_name(report_url: str) -> str:
+        prefix = f"https://storage.googleapis.com/{EXPORT_BUCKET_NAME}/"
+        if not report_url.startswith(prefix):
+            raise ValueError(f"Report URL is not in bucket {EXPORT_BUCKET_NAME}: {report_url}")
+        return report_url[len(prefix):]
+
+    def _download_report(self, export_id: str, index: int, report_url: str) -> str:
+        return download_from_gcs(
+            EXPORT_BUCKET_NAME,
+            self._blob_name(report_url),
+            f"export_{export_id}_{index}.pdf"
+        )
+
+    def _build_merged_pdf(self, export_id: str, reports: List[Tuple[str, str, str]], output_path: str) -> int:
+        """Append each report to output_path with incremental saves; returns the number merged"""
+        import fitz  # PyMuPDF
+
+        merged = 0
+        table_of_contents: List[List[Any]] = []
+        page_count = 0
+        document = fitz.open()
+        for index, (appointment_patient_id, patient_name, report_url) in enumerate(reports):
+            report_path = None
+            try:
+                report_path = self._download_report(export_id, index, report_url)
+                with fitz.open(report_path) as report:
+                    document.insert_pdf(report)
+                    table_of_contents.append([1, patient_name or appointment_patient_id, page_count + 1])
+                    page_count += report.page_count
+                merged += 1
+            except Exception as e:
+                logger.warning(f"Skipping report of patient {appointment_patient_id} in export {export_id}: {str(e)}")
+            else:
+                # Flush to disk every batch and reopen, so only one batch of pages is held in memory
+                # (checked only when a report was added, so a skipped one never flushes the same batch twice)
+                if merged % EXPORT_MERGE_BATCH_SIZE == 0:
+                    document = self._flush(document, output_path)
+            finally:
+                if report_path and os.path.exists(report_path):
+                    os.remove(report_path)
+
+        if not merged:
+            document.close()
+            raise ValueError("No generated report could be added to the export")
+        document.set_toc(table_of_contents)
+        self._flush(document, output_path).close()
+        return merged
+
+    @staticmethod
+    def _flush(document, output_path: str):
+        import fitz  # PyMuPDF
+
+        if document.name == output_path:
+            document.saveIncr()
+        else:
+            document.save(output_path)
+        document.close()
+        return fitz.open(output_path)
+
+    def _build_zip(self, export_id: str, reports: List[Tuple[str, str, str]], output_path: str) -> int:
+        merged = 0
+        # PDFs are already compressed, so they are stored as-is
+        with zipfile.ZipFile(output_path, "w", compression=zipfile.ZIP_STORED) as archive:
+            for index, (appointment_patient_id, patient_name, report_url) in enumerate(reports):
+                report_path = None
+                try:
+                    report_path = self._download_report(export_id, index, report_url)
+                    archive.write(report_path, arcname=os.path.basename(self._blob_name(report_url)))
+                    merged += 1
+                except Exception as e:
+                    logger.warning(f"Skipping report of patient {appointment_patient_id} in export {export_id}: {str(e)}")
+                finally:
+                    if report_path and os.path.exists(report_path):
+                        os.remove(report_path)
+        if not merged:
+            raise ValueError("No generated report could be added to the export")
+        return merged
+
+    def find_export(self, appointment_id: str, export_id: str) -> Optional[str]:
+        """URL of an export already uploaded, or None (for a status no longer, or never, held in memory)"""
+        from google.cloud import storage
+
+        prefix = f"{EXPORT_BLOB_PREFIX}/{appointment_id}/{export_id}."
+        for blob in storage.Client().list_blobs(EXPORT_BUCKET_NAME, prefix=prefix, max_results=1):
+            return f"https://storage.googleapis.com/{EXPORT_BUCKET_NAME}/{blob.name}"
+        return None
+
+    def build_export(self, appointment_id: str, export_id: str, export_format: str = "pdf") -> Dict[str, Any]:
+        """Build and upload the export of an appointment (blocking); returns its URL and report count"""
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {export_format}")
+
+        reports = self.get_generated_reports(appointment_id)
+        if not reports:
+            raise ValueError(f"No generated reports for Appointment ID: {appointment_id}")
+
+        os.makedirs("tmp", exist_ok=True)
+        output_path = os.path.join("tmp", f"export_{export_id}.{export_format}")
+        try:
+            with metrics.timer("appointment_export_duration_seconds", format=export_format):
+                if export_format == "pdf":
+                    report_count = self._build_merged_pdf(export_id, reports, output_path)
+                else:
+                    report_count = self._build_zip(export_id, reports, output_path)
+
+                from google.cloud import storage
+
+                blob_name = f"{EXPORT_BLOB_PREFIX}/{appointment_id}/{export_id}.{export_format}"
+                blob = storage.Client().bucket(EXPORT_BUCKET_NAME).blob(blob_name, chunk_size=EXPORT_UPLOAD_CHUNK_SIZE)
+                blob.upload_from_filename(
+                    output_path,
+                    content_type="application/pdf" if export_format == "pdf" else "application/zip"
+                )
+            metrics.observe("appointment_export_size_bytes", os.path.getsize(output_path), format=export_format)
+            logger.info(f"Export {export_id} of appointment {appointment_id}: {report_count}/{len(reports)} reports")
+            return {
+                "url": f"https://storage.googleapis.com/{EXPORT_BUCKET_NAME}/{blob_name}",
+                "report_count": report_count,
+                "total": len(reports),
+            }
+        finally:
+            if os.path.exists(output_path):
+                os.remove(output_path)
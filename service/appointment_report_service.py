@@ -0,0 +1,55 @@
+from helper.database import db_postgres
+from typing import Any, Dict, List, Tuple
+from datetime import datetime
+import os
+import uuid
+
+# Patients rendered by one appointment_report_shard message
+APPOINTMENT_SHARD_SIZE = max(1, int(os.getenv('APPOINTMENT_SHARD_SIZE', 50)))
+
+
+class AppointmentReportService:
+    """
+    Expands an appointment-wide report run (/generate-appointment-report) into shards.
+
+    The API only queues one appointment_report message; a consumer lists the checked-out
+    patients and queues one appointment_report_shard per APPOINTMENT_SHARD_SIZE patients,
+    which the consumers then render in parallel.
+    """
+
+    def get_report_patients(self, appointment_id: str) -> List[Tuple[str, str, str]]:
+        """(patient name, company name, appointment_patient_id) of every checked-out patient"""
+        patient_query = """
+        SELECT p.name as patient_name, cc.name as company_name, p.id as patient_id
+        FROM b2b_bumame_appointment_patient p
+        JOIN b2b_bumame_appointment a ON p.appointment_id = a.id
+        JOIN b2b_bumame_company_client cc ON a.company_client_id = cc.id
+        WHERE p.appointment_id = %s AND p.is_deleted = 0 AND a.is_deleted = 0 AND cc.is_deleted = 0 AND p.status = 'check_out_examination'
+        ORDER BY p.id
+        """
+        return db_postgres.fetch_query(patient_query, (appointment_id,))
+
+    @staticmethod
+    def plan_shards(
+        appointment_id: str,
+        appointment_batch_id: str,
+        patients: List[Tuple[str, str, str]],
+        shard_size: int = APPOINTMENT_SHARD_SIZE
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Split the patients into shards of `shard_size`, each patient with its report filename and
+        job batch_id. The batch_id is derived from the appointment batch, so expanding the same
+        message twice (a redelivery) tracks the same jobs.
+        """
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        planned = []
+        for patient_name, company_name, appointment_patient_id in patients:
+            # Create safe names for filename
+            safe_patient_name = "".join(c for c in patient_name if c.isalnum() or c.isspace()).replace(" ", "_")
+            safe_company_name = "".join(c for c in company_name if c.isalnum() or c.isspace()).replace(" ", "_")
+            planned.append({
+                "appointment_patient_id": appointment_patient_id,
+                "batch_id": str(uuid.uuid5(uuid.NAMESPACE_OID, f"{appointment_batch_id}/{appointment_patient_id}")),
+                "filename": f"{appointment_id}_{appointment_patient_id}_{safe_patient_name}_{safe_company_name}_{timestamp}",
+            })
+        return [planned[i:i + shard_size] for i in range(0, len(planned), shard_size)]
@@ -0,0 +1,167 @@
+from config.logging import logger
+from helper.singleton import singleton
+from helper.rmq import RabbitMQHelper
+from helper.cloud_run_job import _get_cr_job_params, _list_job_executions, _count_execution_tasks
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import asyncio
+import math
+import os
+import time
+
+# Consumers started by one Cloud Run Job task: its render slots, each registered as one AMQP consumer per lane
+CONSUMERS_PER_TASK = int(os.getenv('CONSUMERS_PER_TASK', 3))
+# The backlog should be drained within this many seconds (while keeping up with new publishes)
+AUTOSCALER_TARGET_DRAIN_SECONDS = float(os.getenv('AUTOSCALER_TARGET_DRAIN_SECONDS', 600))
+# Reports per second one consumer is assumed to ack until a rate has been observed
+AUTOSCALER_CONSUMER_THROUGHPUT = float(os.getenv('AUTOSCALER_CONSUMER_THROUGHPUT', 0.1))
+AUTOSCALER_MAX_CONSUMERS = int(os.getenv('AUTOSCALER_MAX_CONSUMERS', 15))
+# No further scale-up this long after the last one, so new tasks can connect first
+AUTOSCALER_COOLDOWN_SECONDS = float(os.getenv('AUTOSCALER_COOLDOWN_SECONDS', 60))
+# Tasks we started count as "starting" for this long if the executions API doesn't list them yet
+AUTOSCALER_STARTING_GRACE_SECONDS = float(os.getenv('AUTOSCALER_STARTING_GRACE_SECONDS', 180))
+# Weight of the newest observation in the moving averages
+AUTOSCALER_SMOOTHING = float(os.getenv('AUTOSCALER_SMOOTHING', 0.3))
+
+
+@singleton
+class QueueAutoscaler:
+    """
+    Decides how many Cloud Run Job tasks to start for the report queues (all lanes together).
+
+    Each evaluation estimates the publish rate and the per-consumer ack rate (from the
+    RabbitMQ management API when configured, otherwise from queue depth deltas), then asks
+    for enough consumers to drain the backlog within AUTOSCALER_TARGET_DRAIN_SECONDS:
+
+        needed = (backlog / target_drain_seconds + publish_rate) / per_consumer_rate
+
+    Consumers already connected and tasks still starting are subtracted before any new task
+    is requested, and scale-ups are spaced by AUTOSCALER_COOLDOWN_SECONDS.
+    """
+
+    def __init__(self):
+        self.samples: Deque[Tuple[float, int, int]] = deque(maxlen=60)
+        self.recent_starts: List[Tuple[float, int]] = []
+        self.publish_rate: Optional[float] = None
+        self.consumer_throughput = AUTOSCALER_CONSUMER_THROUGHPUT
+        self.last_scale_up_at: Optional[float] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    @staticmethod
+    def _smooth(previous: Optional[float], value: float) -> float:
+        if previous is None:
+            return value
+        return AUTOSCALER_SMOOTHING * value + (1 - AUTOSCALER_SMOOTHING) * previous
+
+    def _update_rates(self, now: float, depth: int, consumers: int, stats: Optional[Dict[str, Any]]):
+        if stats:
+            self.publish_rate = self._smooth(self.publish_rate, stats["publish_rate"])
+            if stats["ack_rate"] > 0 and consumers > 0 and depth > 0:
+                # Only learn throughput while consumers are saturated, otherwise it reflects the arrival rate
+                self.consumer_throughput = self._smooth(self.consumer_throughput, stats["ack_rate"] / consumers)
+        elif self.samples:
+            previous_at, previous_depth, previous_consumers = self.samples[-1]
+            elapsed = now - previous_at
+            if elapsed > 0:
+                # depth change = published - acked, with acked estimated from the consumers that were running
+                acked = previous_consumers * self.consumer_throughput * elapsed
+                published = max(0.0, depth - previous_depth + acked)
+                self.publish_rate = self._smooth(self.publish_rate, published / elapsed)
+        self.samples.append((now, depth, consumers))
+
+    def _starting_tasks(self, now: float, listed_starting: int) -> int:
+        self.recent_starts = [
+            (started_at, tasks) for started_at, tasks in self.recent_starts
+            if now - started_at < AUTOSCALER_STARTING_GRACE_SECONDS
+        ]
+        recently_started = sum(tasks for _, tasks in self.recent_starts)
+        return max(listed_starting, recently_started)
+
+    async def _listed_starting_tasks(self) -> int:
+        params = _get_cr_job_params()
+        if not params:
+            return 0
+        try:
+            executions = await _list_job_executions(params["project"], params["region"], params["job"])
+            return _count_execution_tasks(executions)["starting"]
+        except Exception as e:
+            logger.warning(f"Could not list Cloud Run Job executions: {str(e)}")
+            return 0
+
+    async def _observe(self, queue_names: Tuple[str, ...]) -> Tuple[int, int, Optional[Dict[str, Any]]]:
+        """
+        Depth, consumers and (when the management API answers for every queue) rates, summed over
+        the lanes. Each consumer process subscribes to every lane, so consumers are the largest count.
+        """
+        rmq_helper = RabbitMQHelper()
+        all_stats = [await rmq_helper.get_queue_stats(queue_name) for queue_name in queue_names]
+        if all(all_stats):
+            stats = {
+                "messages_ready": sum(item["messages_ready"] for item in all_stats),
+                "consumers": max(item["consumers"] for item in all_stats),
+                "publish_rate": sum(item["publish_rate"] for item in all_stats),
+                "ack_rate": sum(item["ack_rate"] for item in all_stats),
+            }
+            return stats["messages_ready"], stats["consumers"], stats
+
+        depth = 0
+        consumers = 0
+        for queue_name in queue_names:
+            depth += await rmq_helper.get_queue_message_count(queue_name)
+            consumers = max(consumers, await rmq_helper.get_queue_consumer_count(queue_name))
+        return depth, consumers, None
+
+    async def evaluate(self, *queue_names: str) -> Dict[str, Any]:
+        """Observe the queues (lanes) and return the scaling decision (tasks_to_start may be 0)"""
+        async with self._get_lock():
+            now = time.monotonic()
+            depth, consumers, stats = await self._observe(queue_names)
+
+            self._update_rates(now, depth, consumers, stats)
+            starting_tasks = self._starting_tasks(now, await self._listed_starting_tasks())
+            provisioned = consumers + starting_tasks * CONSUMERS_PER_TASK
+
+            publish_rate = self.publish_rate or 0.0
+            needed = 0
+            if depth > 0:
+                required_rate = depth / AUTOSCALER_TARGET_DRAIN_SECONDS + publish_rate
+                needed = min(AUTOSCALER_MAX_CONSUMERS, math.ceil(required_rate / self.consumer_throughput))
+
+            capacity = provisioned * self.consumer_throughput
+            drain_seconds = None
+            if depth > 0 and capacity > publish_rate:
+                drain_seconds = depth / (capacity - publish_rate)
+
+            deficit = max(0, needed - provisioned)
+            tasks_to_start = math.ceil(deficit / CONSUMERS_PER_TASK)
+            reason = "scale_up" if tasks_to_start else ("idle" if depth == 0 else "sufficient")
+            if tasks_to_start and self.last_scale_up_at and now - self.last_scale_up_at < AUTOSCALER_COOLDOWN_SECONDS:
+                tasks_to_start = 0
+                reason = "cooldown"
+
+            decision = {
+                "queue_depth": depth,
+                "consumers_running": consumers,
+                "tasks_starting": starting_tasks,
+                "publish_rate": round(publish_rate, 4),
+                "consumer_throughput": round(self.consumer_throughput, 4),
+                "estimated_drain_seconds": round(drain_seconds, 1) if drain_seconds is not None else None,
+                "consumers_needed": needed,
+                "tasks_to_start": tasks_to_start,
+                "reason": reason,
+            }
+            logger.info(f"Autoscaler decision for {', '.join(queue_names)}: {decision}")
+            return decision
+
+    def record_scale_up(self, tasks: int) -> None:
+        """Register tasks that were just requested so the next evaluations count them as starting"""
+        if tasks <= 0:
+            return
+        now = time.monotonic()
+        self.recent_starts.append((now, tasks))
+        self.last_scale_up_at = now
@@ -0,0 +1,151 @@
+from config.logging import logger
+from helper.singleton import singleton
+from helper.rmq import RabbitMQHelper
+from helper.database import db_postgres
+from helper.language_mapping_medical_report import get_text
+from helper.metrics import metrics
+from helper.asset_bundle import ASSETS_DIR, AssetBundle
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import os
+import time
+
+CUSTOMIZE_VARIABLE_EXCHANGE = os.getenv('EXCHANGE_NAME_CUSTOMIZE_VARIABLE', 'customize_variable')
+CUSTOMIZE_VARIABLE_CACHE_TTL_SECONDS = float(os.getenv('CUSTOMIZE_VARIABLE_CACHE_TTL_SECONDS', 300))
+
+
+def fetch_customize_variables(appointment_id: str) -> Dict[str, str]:
+    """Customize variables (key -> value) of an appointment"""
+    customize_variable_query = """
+        SELECT key, value FROM b2b_bumame_appointment_customize_variable
+        WHERE appointment_id = %s AND is_deleted = 0
+    """
+    return {row[0]: row[1] for row in db_postgres.fetch_query(customize_variable_query, (appointment_id,))}
+
+
+def build_report_branding(customize_variables: Dict[str, Any], language: str) -> Dict[str, Any]:
+    """Header/footer images and the signing doctor/lab blocks, with the appointment's overrides applied"""
+    header_image_url = customize_variables.get("header_image_url")
+    footer_image_url = customize_variables.get("footer_image_url")
+    dokter_pemeriksa_data = {
+        "name": "dr. Muhammad Reza Kurniawan",
+        "title": get_text("examining_doctor", language),
+        "signature_url": os.path.join(ASSETS_DIR, "internal_reza_signature.png")
+    }
+    penanggung_jawab_lab_data = {
+        "name": "dr. Dwi Utomo Nusantara, Sp. PK",
+        "title": get_text("laboratory_supervisor", language),
+        "signature_url": os.path.join(ASSETS_DIR, "penanggung_jawab_dwi_utomo_signature.jpg")
+    }
+    diperiksa_oleh_data = {
+        "name": "Yaufita Lokananta",
+        "title": get_text("examined_by", language),
+        "signature_url": os.path.join(ASSETS_DIR, "pemeriksa_yaufita_signature.jpg")
+    }
+
+    if customize_variables.get("dokter_internal_signature_url") is not None:
+        dokter_pemeriksa_data["signature_url"] = customize_variables["dokter_internal_signature_url"]
+
+    if customize_variables.get("dokter_internal") is not None:
+        dokter_pemeriksa_data["name"] = customize_variables["dokter_internal"]
+
+    if customize_variables.get("penanggung_jawab_hasil") is not None:
+        penanggung_jawab_lab_data["name"] = customize_variables["penanggung_jawab_hasil"]
+
+    if customize_variables.get("perujuk_lab") is not None:
+        diperiksa_oleh_data["name"] = customize_variables["perujuk_lab"]
+
+    if customize_variables.get("penanggung_jawab_hasil_signature_url") is not None:
+        penanggung_jawab_lab_data["signature_url"] = customize_variables["penanggung_jawab_hasil_signature_url"]
+
+    if customize_variables.get("perujuk_lab_signature_url") is not None:
+        diperiksa_oleh_data["signature_url"] = customize_variables["perujuk_lab_signature_url"]
+
+    # Pre-sized, recompressed copies (company assets are bundled the first time they are seen)
+    asset_bundle = AssetBundle()
+    for signing_data in (dokter_pemeriksa_data, penanggung_jawab_lab_data, diperiksa_oleh_data):
+        signing_data["signature_url"] = asset_bundle.resolve(signing_data["signature_url"], "signature")
+
+    return {
+        "header_image_url": asset_bundle.resolve(header_image_url if header_image_url is not None else os.path.join(ASSETS_DIR, "top-bumame.png"), "header"),
+        "footer_image_url": asset_bundle.resolve(footer_image_url if footer_image_url is not None else os.path.join(ASSETS_DIR, "bottom-bumame.png"), "footer"),
+        "dokter_pemeriksa_data": dokter_pemeriksa_data,
+        "penanggung_jawab_lab_data": penanggung_jawab_lab_data,
+        "diperiksa_oleh_data": diperiksa_oleh_data,
+    }
+
+
+@singleton
+class CustomizeVariableCache:
+    """
+    Appointment-keyed cache of customize variables for the consumer.
+
+    Every patient of an appointment shares the same variables, so they are loaded once per
+    appointment and kept for CUSTOMIZE_VARIABLE_CACHE_TTL_SECONDS. Concurrent misses for the
+    same appointment share one query (single flight). Entries are dropped early when an
+    invalidation is broadcast on the customize variable exchange.
+    """
+
+    def __init__(self):
+        self.entries: Dict[str, Tuple[float, Dict[str, str]]] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._generation: Dict[str, int] = {}
+
+    async def get(self, appointment_id: str) -> Dict[str, str]:
+        entry = self.entries.get(appointment_id)
+        if entry and entry[0] > time.monotonic():
+            metrics.inc("customize_variable_cache_total", result="hit")
+            return dict(entry[1])
+
+        loading = self._loading.get(appointment_id)
+        if loading is not None:
+            metrics.inc("customize_variable_cache_total", result="coalesced")
+            return dict(await asyncio.shield(loading))
+
+        metrics.inc("customize_variable_cache_total", result="miss")
+        generation = self._generation.get(appointment_id, 0)
+        loading = asyncio.get_running_loop().create_future()
+        self._loading[appointment_id] = loading
+        try:
+            customize_variables = await asyncio.to_thread(fetch_customize_variables, appointment_id)
+            # An invalidation that arrived during the query means the result may already be stale
+            if self._generation.get(appointment_id, 0) == generation:
+                self.entries[appointment_id] = (time.monotonic() + CUSTOMIZE_VARIABLE_CACHE_TTL_SECONDS, customize_variables)
+            loading.set_result(customize_variables)
+        except Exception as e:
+            loading.set_exception(e)
+            # Retrieved here so waiters-less failures don't log "exception was never retrieved"
+            loading.exception()
+            raise
+        finally:
+            if not loading.done():
+                # Cancelled mid-query (e.g. by the drain): the callers sharing it must not hang
+                loading.set_exception(RuntimeError(f"Loading customize variables of appointment {appointment_id} was cancelled"))
+                loading.exception()
+            if self._loading.get(appointment_id) is loading:
+                del self._loading[appointment_id]
+        return dict(customize_variables)
+
+    def invalidate(self, appointment_id: Optional[str] = None) -> None:
+        """Drop one appointment (or everything when appointment_id is None)"""
+        appointment_ids = [appointment_id] if appointment_id else list(self.entries) + list(self._loading)
+        for key in appointment_ids:
+            self.entries.pop(key, None)
+            self._loading.pop(key, None)
+            self._generation[key] = self._generation.get(key, 0) + 1
+        logger.info(f"Customize variable cache invalidated for {appointment_id or 'all appointments'}")
+
+
+async def publish_customize_variable_invalidation(appointment_id: Optional[str] = None) -> None:
+    """Tell every consumer to reload an appointment's customize variables (all when None)"""
+    await RabbitMQHelper().publish_fanout(CUSTOMIZE_VARIABLE_EXCHANGE, {"appointment_id": appointment_id})
+
+
+def start_customize_variable_listener() -> asyncio.Task:
+    """Apply invalidations broadcast on the customize variable exchange to the local cache"""
+    cache = CustomizeVariableCache()
+
+    async def on_invalidation(event: Dict[str, Any]):
+        cache.invalidate(event.get("appointment_id"))
+
+    return RabbitMQHelper().subscribe_fanout(CUSTOMIZE_VARIABLE_EXCHANGE, on_invalidation)
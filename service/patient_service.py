@@ -1,10 +1,24 @@
 from helper.database import db_postgres
 from config.logging import logger
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 from helper.language_mapping_medical_report import get_text
-import json
+from schema.report_payload import ANALYSIS_JSON_COLUMNS
+from pydantic import ValidationError
 from datetime import datetime, timedelta
 
+# Columns read by get_patient_data / get_patients_data, in the order build_patient_data indexes them
+ANALYSIS_COLUMNS = """
+    id, appointment_id, appointment_patient_id, examination_status,
+    doctor_examiner_name, prescreening_test_json, physical_examination_json,
+    vital_sign_examination_json, lab_examination_json, electromedical_examination_json,
+    examination_conclusion_json, examination_advice, examination_analysis,
+    is_deleted, specimen_taken_at, result_issued_at, created_at, updated_at
+"""
+PATIENT_COLUMNS = """
+    id, appointment_id, name, nik, birth_date, gender,
+    "group", is_deleted, created_at, updated_at, d_day_photo_proof_url, check_in_at
+"""
+
 class PatientService:
     def update_status_to_generating(appointment_patient_id: str, appointment_id: str) -> None:
         try:
@@ -18,6 +32,42 @@ class PatientService:
             logger.error(f"Error in update_status_to_generating: {str(e)}")
             raise
 
+    def update_status_to_generating_bulk(patients: List[Tuple[str, str]]) -> None:
+        """update_status_to_generating for many (appointment_patient_id, appointment_id) pairs in one statement"""
+        if not patients:
+            return
+        try:
+            update_status_query = """
+            UPDATE b2b_bumame_appointment_patient_analysis AS t
+            SET examination_status = 'generating'
+            FROM (VALUES %s) AS v(appointment_patient_id, appointment_id)
+            WHERE t.appointment_patient_id = v.appointment_patient_id AND t.appointment_id = v.appointment_id
+            AND t.is_deleted = 0 AND t.examination_status = 'generated'
+            """
+            db_postgres.execute_values(update_status_query, patients)
+        except Exception as e:
+            logger.error(f"Error in update_status_to_generating_bulk: {str(e)}")
+            raise
+
+    def get_report_statuses(appointment_id: str, appointment_patient_id: Optional[str] = None) -> List[Tuple[str, Optional[str], Optional[str]]]:
+        """(appointment_patient_id, examination_status, report URL) of the checked-out patients of an appointment, or of one"""
+        try:
+            status_query = """
+            SELECT p.id, an.examination_status, an.medical_report_url_v2
+            FROM b2b_bumame_appointment_patient p
+            LEFT JOIN b2b_bumame_appointment_patient_analysis an
+                ON an.appointment_patient_id = p.id AND an.appointment_id = p.appointment_id AND an.is_deleted = 0
+            WHERE p.appointment_id = %s AND p.is_deleted = 0 AND p.status = 'check_out_examination'
+            """
+            params: Tuple = (appointment_id,)
+            if appointment_patient_id:
+                status_query += " AND p.id = %s"
+                params += (appointment_patient_id,)
+            return db_postgres.fetch_query(status_query, params)
+        except Exception as e:
+            logger.error(f"Error in get_report_statuses: {str(e)}")
+            raise
+
     def get_patient_data(appointment_patient_id: str, appointment_id: str, language: str = "id") -> Dict[str, Any]:
         """
         Get patient data from database for report generation
@@ -36,16 +86,11 @@ class PatientService:
                 raise ValueError(f"Company data not found for appointment_id: {appointment_id}")
             
             company_name = company_data[0][0]
-            print(f"Company name retrieved: {company_name}")
+            logger.debug(f"Company name retrieved for appointment {appointment_id}")
 
             # Get patient analysis record
-            analysis_query = """
-            SELECT 
-                id, appointment_id, appointment_patient_id, examination_status, 
-                doctor_examiner_name, prescreening_test_json, physical_examination_json, 
-                vital_sign_examination_json, lab_examination_json, electromedical_examination_json, 
-                examination_conclusion_json, examination_advice, examination_analysis,
-                is_deleted, specimen_taken_at, result_issued_at, created_at, updated_at
+            analysis_query = f"""
+            SELECT {ANALYSIS_COLUMNS}
             FROM b2b_bumame_appointment_patient_analysis 
             WHERE appointment_patient_id = %s AND is_deleted = 0
             """
@@ -58,10 +103,8 @@ class PatientService:
             analysis_record = analysis_data[0]
             
             # Get patient details including photo URL
-            patient_query = """
-            SELECT 
-                id, appointment_id, name, nik, birth_date, gender, 
-                "group", is_deleted, created_at, updated_at, d_day_photo_proof_url, check_in_at
+            patient_query = f"""
+            SELECT {PATIENT_COLUMNS}
             FROM b2b_bumame_appointment_patient
             WHERE id = %s AND is_deleted = 0
             """
@@ -84,306 +127,201 @@ class PatientService:
             
             if not appointment_data:
                 raise ValueError(f"Appointment data not found for id: {appointment_id}")
-            
-            
-            # Initialize with default sample structures (based on JSON examples)
-            # These are fallbacks that match the expected structure for each section
-            prescreening_test = {
-                "riwayat_penyakit_sendiri": [
-                    ["a. Riwayat Penyakit", "Tidak Ada"]
-                ],
-                "riwayat_penyakit_keluarga": [
-                    ["a. Riwayat Penyakit", "Tidak Ada"]
-                ],
-                "kebiasaan": [
-                    ["a. Kebiasaan", "Tidak Ada"]
-                ]
-            }
-            
-            # physical_examination = [
-            #     ["Kulit", "Normal"],
-            #     ["Kesadaran Umum", "Normal"]
-            # ]
 
-            physical_examination = []
-            vital_sign = []
-            # vital_sign = [
-            #     ["Tensi (mmHg)", "-"],
-            #     ["Nadi (X/menit)", "-"],
-            #     ["Berat Badan (kg)", "-"],
-            #     ["Tinggi Badan (cm)", "-"],
-            #     ["BMI", "-"]
-            # ]
-            
-            lab_examination = {
-                "header": {
-                    "nama": "-",
-                    "no_rm": "-"
-                },
-                "sections": []
-            }
-            
-            # Define default structure for each examination type
-            default_exam_structures = {
-                "rontgen": {
-                    "title": "HASIL PEMERIKSAAN RADIOLOGI",
-                    "subtitle": "THORAX FOTO",
-                    "hasil": "Tidak ada data",
-                    "kesimpulan": "Tidak ada data",
-                    "dokter": {
-                        "name": "-",
-                        "title": "Dokter Pemeriksa"
-                    },
-                    "url": "-"
-                },
-                "audiometri": {
-                    "diagnosis": [["Tidak ada data", "Tidak ada data"]]
-                },
-                "ekg": {
-                    "title": "Pemeriksaan Elektrokardiografi (EKG)",
-                    "subtitle": "Hasil Perekaman Aktivitas Listrik Jantung",
-                    "hasil": "Tidak ada data",
-                    "kesimpulan": "Tidak ada data",
-                    "dokter": {
-                        "name": "-",
-                        "title": "Dokter Pemeriksa"
-                    },
-                    "url": "-"
-                },
-                "spirometri": {
-                    "title": "Pemeriksaan Fungsi Paru - Spirometri",
-                    "subtitle": "Hasil Pengukuran Kapasitas dan Aliran Udara Paru",
-                    "hasil": "Tidak ada data",
-                    "kesimpulan": "Tidak ada data",
-                    "dokter": {"name": "-", "title": "Dokter Pemeriksa"},
-                    "url": "-"
-                },
-                "treadmill": {
-                    "title": "Pemeriksaan Treadmill Test",
-                    "subtitle": "Hasil Uji Toleransi Jantung terhadap Stres",
-                    "hasil": "Tidak ada data",
-                    "kesimpulan": "Tidak ada data",
-                    "dokter": {"name": "-", "title": "Dokter Pemeriksa"},
-                    "url": "-"
-                },
-                "usg_abdomen": {
-                    "title": "Pemeriksaan Ultrasonografi - Abdomen",
-                    "subtitle": "Hasil Pemindaian USG pada Organ Abdomen",
-                    "hasil": "Tidak ada data",
-                    "kesimpulan": "Tidak ada data",
-                    "dokter": {"name": "-", "title": "Dokter Pemeriksa"},
-                    "url": "-"
-                },
-                "usg_mammae": {
-                    "title": "Pemeriksaan Ultrasonografi - Mammae",
-                    "subtitle": "Hasil Pemindaian USG pada Jaringan Payudara",
-                    "hasil": "Tidak ada data",
-                    "kesimpulan": "Tidak ada data",
-                    "dokter": {"name": "-", "title": "Dokter Pemeriksa"},
-                    "url": "-"
-                }
-            }
-            
-            examination_conclusion = [
-                ["Tanda Vital", "-"],
-                ["Pemeriksaan Fisik", "-"]
-            ]
-            
-            # Map column indexes to clear field names for debugging
-            fields_map = {
-                5: "prescreening_test_json",
-                6: "physical_examination_json",
-                7: "vital_sign_examination_json",
-                8: "lab_examination_json",
-                9: "electromedical_examination_json",
-                10: "examination_conclusion_json"
-            }
-            
-            electromedical_examination = {}
+            return PatientService.build_patient_data(
+                appointment_patient_id, appointment_id, company_name, analysis_record, patient_record, language
+            )
+        except Exception as e:
+            logger.error(f"Error in get_patient_data: {str(e)}")
+            raise
 
-            for idx, field_name in fields_map.items():
+    def get_patients_data(appointment_id: str, appointment_patient_ids: List[str], language: str = "id") -> Dict[str, Dict[str, Any]]:
+        """
+        get_patient_data for many patients of one appointment with three queries in total (company,
+        analyses, patients) instead of four per patient. Patients without an analysis or patient
+        row are left out of the result; the caller reports them.
+        """
+        if not appointment_patient_ids:
+            return {}
+        try:
+            company_query = """
+            SELECT cc.name as company_name
+            FROM b2b_bumame_appointment a
+            JOIN b2b_bumame_company_client cc ON a.company_client_id = cc.id
+            WHERE a.id = %s AND a.is_deleted = 0 AND cc.is_deleted = 0
+            """
+            company_data = db_postgres.fetch_query(company_query, (appointment_id,))
+            if not company_data:
+                raise ValueError(f"Company data not found for appointment_id: {appointment_id}")
+            company_name = company_data[0][0]
+
+            patient_ids = tuple(appointment_patient_ids)
+            analysis_query = f"""
+            SELECT {ANALYSIS_COLUMNS}
+            FROM b2b_bumame_appointment_patient_analysis
+            WHERE appointment_patient_id IN %s AND is_deleted = 0
+            """
+            analysis_by_patient: Dict[str, Tuple] = {}
+            for record in db_postgres.fetch_query(analysis_query, (patient_ids,)):
+                analysis_by_patient.setdefault(record[2], record)
+
+            patient_query = f"""
+            SELECT {PATIENT_COLUMNS}
+            FROM b2b_bumame_appointment_patient
+            WHERE id IN %s AND appointment_id = %s AND is_deleted = 0
+            """
+            patient_by_id = {record[0]: record for record in db_postgres.fetch_query(patient_query, (patient_ids, appointment_id))}
+
+            patients_data = {}
+            for appointment_patient_id in appointment_patient_ids:
+                analysis_record = analysis_by_patient.get(appointment_patient_id)
+                patient_record = patient_by_id.get(appointment_patient_id)
+                if analysis_record is None or patient_record is None:
+                    logger.warning(f"Patient analysis or patient data not found for appointment_patient_id: {appointment_patient_id}")
+                    continue
+                patients_data[appointment_patient_id] = PatientService.build_patient_data(
+                    appointment_patient_id, appointment_id, company_name, analysis_record, patient_record, language
+                )
+            return patients_data
+        except Exception as e:
+            logger.error(f"Error in get_patients_data: {str(e)}")
+            raise
+
+    def build_patient_data(
+        appointment_patient_id: str,
+        appointment_id: str,
+        company_name: str,
+        analysis_record: Tuple,
+        patient_record: Tuple,
+        language: str = "id",
+    ) -> Dict[str, Any]:
+        """Report payload of one patient from its analysis and patient rows (see get_patient_data for the columns)"""
+        # Each JSON column through its model: an empty or invalid column gets the model's defaults
+        columns = {}
+        for idx, (field_name, column_model) in ANALYSIS_JSON_COLUMNS.items():
+            json_str = analysis_record[idx]
+            columns[idx] = None
+            if not json_str or not json_str.strip():
+                logger.debug(f"Empty or whitespace {field_name}, using default")
+            else:
                 try:
-                    json_str = analysis_record[idx]
-                    if json_str and json_str.strip():
-                        # print(f"Raw {field_name} data: {json_str[:200]}...")  # Print first 200 chars
-                        
-                        parsed_data = json.loads(json_str)
-                        # print(f"Successfully parsed {field_name}: {type(parsed_data)}")
-                        # print(f"Sample content of {field_name}: {str(parsed_data)[:200]}...")
-                        
-                        # Assign the parsed data to the correct variable
-                        if idx == 5:
-                            if isinstance(parsed_data, dict):
-                                prescreening_test = parsed_data
-                            else:
-                                print(f"WARNING: prescreening_test_json is not a dict, using default")
-                        elif idx == 6:
-                            if isinstance(parsed_data, list):
-                                physical_examination = parsed_data
-                            else:
-                                print(f"WARNING: physical_examination_json is not a list, using default")
-                        elif idx == 7:
-                            if isinstance(parsed_data, list):
-                                vital_sign = parsed_data
-                            else:
-                                print(f"WARNING: vital_sign_examination_json is not a list, using default")
-                        elif idx == 8:
-                            if isinstance(parsed_data, dict):
-                                lab_examination = parsed_data
-                            else:
-                                print(f"WARNING: lab_examination_json is not a dict, using default")
-                        elif idx == 9:
-                            if isinstance(parsed_data, dict):
-                                electromedical_examination = parsed_data
-                                print(f"Loaded electromedical examination data: {list(electromedical_examination.keys())}")
-                            else:
-                                print(f"WARNING: electromedical_examination_json is not a dict, using empty dict")
-                                electromedical_examination = {}
-                        elif idx == 10:
-                            if isinstance(parsed_data, list):
-                                examination_conclusion = parsed_data
-                            else:
-                                print(f"WARNING: examination_conclusion_json is not a list, using default")
+                    # Parses and checks the shape in one pass
+                    columns[idx] = column_model.model_validate_json(json_str)
+                except ValidationError as e:
+                    logger.warning(f"Invalid {field_name}, using default structure: {e.errors()[0]['msg']}")
+            if columns[idx] is None:
+                columns[idx] = column_model()
+
+        prescreening_test = columns[5].model_dump()
+        physical_examination = columns[6].model_dump()
+        vital_sign = columns[7].model_dump()
+        lab_examination = columns[8].model_dump()
+        # Only the examinations the patient had; the report sections show a default block for the others
+        electromedical_examination = columns[9].model_dump(exclude_unset=True)
+        electromedical_sections = columns[9].report_sections()
+        examination_conclusion = columns[10].model_dump()
+        logger.debug(f"Loaded electromedical examination data: {list(electromedical_examination.keys())}")
+        
+        # Format birth date safely
+        birth_date = patient_record[4]
+        checkin_date = patient_record[11]
+        formatted_birth_date = "-"
+        formatted_checkin_date = "-"
+        
+        if birth_date:
+            # Add one day to the birth date
+            if hasattr(birth_date, 'strftime'):
+                # If it's a datetime object, add one day
+                birth_date_plus_one = birth_date + timedelta(days=1)
+                formatted_birth_date = birth_date_plus_one.strftime("%d-%m-%Y")
+            else:
+                # If it's a string or other format, try to convert and add one day
+                try:
+                    if isinstance(birth_date, str):
+                        # Try to parse the string as a date
+                        parsed_date = datetime.strptime(birth_date, "%Y-%m-%d")
+                        birth_date_plus_one = parsed_date + timedelta(days=1)
+                        formatted_birth_date = birth_date_plus_one.strftime("%d-%m-%Y")
                     else:
-                        print(f"Empty or whitespace {field_name}, using default")
-                except json.JSONDecodeError as e:
-                    logger.error(f"JSON parse error in {field_name}: {e}")
-                    print(f"JSON parse error in {field_name}: {e}")
-                    # print(f"Raw JSON data: {analysis_record[idx][:200]}...")  # Print first 200 chars
-                    print(f"Using default structure for {field_name}")
-            
-            # Format birth date safely
-            birth_date = patient_record[4]
-            checkin_date = patient_record[11]
-            formatted_birth_date = "-"
-            formatted_checkin_date = "-"
-            
-            if birth_date:
-                # Add one day to the birth date
-                if hasattr(birth_date, 'strftime'):
-                    # If it's a datetime object, add one day
-                    birth_date_plus_one = birth_date + timedelta(days=1)
-                    formatted_birth_date = birth_date_plus_one.strftime("%d-%m-%Y")
-                else:
-                    # If it's a string or other format, try to convert and add one day
-                    try:
-                        if isinstance(birth_date, str):
-                            # Try to parse the string as a date
-                            parsed_date = datetime.strptime(birth_date, "%Y-%m-%d")
-                            birth_date_plus_one = parsed_date + timedelta(days=1)
-                            formatted_birth_date = birth_date_plus_one.strftime("%d-%m-%Y")
-                        else:
-                            # For other types, just convert to string
-                            formatted_birth_date = str(birth_date)
-                    except (ValueError, TypeError):
-                        # If parsing fails, just use the original value
+                        # For other types, just convert to string
                         formatted_birth_date = str(birth_date)
+                except (ValueError, TypeError):
+                    # If parsing fails, just use the original value
+                    formatted_birth_date = str(birth_date)
 
-            if checkin_date:
-                # Add one day to the checkout date
-                if hasattr(checkin_date, 'strftime'):
-                    # If it's a datetime object, add one day
-                    checkin_date_plus_one = checkin_date + timedelta(hours=7)
-                    formatted_checkin_date = checkin_date_plus_one.strftime("%d-%m-%Y")
-                else:
-                    # If it's a string or other format, try to convert and add one day
-                    try:
-                        if isinstance(checkin_date, str):
-                            # Try to parse the string as a date
-                            parsed_date = datetime.strptime(checkin_date, "%Y-%m-%d")
-                            checkin_date_plus_one = parsed_date + timedelta(hours=7)
-                            formatted_checkin_date = checkin_date_plus_one.strftime("%d-%m-%Y")
-                        else:
-                            # For other types, just convert to string
-                            formatted_checkin_date = str(checkin_date)
-                    except (ValueError, TypeError):
-                        # If parsing fails, just use the original value
-                        formatted_checkin_date = str(checkin_date)
-            
-            # Get patient photo URL and normalize it
-            patient_photo_url = patient_record[10] if len(patient_record) > 10 else None  # d_day_photo_proof_url
-            
-            # Normalize photo URL format
-            if patient_photo_url:
-                if patient_photo_url.startswith("gs://"):
-                    # Convert gs:// format to https:// format
-                    patient_photo_url = patient_photo_url.replace("gs://", "https://storage.googleapis.com/")
-                print(f"Patient photo URL: {patient_photo_url}")
+        if checkin_date:
+            # Add one day to the checkout date
+            if hasattr(checkin_date, 'strftime'):
+                # If it's a datetime object, add one day
+                checkin_date_plus_one = checkin_date + timedelta(hours=7)
+                formatted_checkin_date = checkin_date_plus_one.strftime("%d-%m-%Y")
             else:
-                print("No patient photo URL found")
+                # If it's a string or other format, try to convert and add one day
+                try:
+                    if isinstance(checkin_date, str):
+                        # Try to parse the string as a date
+                        parsed_date = datetime.strptime(checkin_date, "%Y-%m-%d")
+                        checkin_date_plus_one = parsed_date + timedelta(hours=7)
+                        formatted_checkin_date = checkin_date_plus_one.strftime("%d-%m-%Y")
+                    else:
+                        # For other types, just convert to string
+                        formatted_checkin_date = str(checkin_date)
+                except (ValueError, TypeError):
+                    # If parsing fails, just use the original value
+                    formatted_checkin_date = str(checkin_date)
+        
+        # Get patient photo URL and normalize it
+        patient_photo_url = patient_record[10] if len(patient_record) > 10 else None  # d_day_photo_proof_url
+        
+        # Normalize photo URL format
+        if patient_photo_url:
+            if patient_photo_url.startswith("gs://"):
+                # Convert gs:// format to https:// format
+                patient_photo_url = patient_photo_url.replace("gs://", "https://storage.googleapis.com/")
+        else:
+            logger.debug(f"No patient photo URL found for {appointment_patient_id}")
 
-            # Build patient data structure
-            patient_data_dict = {
-                "patient_id": appointment_patient_id,
-                "appointment_id": appointment_id,
-                "company": company_name,  # Use company name from company_client table
-                "patient_photo_url": patient_photo_url,  # Add patient photo URL
-                "nik": patient_record[3] or "-",
-                "nama": patient_record[2] or "-",
-                "tanggal_lahir": formatted_birth_date,
-                "jenis_kelamin": patient_record[5] or "-",
-                "kelompok": patient_record[6] or "-",
-                "checkin_date": formatted_checkin_date,
-                "identity": {
-                    "basic_info": [
-                        [get_text("nik", language), patient_record[3] or "-"],  # nik
-                        [get_text("name", language), patient_record[2] or "-"],  # name
-                        [get_text("birth_date", language), formatted_birth_date],  # birth_date properly formatted
-                        [get_text("checkout_examination_date", language), formatted_checkin_date],  # checkout_examination_date
-                    ],
-                    "extended_info": [
-                        [get_text("gender", language), patient_record[5] or "-"],  # gender
-                        [get_text("group", language), patient_record[6] or "-"]  # group
-                    ]
-                },
-                "keluhan_sekarang": prescreening_test,
-                "pemeriksaan_fisik": physical_examination,
-                "vital_signs": vital_sign,
-                "laboratory_results": lab_examination,
-                "radiologi": electromedical_examination.get("rontgen", default_exam_structures["rontgen"]),
-                "rontgen": electromedical_examination.get("rontgen", default_exam_structures["rontgen"]),
-                "audiometri": electromedical_examination.get("audiometri", default_exam_structures["audiometri"]),
-                "ekg": electromedical_examination.get("ekg", default_exam_structures["ekg"]),
-                "spirometri": electromedical_examination.get("spirometri", default_exam_structures["spirometri"]),
-                "treadmill": electromedical_examination.get("treadmill", default_exam_structures["treadmill"]),
-                "usg_abdomen": electromedical_examination.get("usg_abdomen", default_exam_structures["usg_abdomen"]),
-                "usg_mammae": electromedical_examination.get("usg_mammae", default_exam_structures["usg_mammae"]),
-                "conclusions": examination_conclusion,
-                "advice": analysis_record[11] or "-",  # examination_advice
-                "analysis": analysis_record[12] or "-",  # examination_analysis
-                "doctor": {
-                    "name": analysis_record[4] or "dr. Specialist",  # doctor_examiner_name
-                    "title": "Dokter Pemeriksa"
-                },
-                "status": analysis_record[3] or "Completed",  # examination_status
-                "electromedical_examination": electromedical_examination,  # Add complete electromedical data
-            }
-            
-            # Only add examination types that exist in the data
-            exam_types = ["audiometri", "ekg", "spirometri", "treadmill", "usg_abdomen", "usg_mammae"]
-            for exam_type in exam_types:
-                if exam_type in electromedical_examination:
-                    patient_data_dict[exam_type] = electromedical_examination[exam_type]
-            
-            print("Final patient data structure:")
-            for key, value in patient_data_dict.items():
-                if key in ["identity", "keluhan_sekarang", "pemeriksaan_fisik", "vital_signs", 
-                        "conclusions", "laboratory_results", "radiologi", "rontgen", "audiometri", "ekg", "spirometri", "treadmill", "usg_abdomen", "usg_mammae"]:
-                    print(f"{key}: {type(value)}")
-                    if isinstance(value, dict):
-                        print(f"  Keys: {list(value.keys())}")
-                    elif isinstance(value, list):
-                        if value and len(value) > 0:
-                            print(f"  First item: {value[0]}")
-                            if isinstance(value[0], list) and len(value[0]) > 0:
-                                print(f"    Item structure: {[type(x) for x in value[0]]}")
-                        else:
-                            print("  Empty list")
-                else:
-                    print(f"{key}: {value}")
-            
-            return patient_data_dict
-        except Exception as e:
-            logger.error(f"Error in get_patient_data: {str(e)}")
-            print(f"Error in get_patient_data: {str(e)}")
-            raise
\ No newline at end of file
+        # Build patient data structure
+        patient_data_dict = {
+            "patient_id": appointment_patient_id,
+            "appointment_id": appointment_id,
+            "company": company_name,  # Use company name from company_client table
+            "patient_photo_url": patient_photo_url,  # Add patient photo URL
+            "nik": patient_record[3] or "-",
+            "nama": patient_record[2] or "-",
+            "tanggal_lahir": formatted_birth_date,
+            "jenis_kelamin": patient_record[5] or "-",
+            "kelompok": patient_record[6] or "-",
+            "checkin_date": formatted_checkin_date,
+            "identity": {
+                "basic_info": [
+                    [get_text("nik", language), patient_record[3] or "-"],  # nik
+                    [get_text("name", language), patient_record[2] or "-"],  # name
+                    [get_text("birth_date", language), formatted_birth_date],  # birth_date properly formatted
+                    [get_text("checkout_examination_date", language), formatted_checkin_date],  # checkout_examination_date
+                ],
+                "extended_info": [
+                    [get_text("gender", language), patient_record[5] or "-"],  # gender
+                    [get_text("group", language), patient_record[6] or "-"]  # group
+                ]
+            },
+            "keluhan_sekarang": prescreening_test,
+            "pemeriksaan_fisik": physical_examination,
+            "vital_signs": vital_sign,
+            "laboratory_results": lab_examination,
+            "radiologi": electromedical_sections["rontgen"],
+            **electromedical_sections,
+            "conclusions": examination_conclusion,
+            "advice": analysis_record[11] or "-",  # examination_advice
+            "analysis": analysis_record[12] or "-",  # examination_analysis
+            "doctor": {
+                "name": analysis_record[4] or "dr. Specialist",  # doctor_examiner_name
+                "title": "Dokter Pemeriksa"
+            },
+            "status": analysis_record[3] or "Completed",  # examination_status
+            "electromedical_examination": electromedical_examination,  # Add complete electromedical data
+        }
+        
+        logger.debug(f"Patient data built for {appointment_patient_id}: {list(patient_data_dict.keys())}")
+        
+        return patient_data_dict
\ No newline at end of file
@@ -0,0 +1,258 @@
+from config.logging import logger
+from helper.singleton import singleton
+from helper.rmq import RabbitMQHelper
+from typing import Any, AsyncIterator, Dict, Optional, Set
+from datetime import datetime, timezone
+import asyncio
+import os
+import time
+import uuid
+
+REPORT_STATUS_EXCHANGE = os.getenv('EXCHANGE_NAME_REPORT_STATUS', 'report_status')
+REPORT_JOB_TTL_SECONDS = int(os.getenv('REPORT_JOB_TTL_SECONDS', 24 * 60 * 60))
+# Tags the events this process publishes: it applies them itself, so their broadcast copy is skipped
+REPORT_STATUS_INSTANCE_ID = uuid.uuid4().hex
+
+
+class ReportJobStatus:
+    """Lifecycle of a single patient report job"""
+    QUEUED = "queued"
+    PROCESSING = "processing"
+    GENERATED = "generated"
+    FAILED = "failed"
+
+    FINISHED = (GENERATED, FAILED)
+
+    # A job never moves backwards, so late or duplicated events cannot undo progress
+    ORDER = {QUEUED: 0, PROCESSING: 1, GENERATED: 2, FAILED: 2}
+
+    @classmethod
+    def from_examination_status(cls, examination_status: Optional[str]) -> str:
+        """Job status matching a stored examination_status, for jobs no status event is known for"""
+        if examination_status == "generated":
+            return cls.GENERATED
+        if examination_status == "generating":
+            return cls.PROCESSING
+        return cls.QUEUED
+
+    @classmethod
+    def aggregate(cls, counts: Dict[str, int], total: int) -> str:
+        """Status of an appointment batch from the counts of its jobs per status"""
+        finished = counts[cls.GENERATED] + counts[cls.FAILED]
+        if total > 0 and finished >= total:
+            return cls.FAILED if counts[cls.FAILED] == total else cls.GENERATED
+        if counts[cls.PROCESSING] > 0 or finished > 0:
+            return cls.PROCESSING
+        return cls.QUEUED
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+@singleton
+class ReportJobRegistry:
+    """
+    In-memory registry of report jobs and appointment batches.
+
+    The registry is fed by status events broadcast on the report status exchange, so every
+    API instance converges on the same view without querying the database. Entries expire
+    after REPORT_JOB_TTL_SECONDS.
+    """
+
+    def __init__(self):
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.appointment_batches: Dict[str, Dict[str, Any]] = {}
+        self.latest_job_by_patient: Dict[str, str] = {}
+        self._expires_at: Dict[str, float] = {}
+        self._version = 0
+        self._changed: Optional[asyncio.Condition] = None
+        # Pending notifications, referenced until done so they are not garbage collected
+        self._notify_tasks: Set[asyncio.Task] = set()
+
+    def _condition(self) -> asyncio.Condition:
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    def _touch(self, key: str):
+        self._expires_at[key] = time.monotonic() + REPORT_JOB_TTL_SECONDS
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        expired = [key for key, expires_at in self._expires_at.items() if expires_at < now]
+        for key in expired:
+            self._expires_at.pop(key, None)
+            job = self.jobs.pop(key, None)
+            if job and self.latest_job_by_patient.get(job["appointment_patient_id"]) == key:
+                self.latest_job_by_patient.pop(job["appointment_patient_id"], None)
+            self.appointment_batches.pop(key, None)
+
+    def apply_event(self, event: Dict[str, Any]) -> None:
+        """Apply a status event (see publish_report_status) to the registry"""
+        self._purge_expired()
+
+        appointment_batch_id = event.get("appointment_batch_id")
+        if appointment_batch_id:
+            batch = self.appointment_batches.setdefault(appointment_batch_id, {
+                "appointment_batch_id": appointment_batch_id,
+                "appointment_id": event.get("appointment_id"),
+                "total": 0,
+                "batch_ids": set(),
+                "created_at": event.get("timestamp") or _now_iso(),
+            })
+            if event.get("total") is not None:
+                batch["total"] = max(batch["total"], int(event["total"]))
+            self._touch(appointment_batch_id)
+
+        batch_id = event.get("batch_id")
+        status = event.get("status")
+        if batch_id and status:
+            job = self.jobs.get(batch_id)
+            if job is None:
+                job = {
+                    "batch_id": batch_id,
+                    "appointment_batch_id": appointment_batch_id,
+                    "appointment_id": event.get("appointment_id"),
+                    "appointment_patient_id": event.get("appointment_patient_id"),
+                    "status": status,
+                    "url": None,
+                    "error": None,
+                    "created_at": event.get("timestamp") or _now_iso(),
+                }
+                self.jobs[batch_id] = job
+            elif ReportJobStatus.ORDER.get(status, 0) < ReportJobStatus.ORDER.get(job["status"], 0):
+                logger.debug(f"Ignoring stale status '{status}' for job {batch_id} (currently '{job['status']}')")
+                return
+
+            job["status"] = status
+            job["updated_at"] = event.get("timestamp") or _now_iso()
+            if event.get("url"):
+                job["url"] = event["url"]
+            if event.get("error"):
+                job["error"] = event["error"]
+
+            if job["appointment_patient_id"]:
+                self.latest_job_by_patient[job["appointment_patient_id"]] = batch_id
+            if appointment_batch_id:
+                self.appointment_batches[appointment_batch_id]["batch_ids"].add(batch_id)
+            self._touch(batch_id)
+
+        self._version += 1
+        task = asyncio.get_running_loop().create_task(self._notify())
+        self._notify_tasks.add(task)
+        task.add_done_callback(self._notify_tasks.discard)
+
+    async def _notify(self):
+        async with self._condition():
+            self._condition().notify_all()
+
+    def get_job(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        job = self.jobs.get(batch_id)
+        return dict(job) if job else None
+
+    def get_latest_job_for_patient(self, appointment_patient_id: str) -> Optional[Dict[str, Any]]:
+        batch_id = self.latest_job_by_patient.get(appointment_patient_id)
+        return self.get_job(batch_id) if batch_id else None
+
+    def get_appointment_batch(self, appointment_batch_id: str) -> Optional[Dict[str, Any]]:
+        batch = self.appointment_batches.get(appointment_batch_id)
+        if batch is None:
+            return None
+
+        counts = {
+            ReportJobStatus.QUEUED: 0,
+            ReportJobStatus.PROCESSING: 0,
+            ReportJobStatus.GENERATED: 0,
+            ReportJobStatus.FAILED: 0,
+        }
+        for batch_id in batch["batch_ids"]:
+            job = self.jobs.get(batch_id)
+            if job:
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+
+        total = max(batch["total"], len(batch["batch_ids"]))
+        return {
+            "appointment_batch_id": appointment_batch_id,
+            "appointment_id": batch["appointment_id"],
+            "status": ReportJobStatus.aggregate(counts, total),
+            "total": total,
+            "counts": counts,
+            "created_at": batch["created_at"],
+        }
+
+    def get_status(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Resolve either a patient job id or an appointment batch id"""
+        self._purge_expired()
+        return self.get_job(batch_id) or self.get_appointment_batch(batch_id)
+
+    async def watch(self, batch_id: str, timeout: float = 15.0) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Yield the status of batch_id every time it changes, and at least every `timeout`
+        seconds (used as a keep-alive). Stops after a finished status has been yielded.
+        """
+        last_snapshot = None
+        while True:
+            version = self._version
+            snapshot = self.get_status(batch_id)
+            if snapshot != last_snapshot or snapshot is None:
+                yield snapshot
+                last_snapshot = snapshot
+            if snapshot and snapshot["status"] in ReportJobStatus.FINISHED:
+                return
+
+            condition = self._condition()
+            try:
+                async with condition:
+                    await asyncio.wait_for(
+                        condition.wait_for(lambda: self._version != version),
+                        timeout=timeout
+                    )
+            except asyncio.TimeoutError:
+                yield last_snapshot
+
+
+async def publish_report_status(
+    batch_id: Optional[str],
+    status: Optional[str],
+    appointment_id: Optional[str] = None,
+    appointment_patient_id: Optional[str] = None,
+    appointment_batch_id: Optional[str] = None,
+    url: Optional[str] = None,
+    error: Optional[str] = None,
+    total: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Broadcast a report job status event and return it. Never raises: status tracking must
+    not break report generation.
+    """
+    event = {
+        "batch_id": batch_id,
+        "status": status,
+        "appointment_id": appointment_id,
+        "appointment_patient_id": appointment_patient_id,
+        "appointment_batch_id": appointment_batch_id,
+        "url": url,
+        "error": error,
+        "total": total,
+        "timestamp": _now_iso(),
+        "instance_id": REPORT_STATUS_INSTANCE_ID,
+    }
+    try:
+        await RabbitMQHelper().publish_fanout(REPORT_STATUS_EXCHANGE, event)
+    except Exception as e:
+        logger.warning(f"Failed to publish report status for {batch_id or appointment_batch_id}: {str(e)}")
+    return event
+
+
+def start_report_status_listener() -> asyncio.Task:
+    """Feed the local ReportJobRegistry from the report status exchange"""
+    registry = ReportJobRegistry()
+
+    async def on_status_event(event: Dict[str, Any]):
+        # Our own events were applied when they were published
+        if event.get("instance_id") == REPORT_STATUS_INSTANCE_ID:
+            return
+        registry.apply_event(event)
+
+    return RabbitMQHelper().subscribe_fanout(REPORT_STATUS_EXCHANGE, on_status_event)
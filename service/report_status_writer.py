@@ -0,0 +1,219 @@
+from config.logging import logger
+from helper.singleton import singleton
+from helper.database import db_postgres
+from helper.metrics import metrics
+from helper.rmq import RabbitMQHelper
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+import os
+import threading
+
+# Pending updates are written once this many are waiting...
+REPORT_STATUS_BATCH_SIZE = int(os.getenv('REPORT_STATUS_BATCH_SIZE', 50))
+# ...or after at most this long
+REPORT_STATUS_FLUSH_SECONDS = float(os.getenv('REPORT_STATUS_FLUSH_SECONDS', 2))
+# Updates that could not be written are queued here as report_status_updates messages, for
+# whichever consumer takes them next (a replacement instance never sees this one's disk)
+REPORT_STATUS_SPOOL_QUEUE = os.getenv('QUEUE_NAME_REPORT_CONSUMER', 'report_generation')
+
+GENERATED_UPDATE_QUERY = """
+UPDATE b2b_bumame_appointment_patient_analysis AS t
+SET examination_status = 'generated',
+    medical_report_url_v2 = v.url,
+    result_issued_at = v.issued_at
+FROM (VALUES %s) AS v(appointment_patient_id, url, issued_at)
+WHERE t.appointment_patient_id = v.appointment_patient_id AND t.is_deleted = 0
+"""
+GENERATED_UPDATE_TEMPLATE = "(%s, %s, %s::timestamptz)"
+
+
+@singleton
+class ReportStatusWriter:
+    """
+    Write-behind buffer for the 'generated' status and URL of finished reports.
+
+    Instead of one UPDATE (pool checkout, SELECT 1, commit) per report, updates are coalesced
+    per patient and written with one `UPDATE ... FROM (VALUES ...)` once REPORT_STATUS_BATCH_SIZE
+    are pending or every REPORT_STATUS_FLUSH_SECONDS.
+
+    - Not started: every update is written immediately (scripts, benchmarks).
+    - start(): batched by a background thread; close() writes what is left and returns what
+      could not be written, for publish_status_updates() to queue.
+    - collect(): nothing is written; render workers drain() their updates and ship them to
+      the consumer process, which merge()s them into its own writer.
+
+    written() gives a future resolved once a patient's update is in the database: the consumer
+    waits on it before it acks the report's message.
+
+    Only 'generated' is deferred: it is a report's final state, so writing it late cannot undo
+    a later change. Moving reports back to 'generating' must happen before they are queued
+    (see PatientService.update_status_to_generating_bulk).
+    """
+
+    def __init__(self):
+        # appointment_patient_id -> [url, issued_at]
+        self.pending: Dict[str, List[str]] = {}
+        # appointment_patient_id -> resolved once its pending update is written
+        self._written: Dict[str, Future] = {}
+        # The batch flush() is writing, with its futures
+        self._flushing: Dict[str, List[str]] = {}
+        self._flushing_written: Dict[str, Future] = {}
+        self.collect_only = False
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def mark_generated(self, appointment_patient_id: str, url: str) -> None:
+        issued_at = datetime.now(timezone.utc).isoformat()
+        self.merge({appointment_patient_id: [url, issued_at]})
+
+    def merge(self, updates: Optional[Dict[str, List[str]]]) -> None:
+        """Add updates (from mark_generated() or a worker's drain()); the latest per patient wins"""
+        if not updates:
+            return
+        with self._lock:
+            self.pending.update(updates)
+            for patient_id in updates:
+                self._written.setdefault(patient_id, Future())
+            pending_count = len(self.pending)
+
+        if self.collect_only:
+            return
+        if self._thread is None:
+            self.flush()
+        elif pending_count >= REPORT_STATUS_BATCH_SIZE:
+            self._wakeup.set()
+
+    def written(self, appointment_patient_id: str) -> Future:
+        """Future resolved once the patient's latest update is written (already resolved if none is waiting)"""
+        with self._lock:
+            future = self._written.get(appointment_patient_id) or self._flushing_written.get(appointment_patient_id)
+        if future is None:
+            future = Future()
+            future.set_result(None)
+        return future
+
+    def withdraw(self, appointment_patient_ids: Iterable[str]) -> Dict[str, List[str]]:
+        """Take these patients' updates out, to be written elsewhere (see publish_status_updates)"""
+        updates = {}
+        futures = []
+        with self._lock:
+            for patient_id in appointment_patient_ids:
+                # Also out of a batch being written, so a failed flush does not put it back
+                value = self.pending.pop(patient_id, None) or self._flushing.pop(patient_id, None)
+                if value:
+                    updates[patient_id] = value
+                futures.append(self._written.pop(patient_id, None))
+                futures.append(self._flushing_written.pop(patient_id, None))
+        for future in futures:
+            if future is not None and not future.done():
+                future.set_result(None)
+        return updates
+
+    def _restore(self, updates: Dict[str, List[str]], written: Dict[str, Future]):
+        """Put back a batch that failed to write, behind anything newer that is pending"""
+        with self._lock:
+            for patient_id, value in updates.items():
+                self.pending.setdefault(patient_id, value)
+            for patient_id, future in written.items():
+                newer = self._written.setdefault(patient_id, future)
+                if newer is not future:
+                    # A newer update of the patient arrived meanwhile: this one is done when it is
+                    newer.add_done_callback(lambda _, future=future: future.done() or future.set_result(None))
+
+    def drain(self) -> Dict[str, List[str]]:
+        """Hand over the pending updates (to the consumer process, or to be queued) and clear them"""
+        with self._lock:
+            updates, self.pending = self.pending, {}
+            written, self._written = self._written, {}
+        for future in written.values():
+            if not future.done():
+                future.set_result(None)
+        return updates
+
+    def flush(self) -> int:
+        """Write pending updates; on failure they are put back and the error is raised"""
+        with self._flush_lock:
+            with self._lock:
+                updates, self.pending = self.pending, {}
+                written, self._written = self._written, {}
+                self._flushing, self._flushing_written = updates, written
+            if not updates:
+                return 0
+            try:
+                db_postgres.execute_values(
+                    GENERATED_UPDATE_QUERY,
+                    [(patient_id, url, issued_at) for patient_id, (url, issued_at) in updates.items()],
+                    template=GENERATED_UPDATE_TEMPLATE,
+                )
+            except Exception as e:
+                logger.error(f"Error writing {len(updates)} report status update(s): {str(e)}")
+                self._restore(updates, written)
+                raise
+            finally:
+                with self._lock:
+                    self._flushing, self._flushing_written = {}, {}
+
+        for future in written.values():
+            if not future.done():
+                future.set_result(None)
+        metrics.inc("report_status_updates_total", value=len(updates), status="generated")
+        logger.info(f"Wrote 'generated' status for {len(updates)} patient(s)")
+        return len(updates)
+
+    def collect(self) -> None:
+        """Keep updates in memory for drain() (render worker processes)"""
+        self.collect_only = True
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(REPORT_STATUS_FLUSH_SECONDS)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # Logged by flush(); the updates stay pending for the next round
+                pass
+
+    def start(self) -> None:
+        """Batch updates in a background thread"""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="report-status-writer", daemon=True)
+        self._thread.start()
+
+    def close(self) -> Dict[str, List[str]]:
+        """
+        Stop the background thread and write what is left. Returns the updates that could not be
+        written, for publish_status_updates() to queue.
+        """
+        if self._thread is not None:
+            self._stopped.set()
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        try:
+            self.flush()
+            return {}
+        except Exception:
+            return self.drain()
+
+
+async def publish_status_updates(updates: Dict[str, List[str]]) -> None:
+    """
+    Queue updates that could not be written as a report_status_updates message, which the
+    next consumer to take it writes (report_consumer.process_report_status_updates)
+    """
+    if not updates:
+        return
+    try:
+        await RabbitMQHelper().publish(REPORT_STATUS_SPOOL_QUEUE, {"type": "report_status_updates", "updates": updates})
+        logger.warning(f"Queued {len(updates)} report status update(s) for a consumer to write")
+    except Exception as e:
+        # Last resort: the updates stay recoverable from the log
+        logger.error(f"Could not queue {len(updates)} report status update(s), they are lost: {updates}: {str(e)}")
+        raise